@@ -0,0 +1,84 @@
+"""Aide à l'affectation d'une commande urgente à une feuille en route.
+
+Les feuilles candidates sont les plus proches du client dans l'état de la
+flotte tenu en mémoire (``livraison.spatial.flotte``, mis à jour à chaque
+position reçue). Pour chacune, le détour est le coût de la meilleure insertion
+du client dans ce qui reste de sa tournée (position actuelle puis arrêts
+restants, lus dans le cache des ETA) : aucune requête SQL tant que ces caches
+sont chauds.
+"""
+from django.db import transaction
+
+from livraison import eta, spatial, suivi
+from livraison.models import Livraison
+
+# Feuilles les plus proches évaluées pour le détour
+NB_CANDIDATES = 10
+
+
+def _meilleure_insertion(client, position, arrets):
+    """Détour minimal (km) pour passer chez ``client`` et rang d'insertion parmi les ``arrets``."""
+    points = [position] + [(lat, lng) for _, _, lat, lng in arrets if lat is not None and lng is not None]
+    meilleur = (spatial.distance_km(*points[-1], *client), len(points) - 1)
+    for i in range(len(points) - 1):
+        detour = (
+            spatial.distance_km(*points[i], *client) + spatial.distance_km(*client, *points[i + 1])
+            - spatial.distance_km(*points[i], *points[i + 1])
+        )
+        if detour < meilleur[0]:
+            meilleur = (detour, i)
+    return meilleur
+
+
+def classer_feuilles(lat, lng, nombre=NB_CANDIDATES):
+    """Feuilles en route les plus proches du point, classées par détour puis distance.
+
+    Renvoie une liste de dicts ``{'feuille_id', 'distance_km', 'detour_km', 'rang', 'restantes'}`` ;
+    ``rang`` est le nombre d'arrêts localisés restants à faire avant le client.
+    """
+    client = (float(lat), float(lng))
+    etat = spatial.flotte()
+    with spatial.flotte.lock:
+        proches = [(distance, pk, etat.index.position(pk)) for distance, pk in etat.plus_proches(*client, k=nombre)]
+    resultats = []
+    for distance, feuille_id, position in proches:
+        donnees = eta.arrets_restants(feuille_id) or {'arrets': []}
+        detour, rang = _meilleure_insertion(client, position, donnees['arrets'])
+        resultats.append({
+            'feuille_id': feuille_id,
+            'distance_km': distance,
+            'detour_km': detour,
+            'rang': rang,
+            'restantes': len(donnees['arrets']),
+        })
+    resultats.sort(key=lambda r: (r['detour_km'], r['distance_km']))
+    return resultats
+
+
+def inserer_livraison(feuille, client, **champs):
+    """Crée la livraison dans ``feuille`` à la place de moindre détour et renumérote l'ordre de passage."""
+    with transaction.atomic():
+        restantes = list(feuille.livraisons.filter(statut='en_cours').select_related('client').select_for_update())
+        restantes.sort(key=lambda l: (l.ordre is None, l.ordre or 0, l.horaire_estime is None, l.horaire_estime, l.pk))
+        position = (
+            (float(feuille.last_latitude), float(feuille.last_longitude))
+            if feuille.last_latitude is not None and feuille.last_longitude is not None else None
+        )
+        localisees = [l for l in restantes if l.client.latitude is not None and l.client.longitude is not None]
+        if position and client.latitude is not None and client.longitude is not None:
+            _, rang = _meilleure_insertion(
+                (float(client.latitude), float(client.longitude)), position,
+                [(l.pk, None, float(l.client.latitude), float(l.client.longitude)) for l in localisees],
+            )
+            # Insérée juste avant le rang-ième arrêt localisé (ou en fin de tournée)
+            index = restantes.index(localisees[rang]) if rang < len(localisees) else len(restantes)
+        else:
+            index = len(restantes)
+
+        premier = min([l.ordre for l in restantes if l.ordre is not None], default=1)
+        for rang, livraison in enumerate(restantes):
+            livraison.ordre = premier + rang + (rang >= index)
+        Livraison.objects.bulk_update(restantes, ['ordre'])
+        # Écriture sans signal : les pages de suivi des autres arrêts affichent leur rang
+        suivi.invalider_livraisons([l.pk for l in restantes])
+        return Livraison.objects.create(feuille=feuille, client=client, ordre=premier + index, **champs)
@@ -0,0 +1,169 @@
+"""Calculs des rapports.
+
+Les jours clos sont lus dans les cumuls journaliers (``livraison.cumuls``) ;
+seuls aujourd'hui, les jours suivants et les feuilles sans date de route sont
+comptés sur les tables brutes. Les deux parts sont additionnées ici.
+"""
+from decimal import Decimal
+from itertools import chain
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from livraison.models import Livraison
+
+LivraisonProduit = Livraison.produits.through
+
+# Colonne des cumuls pour chaque statut de livraison
+COLONNES_STATUT = {'en_cours': 'nb_en_cours', 'livre': 'nb_livre', 'probleme': 'nb_probleme'}
+STATUTS_FEUILLE = ('planifie', 'en_route', 'terminee', 'probleme')
+
+# Montant d'une ligne livraison/produit : prix unitaire × quantité livrée
+MONTANT_LIGNE = ExpressionWrapper(
+    F('produit__prix_unitaire') * F('livraison__quantite'),
+    output_field=DecimalField(max_digits=14, decimal_places=2),
+)
+
+CENTIMES = Decimal('0.01')
+
+
+def montant_livraison():
+    """Sous-requête à annoter sur un queryset Livraison : montant total de ses produits."""
+    montants = LivraisonProduit.objects.filter(livraison=OuterRef('pk')).values('livraison').annotate(
+        montant=Sum(MONTANT_LIGNE)
+    ).values('montant')
+    return Subquery(montants, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def jours_ouverts(queryset, champ='date_route'):
+    """Restreint un queryset brut à ce que les cumuls ne couvrent pas : aujourd'hui et après, et sans date."""
+    return queryset.filter(Q(**{f'{champ}__gte': timezone.localdate()}) | Q(**{f'{champ}__isnull': True}))
+
+
+def jours_clos(cumuls, date_debut=None, date_fin=None, chauffeur_id=None):
+    """Cumuls journaliers de la période, jusqu'à hier."""
+    cumuls = cumuls.filter(date__lt=timezone.localdate())
+    if date_debut:
+        cumuls = cumuls.filter(date__gte=date_debut)
+    if date_fin:
+        cumuls = cumuls.filter(date__lte=date_fin)
+    if chauffeur_id:
+        cumuls = cumuls.filter(chauffeur_id=chauffeur_id)
+    return cumuls
+
+
+def _additionner(lignes, cles):
+    """Additionne les compteurs des lignes de même clé ; écarte les totaux nuls, trie par total décroissant."""
+    fusion = {}
+    for ligne in lignes:
+        cle = tuple(ligne[c] for c in cles)
+        if cle in fusion:
+            for champ, valeur in ligne.items():
+                if champ not in cles:
+                    fusion[cle][champ] += valeur
+        else:
+            fusion[cle] = dict(ligne)
+    return sorted((l for l in fusion.values() if l['total']), key=lambda l: -l['total'])
+
+
+def statistiques_livraisons(livraisons, cumuls, statut=None):
+    """Compteurs total/livre/probleme par chauffeur et par véhicule.
+
+    ``livraisons`` : livraisons brutes des jours ouverts, déjà filtrées ;
+    ``cumuls`` : cumuls des jours clos. Le statut de livraison filtré choisit
+    les colonnes des cumuls qui comptent.
+    """
+    colonnes = {s: c for s, c in COLONNES_STATUT.items() if not statut or s == statut}
+    compteurs = {
+        'total': Count('id'),
+        'livre': Count('id', filter=Q(statut='livre')),
+        'probleme': Count('id', filter=Q(statut='probleme')),
+    }
+    groupes = {
+        'chauffeur': ('chauffeur__user__first_name', 'chauffeur__user__last_name'),
+        'vehicule': ('vehicule__marque', 'vehicule__modele', 'vehicule__immatriculation'),
+    }
+    resultat = {}
+    for groupe, champs in groupes.items():
+        cles = [f'feuille__{champ}' for champ in champs]
+        lignes = list(livraisons.values(*cles).annotate(**compteurs).order_by())
+        sommes = cumuls.values(*champs).annotate(**{c: Sum(c) for c in COLONNES_STATUT.values()}).order_by()
+        for somme in sommes:
+            lignes.append({
+                **{f'feuille__{champ}': somme[champ] for champ in champs},
+                'total': sum(somme[c] for c in colonnes.values()),
+                'livre': somme['nb_livre'] if 'livre' in colonnes else 0,
+                'probleme': somme['nb_probleme'] if 'probleme' in colonnes else 0,
+            })
+        resultat[groupe] = _additionner(lignes, cles)
+    return resultat['chauffeur'], resultat['vehicule']
+
+
+def statistiques_feuilles(feuilles, cumuls):
+    """Répartition des feuilles par statut et par chauffeur (feuilles brutes des jours ouverts + cumuls)."""
+    par_statut = list(feuilles.values('statut').annotate(
+        total=Count('id', distinct=True),
+        total_livraisons=Count('livraisons'),
+        livraisons_livrees=Count('livraisons', filter=Q(livraisons__statut='livre')),
+        livraisons_probleme=Count('livraisons', filter=Q(livraisons__statut='probleme')),
+    ).order_by())
+    for somme in cumuls.values('statut').annotate(
+        total=Sum('nb_feuilles'), en_cours=Sum('nb_en_cours'), livre=Sum('nb_livre'), probleme=Sum('nb_probleme'),
+    ).order_by():
+        par_statut.append({
+            'statut': somme['statut'],
+            'total': somme['total'],
+            'total_livraisons': somme['en_cours'] + somme['livre'] + somme['probleme'],
+            'livraisons_livrees': somme['livre'],
+            'livraisons_probleme': somme['probleme'],
+        })
+
+    cles = ['chauffeur__user__first_name', 'chauffeur__user__last_name']
+    par_chauffeur = chain(
+        feuilles.values(*cles).annotate(
+            total=Count('id'), **{s: Count('id', filter=Q(statut=s)) for s in STATUTS_FEUILLE}
+        ).order_by(),
+        cumuls.values(*cles).annotate(
+            total=Sum('nb_feuilles'),
+            **{s: Coalesce(Sum('nb_feuilles', filter=Q(statut=s)), 0) for s in STATUTS_FEUILLE},
+        ).order_by(),
+    )
+    return (
+        sorted(_additionner(par_statut, ['statut']), key=lambda l: l['statut']),
+        _additionner(par_chauffeur, cles),
+    )
+
+
+def analyse_produits(livraisons, cumuls_produits=None):
+    """Quantité et montant par produit pour les livraisons données, en une requête groupée.
+
+    ``cumuls_produits`` : quantités des jours clos à ajouter, valorisées au prix
+    unitaire actuel comme les livraisons brutes. Renvoie un dict {nom du
+    produit: {'quantite', 'montant', 'prix_unitaire'}} trié par montant décroissant.
+    """
+    lignes = LivraisonProduit.objects.filter(livraison__in=livraisons.values('pk')).values(
+        'produit_id', 'produit__nom', 'produit__prix_unitaire'
+    ).annotate(
+        quantite=Sum('livraison__quantite'),
+        montant=Sum(MONTANT_LIGNE),
+    ).order_by()
+    if cumuls_produits is not None:
+        ventes = cumuls_produits.values('produit_id', 'produit__nom', 'produit__prix_unitaire').annotate(
+            quantite_livree=Sum('quantite'),
+        ).order_by()
+        lignes = chain(lignes, (
+            {**v, 'quantite': v['quantite_livree'], 'montant': v['produit__prix_unitaire'] * v['quantite_livree']}
+            for v in ventes
+        ))
+
+    analyse = {}
+    for ligne in lignes:
+        stats = analyse.setdefault(ligne['produit__nom'], {
+            'quantite': 0,
+            'montant': Decimal('0'),
+            'prix_unitaire': ligne['produit__prix_unitaire'],
+        })
+        stats['quantite'] += ligne['quantite']
+        stats['montant'] += Decimal(ligne['montant']).quantize(CENTIMES)
+    return dict(sorted(analyse.items(), key=lambda item: (-item[1]['montant'], item[0])))
@@ -1,3 +1,448 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from admin_dashboard import dispatch, reporting
+from livraison import pagination, positions, spatial
+from livraison.diffusion import SUJET_FLOTTE, diffuseur, evenement_sse
+from livraison.models import Chauffeur, Client, FeuilleDeRoute, Livraison, Produit
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DashboardTodayTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        user = User.objects.create_user('pierre', first_name='Pierre', last_name='Martin')
+        self.chauffeur = Chauffeur.objects.create(user=user, telephone='0600000000')
+        self.client_livre = Client.objects.create(nom='Client A', adresse='1 rue A', telephone='01')
+
+    def creer_feuille(self, statuts):
+        feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, date_route=timezone.localdate())
+        for i, statut in enumerate(statuts):
+            Livraison.objects.create(
+                feuille=feuille, client=self.client_livre,
+                reference_commande=f'CMD-{feuille.pk}-{i}', statut=statut,
+            )
+        return feuille
+
+    def test_status_summary_counts_and_color(self):
+        rouge = self.creer_feuille(['livre', 'probleme', 'en_cours'])
+        verte = self.creer_feuille(['livre', 'livre'])
+        orange = self.creer_feuille(['livre', 'en_cours'])
+        vide = self.creer_feuille([])
+
+        feuilles = {f.pk: f for f in FeuilleDeRoute.objects.with_status_summary()}
+
+        self.assertEqual(
+            feuilles[rouge.pk].status_summary,
+            {'total': 3, 'livre': 1, 'probleme': 1, 'en_cours': 1, 'color': 'red'},
+        )
+        self.assertEqual(feuilles[verte.pk].status_summary['color'], 'green')
+        self.assertEqual(feuilles[orange.pk].status_summary['color'], 'orange')
+        self.assertEqual(feuilles[vide.pk].status_summary['total'], 0)
+        self.assertEqual(feuilles[vide.pk].status_summary['color'], 'orange')
+
+    def test_dashboard_query_count_does_not_grow_with_feuilles(self):
+        self.creer_feuille(['livre', 'probleme'])
+        with CaptureQueriesContext(connection) as une_feuille:
+            self.client.get(reverse('admin_dashboard:index'))
+
+        for _ in range(10):
+            self.creer_feuille(['livre', 'en_cours', 'probleme'])
+        with CaptureQueriesContext(connection) as onze_feuilles:
+            response = self.client.get(reverse('admin_dashboard:index'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['feuilles']), 11)
+        self.assertEqual(len(onze_feuilles), len(une_feuille))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ExportCsvTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('admin', password='x', is_staff=True)
+        self.client.force_login(self.staff)
+        user = User.objects.create_user('paul')
+        self.chauffeur = Chauffeur.objects.create(user=user, telephone='0600000001')
+        client = Client.objects.create(nom='Client B', adresse='2 rue B', telephone='02')
+        produit_a = Produit.objects.create(nom='Eau', prix_unitaire=Decimal('500.00'))
+        produit_b = Produit.objects.create(nom='Riz', prix_unitaire=Decimal('1500.00'))
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, date_route=date(2025, 3, 10))
+        livraison = Livraison.objects.create(
+            feuille=self.feuille, client=client, reference_commande='CMD-1', quantite=2, statut='livre',
+        )
+        livraison.produits.set([produit_a, produit_b])
+        Livraison.objects.create(feuille=self.feuille, client=client, reference_commande='CMD-2', statut='probleme')
+        autre = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, date_route=date(2025, 1, 5))
+        Livraison.objects.create(feuille=autre, client=client, reference_commande='CMD-3')
+
+    def lire_csv(self, response):
+        self.assertTrue(response.streaming)
+        contenu = b''.join(response.streaming_content).decode()
+        return list(csv.reader(io.StringIO(contenu)))
+
+    def test_export_livraisons_montant_et_filtres(self):
+        response = self.client.get(reverse('admin_dashboard:export_csv_livraisons'), {
+            'date_debut': '2025-03-01', 'statut': 'livre',
+        })
+        lignes = self.lire_csv(response)
+        self.assertEqual(len(lignes), 2)
+        self.assertEqual(lignes[1][5], 'CMD-1')
+        self.assertEqual(lignes[1][10], '4000.00 FCFA')
+
+    def test_export_feuilles_compteurs(self):
+        response = self.client.get(reverse('admin_dashboard:export_csv_feuilles_route'), {
+            'date_debut': '2025-03-01',
+        })
+        lignes = self.lire_csv(response)
+        self.assertEqual(len(lignes), 2)
+        self.assertEqual(lignes[1][0], str(self.feuille.pk))
+        self.assertEqual(lignes[1][5:8], ['2', '1', '1'])
+
+    def test_analyse_produits_concorde_avec_export(self):
+        analyse = reporting.analyse_produits(Livraison.objects.filter(statut='livre'))
+        self.assertEqual(list(analyse), ['Riz', 'Eau'])
+        self.assertEqual(analyse['Riz'], {
+            'quantite': 2, 'montant': Decimal('3000.00'), 'prix_unitaire': Decimal('1500.00'),
+        })
+        montant_export = Livraison.objects.annotate(
+            montant_total=reporting.montant_livraison()
+        ).get(reference_commande='CMD-1').montant_total
+        self.assertEqual(montant_export, sum(stats['montant'] for stats in analyse.values()))
+
+    def test_banc_export(self):
+        sortie = io.StringIO()
+
+        call_command('banc_export', lignes=[30, 50], par_feuille=7, stdout=sortie)
+
+        self.assertIn('30 livraison(s),       5 feuille(s) exportée(s)', sortie.getvalue())
+        self.assertIn('50 livraison(s),       8 feuille(s) exportée(s)', sortie.getvalue())
+        # Données du banc annulées
+        self.assertEqual(Livraison.objects.count(), 3)
+        self.assertEqual(FeuilleDeRoute.objects.count(), 2)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Plans d'exécution au format SQLite")
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PlansRequetesTests(TestCase):
+    """Les requêtes exécutées par le tableau de bord et les rapports doivent passer par un index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        client = Client.objects.create(nom='Client F', adresse='6 rue F', telephone='06')
+        cls.chauffeurs = [
+            Chauffeur.objects.create(user=User.objects.create_user(f'chauffeur{i}'), telephone='07')
+            for i in range(10)
+        ]
+        # Jours clos et jours ouverts : les rapports lisent les deux parts
+        cls.aujourdhui = timezone.localdate()
+        debut = cls.aujourdhui - timedelta(days=30)
+        feuilles = FeuilleDeRoute.objects.bulk_create([
+            FeuilleDeRoute(chauffeur=chauffeur, date_route=debut + timedelta(days=jour), statut='en_route')
+            for jour in range(60) for chauffeur in cls.chauffeurs
+        ])
+        Livraison.objects.bulk_create([
+            Livraison(feuille=feuille, client=client, reference_commande='CMD', statut=statut,
+                      date_livraison=timezone.now() + (feuille.date_route - cls.aujourdhui) if statut == 'livre' else None)
+            for feuille in feuilles for statut in ('livre', 'en_cours', 'probleme')
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True, is_superuser=True))
+
+    def plans(self, url):
+        """Plans d'exécution des SELECT sur les feuilles ou les livraisons exécutés par la vue."""
+        with CaptureQueriesContext(connection) as requetes:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        plans = {}
+        with connection.cursor() as cursor:
+            for requete in requetes.captured_queries:
+                sql = requete['sql']
+                if sql.startswith('SELECT') and ('"livraison_feuillederoute"' in sql or '"livraison_livraison"' in sql):
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plans[sql] = '\n'.join(ligne[-1] for ligne in cursor.fetchall())
+        self.assertTrue(plans)
+        return plans
+
+    def assertRecherchesIndexees(self, url, *index):
+        plans = self.plans(url)
+        for sql, plan in plans.items():
+            for table in ('livraison_feuillederoute', 'livraison_livraison'):
+                self.assertNotIn(f'SCAN {table}', plan, sql)
+        tous = '\n'.join(plans.values())
+        for nom in index:
+            self.assertIn(nom, tous)
+        return plans
+
+    def periode(self, **params):
+        return {
+            'date_debut': self.aujourdhui - timedelta(days=5),
+            'date_fin': self.aujourdhui + timedelta(days=5),
+            **params,
+        }
+
+    def test_dashboard_today(self):
+        url = reverse('admin_dashboard:index')
+        self.assertRecherchesIndexees(url, 'feuille_date_chauffeur_idx', 'livraison_feuille_statut_idx')
+        self.assertRecherchesIndexees(f'{url}?chauffeur={self.chauffeurs[0].pk}', 'livraison_feuille_statut_idx')
+        self.assertRecherchesIndexees(f'{url}?statut=en_route', 'feuille_date_statut_idx', 'livraison_feuille_statut_idx')
+
+    def test_rapport_livraisons(self):
+        url = reverse('admin_dashboard:rapport_livraisons')
+        self.assertRecherchesIndexees(f'{url}?{urlencode(self.periode())}',
+                                      'feuille_date_chauffeur_idx', 'livraison_feuille_statut_idx')
+        self.assertRecherchesIndexees(f'{url}?{urlencode(self.periode(statut="livre"))}', 'livraison_feuille_statut_idx')
+
+    def test_rapport_feuilles_route(self):
+        url = reverse('admin_dashboard:rapport_feuilles_route')
+        self.assertRecherchesIndexees(f'{url}?{urlencode(self.periode(statut="en_route"))}',
+                                      'feuille_date_statut_idx', 'livraison_feuille_statut_idx')
+
+    def test_page_suivante_indexee(self):
+        url = reverse('admin_dashboard:rapport_feuilles_route')
+        plans = self.assertRecherchesIndexees(f'{url}?{urlencode(self.periode(apres=f"{self.aujourdhui}.300"))}')
+        pages = [plan for sql, plan in plans.items() if ' LIMIT ' in sql]
+        self.assertTrue(pages)
+        for plan in pages:
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_filtre_admin_date_livraison(self):
+        plans = self.plans('/admin/livraison/livraison/?' + urlencode({'date_livraison__gte': timezone.now().isoformat()}))
+        self.assertIn('livraison_date_idx', '\n'.join(plans.values()))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POSITIONS_INTERVALLE_ECRITURE_S=0)
+class CarteFlotteTests(TestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('paul'), telephone='08')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur, date_route=timezone.localdate())
+
+    def test_carte_positions_initiales(self):
+        FeuilleDeRoute.objects.filter(pk=self.feuille.pk).update(
+            last_latitude=Decimal('5.345317'), last_longitude=Decimal('-4.024429'), last_position_at=timezone.now(),
+        )
+        response = self.client.get(reverse('admin_dashboard:carte_flotte'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['positions']), 1)
+        self.assertEqual(response.context['positions'][0]['lat'], 5.345317)
+        self.assertContains(response, reverse('admin_dashboard:flux_flotte'))
+
+    def test_position_publiee_apres_commit(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        flux = diffuseur.ecouter(SUJET_FLOTTE, keepalive=5)
+        attente = loop.create_task(flux.__anext__())
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(diffuseur.nombre_abonnes(SUJET_FLOTTE), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('livraison:update_position', args=[self.feuille.token]), {'lat': '5.3', 'lng': '-4.0'},
+            )
+        sujet, message = loop.run_until_complete(attente)
+        loop.run_until_complete(flux.aclose())
+
+        self.assertEqual(sujet, SUJET_FLOTTE)
+        self.assertEqual(message['feuille'], self.feuille.pk)
+        self.assertEqual(message['lat'], 5.3)
+        self.assertEqual(diffuseur.nombre_abonnes(SUJET_FLOTTE), 0)
+
+    def test_evenement_sse(self):
+        self.assertEqual(evenement_sse(None), ': keepalive\n\n')
+        self.assertEqual(evenement_sse({'feuille': 1}, event='position'), 'event: position\ndata: {"feuille": 1}\n\n')
+
+
+class DispatchUrgentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        spatial.flotte.reinitialiser()
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('paul'), telephone='08')
+        # Deux feuilles en route : la plus proche du client va dans l'autre sens
+        self.proche = FeuilleDeRoute.objects.create(
+            chauffeur=chauffeur, statut='en_route', last_latitude=Decimal('5.30'), last_longitude=Decimal('-4.00'),
+        )
+        self.alignee = FeuilleDeRoute.objects.create(
+            chauffeur=chauffeur, statut='en_route', last_latitude=Decimal('5.00'), last_longitude=Decimal('-4.00'),
+        )
+        self.urgent = Client.objects.create(
+            nom='Urgent', adresse='x', telephone='01', latitude=Decimal('5.20'), longitude=Decimal('-4.00'),
+        )
+        self._arret(self.proche, 5.60, 1)
+        self.a1 = self._arret(self.alignee, 5.10, 1)
+        self.a2 = self._arret(self.alignee, 5.30, 2)
+
+    def _arret(self, feuille, lat, ordre):
+        client = Client.objects.create(
+            nom=f'C{lat}', adresse='x', telephone='02', latitude=Decimal(str(lat)), longitude=Decimal('-4.00'),
+        )
+        return Livraison.objects.create(feuille=feuille, client=client, reference_commande=f'R{lat}', ordre=ordre)
+
+    def test_classement_par_detour(self):
+        classement = dispatch.classer_feuilles(5.20, -4.00)
+        self.assertEqual([r['feuille_id'] for r in classement], [self.alignee.pk, self.proche.pk])
+        self.assertAlmostEqual(classement[0]['detour_km'], 0, places=3)
+        self.assertEqual((classement[0]['rang'], classement[0]['restantes']), (1, 2))
+        self.assertLess(classement[1]['distance_km'], classement[0]['distance_km'])
+
+    def test_insertion_renumerote(self):
+        livraison = dispatch.inserer_livraison(self.alignee, self.urgent, reference_commande='URG')
+        ordres = dict(self.alignee.livraisons.values_list('pk', 'ordre'))
+        self.assertEqual(ordres, {self.a1.pk: 1, livraison.pk: 2, self.a2.pk: 3})
+
+    def test_post_cree_la_livraison(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin_dashboard:dispatch'), {
+                'client': self.urgent.pk, 'feuille': self.alignee.pk, 'reference_commande': 'URG', 'quantite': '2',
+            })
+        livraison = Livraison.objects.get(reference_commande='URG')
+        self.assertRedirects(
+            response, f"{reverse('admin_dashboard:dispatch')}?client={self.urgent.pk}&inseree={livraison.pk}",
+        )
+        self.assertEqual((livraison.feuille, livraison.quantite, livraison.ordre), (self.alignee, 2, 2))
+
+    def test_parametres_non_numeriques(self):
+        url = reverse('admin_dashboard:dispatch')
+        self.assertEqual(self.client.get(url, {'client': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'client': self.urgent.pk, 'inseree': 'x'}).status_code, 200)
+        response = self.client.post(url, {'client': self.urgent.pk, 'feuille': 'abc', 'reference_commande': 'URG'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['erreur'], "Choisissez une feuille de route.")
+        self.assertFalse(Livraison.objects.filter(reference_commande='URG').exists())
+
+    def test_insertion_change_les_pages_de_suivi(self):
+        url = reverse('livraison:track', args=[self.a2.public_token])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch.inserer_livraison(self.alignee, self.urgent, reference_commande='URG')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_reponse_json(self):
+        response = self.client.get(
+            reverse('admin_dashboard:dispatch'), {'client': self.urgent.pk}, HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual(response.json()['feuilles'][0]['feuille_id'], self.alignee.pk)
+
+    def test_page_classement(self):
+        response = self.client.get(reverse('admin_dashboard:dispatch'), {'client': self.urgent.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['classement'][0]['feuille'], self.alignee)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RapportsCumulsTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        self.chauffeur = Chauffeur.objects.create(user=User.objects.create_user('paul', first_name='Paul'), telephone='08')
+        self.produit = Produit.objects.create(nom='Riz', prix_unitaire=Decimal('10.00'))
+        client = Client.objects.create(nom='Client R', adresse='x', telephone='01')
+        aujourdhui = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            for jour, statut_feuille, statuts in (
+                (aujourdhui - timedelta(days=2), 'terminee', ('livre', 'livre', 'probleme')),
+                (aujourdhui - timedelta(days=1), 'terminee', ('livre',)),
+                (aujourdhui, 'en_route', ('livre', 'en_cours')),
+            ):
+                feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, date_route=jour, statut=statut_feuille)
+                for statut in statuts:
+                    livraison = Livraison.objects.create(
+                        feuille=feuille, client=client, reference_commande='R', quantite=2, statut=statut,
+                    )
+                    livraison.produits.add(self.produit)
+        # Jours clos lus dans les cumuls : une écriture sans signal sur les lignes brutes n'y change rien
+        Livraison.objects.filter(feuille__date_route__lt=aujourdhui).update(statut='en_cours')
+
+    def test_rapport_livraisons(self):
+        response = self.client.get(reverse('admin_dashboard:rapport_livraisons'))
+        self.assertEqual(response.context['total_livraisons'], 6)
+        self.assertEqual(response.context['livraisons_livrees'], 4)
+        self.assertEqual(response.context['livraisons_probleme'], 1)
+        self.assertEqual(response.context['stats_chauffeur'], [{
+            'feuille__chauffeur__user__first_name': 'Paul', 'feuille__chauffeur__user__last_name': '',
+            'total': 6, 'livre': 4, 'probleme': 1,
+        }])
+        self.assertEqual(response.context['analyse_produits']['Riz']['quantite'], 8)
+        self.assertEqual(response.context['analyse_produits']['Riz']['montant'], Decimal('80.00'))
+
+        response = self.client.get(reverse('admin_dashboard:rapport_livraisons'), {'statut': 'probleme'})
+        self.assertEqual((response.context['total_livraisons'], response.context['livraisons_probleme']), (1, 1))
+        self.assertEqual(response.context['analyse_produits'], {})
+
+    def test_rapport_feuilles_route(self):
+        response = self.client.get(reverse('admin_dashboard:rapport_feuilles_route'))
+        self.assertEqual(response.context['total_feuilles'], 3)
+        self.assertEqual(
+            [(s['statut'], s['total'], s['total_livraisons'], s['livraisons_livrees']) for s in response.context['stats_statut']],
+            [('en_route', 1, 2, 1), ('terminee', 2, 4, 3)],
+        )
+        stat, = response.context['stats_chauffeur']
+        self.assertEqual((stat['total'], stat['en_route'], stat['terminee'], stat['planifie']), (3, 1, 2, 0))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PaginationRapportsTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('paul'), telephone='08')
+        client = Client.objects.create(nom='Client P', adresse='x', telephone='01')
+        jour = timezone.localdate()
+        self.feuilles = [
+            FeuilleDeRoute.objects.create(chauffeur=chauffeur, date_route=date_route)
+            for date_route in (jour, jour - timedelta(days=1), jour, None, jour - timedelta(days=1))
+        ]
+        for feuille in self.feuilles:
+            Livraison.objects.create(feuille=feuille, client=client, reference_commande='P', statut='livre')
+
+    def test_pages_par_cle(self):
+        attendu = [self.feuilles[i].pk for i in (2, 0, 4, 1, 3)]
+        lues, curseur = [], None
+        while True:
+            lignes, curseur = pagination.page(FeuilleDeRoute.objects.all(), curseur, taille=2)
+            lues += [f.pk for f in lignes]
+            if curseur is None:
+                break
+        self.assertEqual(lues, attendu)
+        self.assertIsNone(pagination.lire_curseur('pas-un-curseur'))
+
+    def test_rapport_feuilles_route_pagine(self):
+        response = self.client.get(reverse('admin_dashboard:rapport_feuilles_route'), {'date_debut': '', 'date_fin': ''})
+        self.assertEqual(len(response.context['feuilles']), 5)
+        self.assertEqual(response.context['feuilles'][0].nb_livre, 1)
+        self.assertIsNone(response.context['page_suivante'])
+        self.assertIsNone(response.context['premiere_page'])
+
+        curseur = pagination.ecrire_curseur(self.feuilles[0].date_route, self.feuilles[0].pk)
+        response = self.client.get(reverse('admin_dashboard:rapport_feuilles_route'), {'apres': curseur, 'statut': ''})
+        self.assertEqual([f.pk for f in response.context['feuilles']], [self.feuilles[4].pk, self.feuilles[1].pk])
+        self.assertEqual(response.context['premiere_page'], '?statut=')
+
+    def test_rapport_livraisons_pagine(self):
+        curseur = pagination.ecrire_curseur(None, Livraison.objects.get(feuille=self.feuilles[3]).pk + 1)
+        response = self.client.get(reverse('admin_dashboard:rapport_livraisons'), {'date_debut': '', 'date_fin': '', 'apres': curseur})
+        self.assertEqual([l.feuille_id for l in response.context['livraisons']], [self.feuilles[3].pk])
@@ -5,6 +5,9 @@ app_name = 'admin_dashboard'
 
 urlpatterns = [
     path('', views.dashboard_today, name='index'),
+    path('carte/', views.carte_flotte, name='carte_flotte'),
+    path('carte/flux/', views.flux_flotte, name='flux_flotte'),
+    path('dispatch/', views.dispatch_urgent, name='dispatch'),
     path('rapport-livraisons/', views.rapport_livraisons, name='rapport_livraisons'),
     path('rapport-feuilles-route/', views.rapport_feuilles_route, name='rapport_feuilles_route'),
     path('export-csv-livraisons/', views.export_csv_livraisons, name='export_csv_livraisons'),
@@ -1,15 +1,23 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
-from django.http import HttpResponse
-from django.db.models import Count, Sum, Q
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib.admin.views.decorators import staff_member_required
-from livraison.models import FeuilleDeRoute, Livraison, Produit, Chauffeur, Vehicule
+from livraison.models import (
+    Client, CumulJournalier, CumulProduitJournalier, FeuilleDeRoute, Livraison, Produit, Chauffeur, Vehicule,
+)
+from livraison import eta, pagination
+from livraison.diffusion import SUJET_FLOTTE, diffuseur, evenement_sse
+from . import dispatch, reporting
 from datetime import datetime, timedelta
 import csv
 
+# Nombre de lignes lues par aller-retour SQL lors des exports CSV
+EXPORT_CHUNK_SIZE = 2000
+
 def dashboard_today(request):
     today = timezone.localdate()
-    qs = FeuilleDeRoute.objects.select_related('chauffeur__user', 'vehicule').prefetch_related('livraisons')
+    qs = FeuilleDeRoute.objects.select_related('chauffeur__user', 'vehicule')
     date_filter = request.GET.get('date') or today.isoformat()
     qs = qs.filter(date_route=date_filter) if request.GET.get('date') else qs.filter(date_route=today)
 
@@ -24,21 +32,133 @@ def dashboard_today(request):
     if vehicule:
         qs = qs.filter(vehicule__immatriculation__icontains=vehicule)
 
-    def feuille_status_summary(f):
-        total = f.livraisons.count()
-        livre = f.livraisons.filter(statut='livre').count()
-        probleme = f.livraisons.filter(statut='probleme').count()
-        en_cours = total - livre - probleme
-        if probleme > 0:
-            color = 'red'
-        elif livre == total and total > 0:
-            color = 'green'
+    qs = qs.with_status_summary()
+    feuilles = [(f, f.status_summary) for f in qs.order_by('chauffeur__user__last_name', 'id')]
+    # ETA calculées à l'arrivée des positions : simple lecture du cache
+    arrivees = eta.prochaines_arrivees([f.pk for f, _ in feuilles])
+    for f, _ in feuilles:
+        f.prochaine_arrivee = arrivees.get(f.pk)
+    return render(request, 'admin_dashboard/dashboard.html', {'feuilles': feuilles, 'date_filter': date_filter})
+
+@staff_member_required
+def carte_flotte(request):
+    """Carte des feuilles de route du jour, mise à jour en direct par le flux SSE."""
+    feuilles = FeuilleDeRoute.objects.filter(
+        date_route=timezone.localdate(), last_latitude__isnull=False, last_longitude__isnull=False,
+    ).select_related('chauffeur__user', 'vehicule').order_by('id')
+    positions = [{
+        'feuille': f.id,
+        'chauffeur': f.chauffeur.user.get_full_name() or f.chauffeur.user.username,
+        'vehicule': f.vehicule.immatriculation if f.vehicule else '',
+        'statut': f.get_statut_display(),
+        'lat': float(f.last_latitude),
+        'lng': float(f.last_longitude),
+        'date': f.last_position_at,
+    } for f in feuilles]
+    return render(request, 'admin_dashboard/carte_flotte.html', {'positions': positions})
+
+@staff_member_required
+async def flux_flotte(request):
+    """Flux server-sent events des positions publiées par livraison.views (nécessite un serveur ASGI)."""
+    async def evenements():
+        yield 'retry: 5000\n\n'
+        async for recu in diffuseur.ecouter(SUJET_FLOTTE):
+            yield evenement_sse(recu and recu[1], event='position')
+
+    response = StreamingHttpResponse(evenements(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _identifiant(valeur):
+    """Clé primaire passée en paramètre, ou None si elle n'est pas un entier."""
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        return None
+
+@staff_member_required
+def dispatch_urgent(request):
+    """Classe les feuilles en route pour une commande urgente et l'insère dans la feuille choisie."""
+    client = None
+    if request.method == 'POST' or request.GET.get('client'):
+        client_id = _identifiant(request.POST.get('client') or request.GET.get('client'))
+        if client_id is None:
+            return HttpResponseBadRequest("Client invalide.")
+        client = get_object_or_404(Client, pk=client_id)
+
+    erreur = None
+    if request.method == 'POST':
+        feuille_id = _identifiant(request.POST.get('feuille'))
+        reference = request.POST.get('reference_commande', '').strip()
+        try:
+            quantite = int(request.POST.get('quantite') or 1)
+        except ValueError:
+            quantite = 0
+        if feuille_id is None:
+            erreur = "Choisissez une feuille de route."
+        elif not reference or quantite < 1:
+            erreur = "Référence de commande et quantité (au moins 1) obligatoires."
         else:
-            color = 'orange'
-        return {'total': total, 'livre': livre, 'probleme': probleme, 'en_cours': en_cours, 'color': color}
+            feuille = get_object_or_404(FeuilleDeRoute, pk=feuille_id, statut='en_route')
+            livraison = dispatch.inserer_livraison(
+                feuille, client, reference_commande=reference[:50], quantite=quantite,
+                notes=request.POST.get('notes', '').strip(),
+            )
+            return redirect(f"{reverse('admin_dashboard:dispatch')}?client={client.pk}&inseree={livraison.pk}")
 
-    feuilles = [(f, feuille_status_summary(f)) for f in qs.order_by('chauffeur__user__last_name', 'id')]
-    return render(request, 'admin_dashboard/dashboard.html', {'feuilles': feuilles, 'date_filter': date_filter})
+    classement = []
+    if client is not None and client.latitude is not None and client.longitude is not None:
+        classement = dispatch.classer_feuilles(client.latitude, client.longitude)
+        if 'application/json' in request.headers.get('Accept', ''):
+            return JsonResponse({'client': client.pk, 'feuilles': classement})
+        feuilles = FeuilleDeRoute.objects.select_related('chauffeur__user', 'vehicule').in_bulk(
+            [r['feuille_id'] for r in classement]
+        )
+        classement = [{**r, 'feuille': feuilles[r['feuille_id']]} for r in classement if r['feuille_id'] in feuilles]
+
+    recherche = request.GET.get('q', '').strip()
+    clients = Client.objects.filter(nom__icontains=recherche).order_by('nom')[:20] if recherche else []
+    inseree = _identifiant(request.GET.get('inseree'))
+    context = {
+        'client': client,
+        'classement': classement,
+        'recherche': recherche,
+        'clients': clients,
+        'erreur': erreur,
+        'inseree': Livraison.objects.select_related('feuille__chauffeur__user').filter(pk=inseree).first() if inseree is not None else None,
+    }
+    return render(request, 'admin_dashboard/dispatch.html', context)
+
+def filtrer_livraisons(livraisons, date_debut=None, date_fin=None, chauffeur_id=None, statut=None):
+    if date_debut:
+        livraisons = livraisons.filter(feuille__date_route__gte=date_debut)
+    if date_fin:
+        livraisons = livraisons.filter(feuille__date_route__lte=date_fin)
+    if chauffeur_id:
+        livraisons = livraisons.filter(feuille__chauffeur_id=chauffeur_id)
+    if statut:
+        livraisons = livraisons.filter(statut=statut)
+    return livraisons
+
+def filtrer_feuilles(feuilles, date_debut=None, date_fin=None, chauffeur_id=None, statut=None):
+    if date_debut:
+        feuilles = feuilles.filter(date_route__gte=date_debut)
+    if date_fin:
+        feuilles = feuilles.filter(date_route__lte=date_fin)
+    if chauffeur_id:
+        feuilles = feuilles.filter(chauffeur_id=chauffeur_id)
+    if statut:
+        feuilles = feuilles.filter(statut=statut)
+    return feuilles
+
+def _url_page(request, curseur):
+    """Lien vers la page qui commence après ``curseur`` (la première si None), filtres conservés."""
+    params = request.GET.copy()
+    params.pop('apres', None)
+    if curseur:
+        params['apres'] = curseur
+    return f'?{params.urlencode()}'
 
 @staff_member_required
 def rapport_livraisons(request):
@@ -54,58 +174,27 @@ def rapport_livraisons(request):
         'feuille__vehicule', 
         'client'
     ).prefetch_related('produits', 'sacs')
+    livraisons = filtrer_livraisons(livraisons, date_debut, date_fin, chauffeur_id, statut)
     
-    if date_debut:
-        livraisons = livraisons.filter(feuille__date_route__gte=date_debut)
-    if date_fin:
-        livraisons = livraisons.filter(feuille__date_route__lte=date_fin)
-    if chauffeur_id:
-        livraisons = livraisons.filter(feuille__chauffeur_id=chauffeur_id)
-    if statut:
-        livraisons = livraisons.filter(statut=statut)
+    # Jours clos lus dans les cumuls journaliers, aujourd'hui et après sur les livraisons brutes
+    recentes = reporting.jours_ouverts(livraisons, 'feuille__date_route')
+    cumuls = reporting.jours_clos(CumulJournalier.objects.all(), date_debut, date_fin, chauffeur_id)
+    stats_chauffeur, stats_vehicule = reporting.statistiques_livraisons(recentes, cumuls, statut)
     
     # Statistiques globales
-    total_livraisons = livraisons.count()
-    livraisons_livrees = livraisons.filter(statut='livre').count()
-    livraisons_probleme = livraisons.filter(statut='probleme').count()
+    total_livraisons = sum(stat['total'] for stat in stats_chauffeur)
+    livraisons_livrees = sum(stat['livre'] for stat in stats_chauffeur)
+    livraisons_probleme = sum(stat['probleme'] for stat in stats_chauffeur)
     taux_livraison = (livraisons_livrees / total_livraisons * 100) if total_livraisons > 0 else 0
     
-    # Statistiques par chauffeur
-    stats_chauffeur = livraisons.values(
-        'feuille__chauffeur__user__first_name',
-        'feuille__chauffeur__user__last_name'
-    ).annotate(
-        total=Count('id'),
-        livre=Count('id', filter=Q(statut='livre')),
-        probleme=Count('id', filter=Q(statut='probleme'))
-    ).order_by('-total')
-    
-    # Statistiques par véhicule
-    stats_vehicule = livraisons.values(
-        'feuille__vehicule__marque',
-        'feuille__vehicule__modele',
-        'feuille__vehicule__immatriculation'
-    ).annotate(
-        total=Count('id'),
-        livre=Count('id', filter=Q(statut='livre')),
-        probleme=Count('id', filter=Q(statut='probleme'))
-    ).order_by('-total')
-    
     # Analyse financière par produit
-    analyse_produits = {}
-    for livraison in livraisons.filter(statut='livre'):
-        for produit in livraison.produits.all():
-            if produit.nom not in analyse_produits:
-                analyse_produits[produit.nom] = {
-                    'quantite': 0,
-                    'montant': 0,
-                    'prix_unitaire': produit.prix_unitaire
-                }
-            analyse_produits[produit.nom]['quantite'] += livraison.quantite
-            analyse_produits[produit.nom]['montant'] += produit.prix_unitaire * livraison.quantite
+    ventes = None
+    if not statut or statut == 'livre':
+        ventes = reporting.jours_clos(CumulProduitJournalier.objects.all(), date_debut, date_fin, chauffeur_id)
+    analyse_produits = reporting.analyse_produits(recentes.filter(statut='livre'), ventes)
     
-    # Tri par montant décroissant
-    analyse_produits = dict(sorted(analyse_produits.items(), key=lambda x: x[1]['montant'], reverse=True))
+    # Détail : pagination par clé sur (date de route, id) décroissants
+    page_livraisons, curseur_suivant = pagination.page(livraisons, request.GET.get('apres'), 'feuille__date_route')
     
     context = {
         'date_debut': date_debut,
@@ -117,7 +206,9 @@ def rapport_livraisons(request):
         'stats_chauffeur': stats_chauffeur,
         'stats_vehicule': stats_vehicule,
         'analyse_produits': analyse_produits,
-        'livraisons': livraisons.order_by('-feuille__date_route', '-id')[:100],  # Limiter à 100 pour l'affichage
+        'livraisons': page_livraisons,
+        'page_suivante': _url_page(request, curseur_suivant) if curseur_suivant else None,
+        'premiere_page': _url_page(request, None) if request.GET.get('apres') else None,
         'chauffeurs': Chauffeur.objects.all(),
     }
     
@@ -133,120 +224,126 @@ def rapport_feuilles_route(request):
     feuilles = FeuilleDeRoute.objects.select_related(
         'chauffeur__user', 
         'vehicule'
-    ).prefetch_related('livraisons')
+    )
+    feuilles = filtrer_feuilles(feuilles, date_debut, date_fin, statut=statut)
     
-    if date_debut:
-        feuilles = feuilles.filter(date_route__gte=date_debut)
-    if date_fin:
-        feuilles = feuilles.filter(date_route__lte=date_fin)
+    # Statistiques par statut et par chauffeur : cumuls des jours clos + feuilles brutes d'aujourd'hui et après
+    cumuls = reporting.jours_clos(CumulJournalier.objects.all(), date_debut, date_fin)
     if statut:
-        feuilles = feuilles.filter(statut=statut)
+        cumuls = cumuls.filter(statut=statut)
+    stats_statut, stats_chauffeur = reporting.statistiques_feuilles(reporting.jours_ouverts(feuilles), cumuls)
     
-    # Statistiques par statut
-    stats_statut = feuilles.values('statut').annotate(
-        total=Count('id'),
-        total_livraisons=Count('livraisons'),
-        livraisons_livrees=Count('livraisons', filter=Q(livraisons__statut='livre')),
-        livraisons_probleme=Count('livraisons', filter=Q(livraisons__statut='probleme'))
-    ).order_by('statut')
-    
-    # Statistiques par chauffeur
-    stats_chauffeur = feuilles.values(
-        'chauffeur__user__first_name',
-        'chauffeur__user__last_name'
-    ).annotate(
-        total=Count('id'),
-        planifie=Count('id', filter=Q(statut='planifie')),
-        en_route=Count('id', filter=Q(statut='en_route')),
-        terminee=Count('id', filter=Q(statut='terminee')),
-        probleme=Count('id', filter=Q(statut='probleme'))
-    ).order_by('-total')
+    # Détail : une page de feuilles, puis leurs compteurs de livraisons en une requête groupée
+    page_feuilles, curseur_suivant = pagination.page(feuilles, request.GET.get('apres'))
+    compteurs = FeuilleDeRoute.objects.filter(pk__in=[f.pk for f in page_feuilles]).with_status_summary().in_bulk()
+    for feuille in page_feuilles:
+        feuille.nb_livraisons = compteurs[feuille.pk].nb_livraisons
+        feuille.nb_livre = compteurs[feuille.pk].nb_livre
+        feuille.nb_probleme = compteurs[feuille.pk].nb_probleme
     
     context = {
         'date_debut': date_debut,
         'date_fin': date_fin,
         'stats_statut': stats_statut,
         'stats_chauffeur': stats_chauffeur,
-        'feuilles': feuilles.order_by('-date_route', '-id'),
-        'total_feuilles': feuilles.count(),
+        'feuilles': page_feuilles,
+        'page_suivante': _url_page(request, curseur_suivant) if curseur_suivant else None,
+        'premiere_page': _url_page(request, None) if request.GET.get('apres') else None,
+        'total_feuilles': sum(stat['total'] for stat in stats_statut),
     }
     
     return render(request, 'admin_dashboard/rapport_feuilles_route.html', context)
 
+class Echo:
+    """Pseudo-buffer : write() renvoie la ligne au lieu de la stocker."""
+    def write(self, value):
+        return value
+
+def stream_csv(filename, entetes, lignes):
+    """Réponse CSV produite ligne par ligne, sans construire le fichier en mémoire."""
+    writer = csv.writer(Echo())
+
+    def contenu():
+        yield writer.writerow(entetes)
+        for ligne in lignes:
+            yield writer.writerow(ligne)
+
+    response = StreamingHttpResponse(contenu(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}_{timezone.now().strftime("%Y%m%d")}.csv"'
+    return response
+
 @staff_member_required
 def export_csv_livraisons(request):
     """Export CSV des livraisons"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="livraisons_{timezone.now().strftime("%Y%m%d")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'ID', 'Date Route', 'Chauffeur', 'Véhicule', 'Client', 'Référence', 
-        'Quantité', 'Statut', 'Date Livraison', 'Produits', 'Montant Total'
-    ])
-    
     livraisons = Livraison.objects.select_related(
         'feuille__chauffeur__user', 
         'feuille__vehicule', 
         'client'
-    ).prefetch_related('produits').order_by('-feuille__date_route', '-id')
-    
-    for livraison in livraisons:
-        produits_str = ', '.join([f"{p.nom} ({p.prix_unitaire} FCFA)" for p in livraison.produits.all()])
-        montant_total = sum(p.prix_unitaire * livraison.quantite for p in livraison.produits.all())
-        
-        writer.writerow([
-            livraison.id,
-            livraison.feuille.date_route or livraison.feuille.date_creation,
-            livraison.feuille.chauffeur.user.get_full_name() or livraison.feuille.chauffeur.user.username,
-            f"{livraison.feuille.vehicule.marque} {livraison.feuille.vehicule.modele}" if livraison.feuille.vehicule else "Non assigné",
-            livraison.client.nom,
-            livraison.reference_commande,
-            livraison.quantite,
-            livraison.get_statut_display(),
-            livraison.date_livraison.strftime('%Y-%m-%d %H:%M') if livraison.date_livraison else '',
-            produits_str,
-            f"{montant_total} FCFA"
-        ])
-    
-    return response
+    ).prefetch_related('produits').annotate(
+        montant_total=reporting.montant_livraison()
+    ).order_by('-feuille__date_route', '-id')
+    livraisons = filtrer_livraisons(
+        livraisons,
+        date_debut=request.GET.get('date_debut'),
+        date_fin=request.GET.get('date_fin'),
+        chauffeur_id=request.GET.get('chauffeur'),
+        statut=request.GET.get('statut'),
+    )
+
+    def lignes():
+        for livraison in livraisons.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            produits_str = ', '.join([f"{p.nom} ({p.prix_unitaire} FCFA)" for p in livraison.produits.all()])
+            yield [
+                livraison.id,
+                livraison.feuille.date_route or livraison.feuille.date_creation,
+                livraison.feuille.chauffeur.user.get_full_name() or livraison.feuille.chauffeur.user.username,
+                f"{livraison.feuille.vehicule.marque} {livraison.feuille.vehicule.modele}" if livraison.feuille.vehicule else "Non assigné",
+                livraison.client.nom,
+                livraison.reference_commande,
+                livraison.quantite,
+                livraison.get_statut_display(),
+                livraison.date_livraison.strftime('%Y-%m-%d %H:%M') if livraison.date_livraison else '',
+                produits_str,
+                f"{livraison.montant_total or 0:.2f} FCFA"
+            ]
+
+    return stream_csv('livraisons', [
+        'ID', 'Date Route', 'Chauffeur', 'Véhicule', 'Client', 'Référence', 
+        'Quantité', 'Statut', 'Date Livraison', 'Produits', 'Montant Total'
+    ], lignes())
 
 @staff_member_required
 def export_csv_feuilles_route(request):
     """Export CSV des feuilles de route"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="feuilles_route_{timezone.now().strftime("%Y%m%d")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'ID', 'Date Route', 'Chauffeur', 'Véhicule', 'Statut', 
-        'Total Livraisons', 'Livraisons Livrées', 'Livraisons Problème',
-        'Observations Chauffeur', 'Date Observations'
-    ])
-    
     feuilles = FeuilleDeRoute.objects.select_related(
         'chauffeur__user', 
         'vehicule'
-    ).prefetch_related('livraisons').order_by('-date_route', '-id')
-    
-    for feuille in feuilles:
-        total_livraisons = feuille.livraisons.count()
-        livraisons_livrees = feuille.livraisons.filter(statut='livre').count()
-        livraisons_probleme = feuille.livraisons.filter(statut='probleme').count()
-        
-        writer.writerow([
-            feuille.id,
-            feuille.date_route or feuille.date_creation,
-            feuille.chauffeur.user.get_full_name() or feuille.chauffeur.user.username,
-            f"{feuille.vehicule.marque} {feuille.vehicule.modele}" if feuille.vehicule else "Non assigné",
-            feuille.get_statut_display(),
-            total_livraisons,
-            livraisons_livrees,
-            livraisons_probleme,
-            feuille.observations_chauffeur or '',
-            feuille.date_observations.strftime('%Y-%m-%d %H:%M') if feuille.date_observations else ''
-        ])
-    
-    return response
+    ).with_status_summary().order_by('-date_route', '-id')
+    feuilles = filtrer_feuilles(
+        feuilles,
+        date_debut=request.GET.get('date_debut'),
+        date_fin=request.GET.get('date_fin'),
+        chauffeur_id=request.GET.get('chauffeur'),
+        statut=request.GET.get('statut'),
+    )
 
+    def lignes():
+        for feuille in feuilles.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield [
+                feuille.id,
+                feuille.date_route or feuille.date_creation,
+                feuille.chauffeur.user.get_full_name() or feuille.chauffeur.user.username,
+                f"{feuille.vehicule.marque} {feuille.vehicule.modele}" if feuille.vehicule else "Non assigné",
+                feuille.get_statut_display(),
+                feuille.nb_livraisons,
+                feuille.nb_livre,
+                feuille.nb_probleme,
+                feuille.observations_chauffeur or '',
+                feuille.date_observations.strftime('%Y-%m-%d %H:%M') if feuille.date_observations else ''
+            ]
 
+    return stream_csv('feuilles_route', [
+        'ID', 'Date Route', 'Chauffeur', 'Véhicule', 'Statut', 
+        'Total Livraisons', 'Livraisons Livrées', 'Livraisons Problème',
+        'Observations Chauffeur', 'Date Observations'
+    ], lignes())
@@ -0,0 +1,102 @@
+"""Chauffeur connecté, résolu une fois par requête et gardé en cache.
+
+Les pages chauffeur sont rechargées toutes les minutes : plutôt que de relire
+``auth_user`` (via la session) puis ``Chauffeur`` à chaque fois, le chauffeur
+et son utilisateur sont lus ensemble une fois, puis servis par le cache :
+
+* ``ChauffeurBackend.get_user`` rend l'utilisateur d'un chauffeur en cache,
+  avec seulement son mot de passe et ``is_active`` relus en base ; les autres
+  utilisateurs sont lus comme avant ;
+* ``ChauffeurMiddleware`` (voir ``chauffeur.middleware``) pose
+  ``request.chauffeur``, évalué à la première lecture ;
+* ``chauffeur_requis`` remplace, dans les vues, la recherche du chauffeur et la
+  redirection vers la connexion.
+
+L'entrée est effacée à chaque modification du chauffeur ou de son utilisateur,
+mais seulement dans le cache du processus qui l'a faite (LocMemCache) : les
+autres processus, comme une écriture sans signal (``update()``), ne la voient
+qu'à l'expiration, après ``DUREE_CACHE``. C'est pourquoi le mot de passe (haché
+de session) et ``is_active`` ne sont jamais pris dans le cache : un changement
+de mot de passe ou une désactivation déconnecte aussitôt sur tous les processus.
+"""
+from functools import wraps
+
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.shortcuts import redirect
+
+from livraison.models import Chauffeur
+
+User = get_user_model()
+
+DUREE_CACHE = 15 * 60
+# Valeur en cache pour un utilisateur qui n'est pas chauffeur
+PAS_CHAUFFEUR = False
+
+
+def _cle(user_id):
+    return f'chauffeur:user:{user_id}'
+
+
+def _charger(user_id):
+    """Chauffeur (avec son utilisateur) de ``user_id`` depuis le cache ou la base ; None s'il n'y en a pas."""
+    chauffeur = cache.get(_cle(user_id))
+    if chauffeur is None:
+        chauffeur = Chauffeur.objects.select_related('user').filter(user_id=user_id).first() or PAS_CHAUFFEUR
+        cache.set(_cle(user_id), chauffeur, DUREE_CACHE)
+    return chauffeur or None
+
+
+def chauffeur_de(user):
+    """Chauffeur de l'utilisateur, ou None (anonyme, pas chauffeur)."""
+    if not user.is_authenticated:
+        return None
+    # Utilisateur venu du cache par ChauffeurBackend : son chauffeur est déjà attaché
+    if Chauffeur.user.field.remote_field.is_cached(user):
+        return user.chauffeur
+    return _charger(user.pk)
+
+
+class ChauffeurBackend(ModelBackend):
+    """ModelBackend dont ``get_user`` sert les chauffeurs depuis le cache."""
+
+    def get_user(self, user_id):
+        chauffeur = _charger(user_id)
+        if chauffeur is None:
+            return super().get_user(user_id)
+        etat = User._default_manager.filter(pk=user_id).values_list('password', 'is_active').first()
+        if etat is None:
+            cache.delete(_cle(user_id))
+            return None
+        user = chauffeur.user
+        user.password, user.is_active = etat
+        return user if self.user_can_authenticate(user) else None
+
+
+def chauffeur_requis(vue):
+    """Vue réservée aux chauffeurs : ``request.chauffeur`` est garanti, sinon retour à la connexion."""
+    @login_required
+    @wraps(vue)
+    def wrapper(request, *args, **kwargs):
+        if not request.chauffeur:
+            messages.error(request, 'Vous n\'êtes pas un chauffeur autorisé.')
+            return redirect('chauffeur:login')
+        return vue(request, *args, **kwargs)
+    return wrapper
+
+
+@receiver(post_save, sender=Chauffeur)
+@receiver(post_delete, sender=Chauffeur)
+def _chauffeur_modifie(sender, instance, **kwargs):
+    cache.delete(_cle(instance.user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _utilisateur_modifie(sender, instance, **kwargs):
+    cache.delete(_cle(instance.pk))
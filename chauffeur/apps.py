@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChauffeurConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chauffeur'
+
+    def ready(self):
+        # Signaux : invalidation du chauffeur en cache
+        from . import acces  # noqa: F401
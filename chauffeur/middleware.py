@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .acces import chauffeur_de
+
+
+class ChauffeurMiddleware:
+    """Pose ``request.chauffeur`` (Chauffeur, ou None en valeur booléenne fausse), résolu à la première lecture."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.chauffeur = SimpleLazyObject(lambda: chauffeur_de(request.user))
+        return self.get_response(request)
@@ -1,3 +1,106 @@
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+
+from livraison.models import Chauffeur, Client, FeuilleDeRoute, Livraison, Vehicule
+
+
+class DashboardChauffeurTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('jules', password='x')
+        self.chauffeur = Chauffeur.objects.create(user=user, telephone='0600000030')
+        self.vehicule = Vehicule.objects.create(nom='V1', marque='Renault', modele='Kangoo', immatriculation='AA-123')
+        self.client_ = Client.objects.create(nom='Client D', adresse='x', telephone='01')
+        self.client.force_login(user)
+
+    def creer_feuilles(self, nombre, debut=date(2024, 1, 1), **champs):
+        feuilles = FeuilleDeRoute.objects.bulk_create([
+            FeuilleDeRoute(chauffeur=self.chauffeur, date_route=debut + timedelta(days=i), statut='terminee', **champs)
+            for i in range(nombre)
+        ])
+        Livraison.objects.bulk_create([
+            Livraison(feuille=feuille, client=self.client_, reference_commande='D') for feuille in feuilles for _ in range(2)
+        ])
+        return feuilles
+
+    def test_requetes_independantes_de_l_historique(self):
+        self.creer_feuilles(3)
+        self.client.get(reverse('chauffeur:dashboard'))
+        # Mot de passe et is_active, compteurs, page de feuilles : session, reste de
+        # l'utilisateur et chauffeur viennent du cache
+        with self.assertNumQueries(3):
+            self.client.get(reverse('chauffeur:dashboard'))
+        self.creer_feuilles(60, debut=date(2020, 1, 1))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('chauffeur:dashboard'))
+
+        self.assertEqual(response.context['total_feuilles'], 63)
+        self.assertEqual(response.context['feuilles_terminees'], 63)
+        self.assertEqual(len(response.context['feuilles']), 20)
+        self.assertEqual(response.context['feuilles'][0].date_route, date(2024, 1, 3))
+        self.assertEqual(response.context['feuilles'][0].nb_livraisons, 2)
+        self.assertContains(response, 'Charger plus')
+
+    def test_page_suivante(self):
+        feuilles = self.creer_feuilles(25)
+        response = self.client.get(reverse('chauffeur:dashboard'))
+        response = self.client.get(reverse('chauffeur:dashboard') + response.context['page_suivante'])
+        self.assertEqual([f.pk for f in response.context['feuilles']], [f.pk for f in reversed(feuilles[:5])])
+        self.assertIsNone(response.context['page_suivante'])
+
+    def test_vehicule_actuel(self):
+        self.creer_feuilles(2, vehicule=self.vehicule)
+        response = self.client.get(reverse('chauffeur:dashboard'))
+        self.assertIsNone(response.context['vehicule_actuel'])
+
+        FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, date_route=date(2023, 1, 1), vehicule=self.vehicule)
+        response = self.client.get(reverse('chauffeur:dashboard'))
+        self.assertEqual(response.context['vehicule_actuel'], self.vehicule)
+
+
+class ChauffeurEnCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('leo', password='x', first_name='Léo')
+        self.chauffeur = Chauffeur.objects.create(user=self.user, telephone='0600000031')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur)
+        self.url = reverse('chauffeur:feuille_detail', args=[self.feuille.pk])
+        self.client.force_login(self.user)
+
+    def test_modifications_invalident_le_cache(self):
+        self.client.get(self.url)
+        self.chauffeur.telephone = '0700000000'
+        self.chauffeur.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['chauffeur'].telephone, '0700000000')
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        # Compte désactivé : plus d'utilisateur connecté, login_required renvoie vers la connexion
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(f'?next={self.url}', response.url)
+
+    def test_modification_par_un_autre_processus(self):
+        self.client.get(self.url)
+        # Écriture sans signal, comme depuis un autre processus : le cache local n'est pas effacé
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.set_password('y')
+        User.objects.filter(pk=self.user.pk).update(password=self.user.password)
+        # Haché de session invalide : session fermée
+        self.assertEqual(self.client.get(self.url).status_code, 302)
 
-# Create your tests here.
+    def test_utilisateur_non_chauffeur(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get(self.url)
+        self.assertRedirects(response, reverse('chauffeur:login'))
+        self.client.get(self.url)
+        self.assertIs(cache.get(f'chauffeur:user:{User.objects.get(username="admin").pk}'), False)
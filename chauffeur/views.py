@@ -3,8 +3,12 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponse, JsonResponse
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from livraison.models import FeuilleDeRoute, Livraison, Chauffeur
+from livraison import pagination
+from livraison.models import FeuilleDeRoute, Livraison, Chauffeur, Vehicule
+from .acces import chauffeur_requis
 
 def chauffeur_login(request):
     if request.method == 'POST':
@@ -31,47 +35,56 @@ def chauffeur_logout(request):
     messages.success(request, 'Vous avez été déconnecté.')
     return redirect('chauffeur:login')
 
-@login_required
+# Feuilles affichées par page sur l'accueil du chauffeur
+FEUILLES_PAR_PAGE = 20
+
+@chauffeur_requis
 def chauffeur_dashboard(request):
-    try:
-        chauffeur = Chauffeur.objects.get(user=request.user)
-    except Chauffeur.DoesNotExist:
-        messages.error(request, 'Vous n\'êtes pas un chauffeur autorisé.')
-        return redirect('chauffeur:login')
+    chauffeur = request.chauffeur
     
-    # Récupérer les feuilles de route du chauffeur avec le véhicule assigné
-    feuilles = FeuilleDeRoute.objects.filter(chauffeur=chauffeur).select_related('vehicule').order_by('-date_route', '-date_creation')
+    # Compteurs des feuilles et véhicule actuel (feuille planifiée ou en route la plus récente)
+    # en une requête, quelle que soit la longueur de l'historique
+    actives = FeuilleDeRoute.objects.filter(
+        chauffeur=OuterRef('pk'), statut__in=['planifie', 'en_route'], vehicule__isnull=False,
+    ).order_by(F('date_route').desc(nulls_last=True), '-id')
+    stats = Chauffeur.objects.filter(pk=chauffeur.pk).annotate(
+        total_feuilles=Count('feuillederoute'),
+        feuilles_en_cours=Count('feuillederoute', filter=Q(feuillederoute__statut='en_route')),
+        feuilles_terminees=Count('feuillederoute', filter=Q(feuillederoute__statut='terminee')),
+        vehicule_actuel_id=Subquery(actives.values('vehicule_id')[:1]),
+    ).values('total_feuilles', 'feuilles_en_cours', 'feuilles_terminees', 'vehicule_actuel_id').get()
     
-    # Statistiques
-    total_feuilles = feuilles.count()
-    feuilles_en_cours = feuilles.filter(statut='en_route').count()
-    feuilles_terminees = feuilles.filter(statut='terminee').count()
+    # Feuilles les plus récentes, par pages ; nombre de livraisons par sous-requête (pas de GROUP BY sur l'historique)
+    nb_livraisons = Livraison.objects.filter(feuille=OuterRef('pk')).values('feuille').annotate(n=Count('id')).values('n')
+    feuilles, curseur_suivant = pagination.page(
+        FeuilleDeRoute.objects.filter(chauffeur=chauffeur).select_related('vehicule').annotate(
+            nb_livraisons=Coalesce(Subquery(nb_livraisons), 0),
+        ),
+        request.GET.get('apres'),
+        taille=FEUILLES_PAR_PAGE,
+    )
     
-    # Trouver le véhicule actuellement assigné (feuille en cours ou planifiée)
     vehicule_actuel = None
-    for feuille in feuilles:
-        if feuille.vehicule and feuille.statut in ['planifie', 'en_route']:
-            vehicule_actuel = feuille.vehicule
-            break
+    if stats['vehicule_actuel_id']:
+        vehicule_actuel = next(
+            (f.vehicule for f in feuilles if f.vehicule_id == stats['vehicule_actuel_id']), None
+        ) or Vehicule.objects.filter(pk=stats['vehicule_actuel_id']).first()
     
     context = {
         'chauffeur': chauffeur,
         'feuilles': feuilles,
+        'page_suivante': f'?apres={curseur_suivant}' if curseur_suivant else None,
         'vehicule_actuel': vehicule_actuel,
-        'total_feuilles': total_feuilles,
-        'feuilles_en_cours': feuilles_en_cours,
-        'feuilles_terminees': feuilles_terminees,
+        'total_feuilles': stats['total_feuilles'],
+        'feuilles_en_cours': stats['feuilles_en_cours'],
+        'feuilles_terminees': stats['feuilles_terminees'],
     }
     return render(request, 'chauffeur/dashboard.html', context)
 
-@login_required
+@chauffeur_requis
 def feuille_detail_chauffeur(request, feuille_id):
-    try:
-        chauffeur = Chauffeur.objects.get(user=request.user)
-        feuille = get_object_or_404(FeuilleDeRoute, id=feuille_id, chauffeur=chauffeur)
-    except Chauffeur.DoesNotExist:
-        messages.error(request, 'Vous n\'êtes pas un chauffeur autorisé.')
-        return redirect('chauffeur:login')
+    chauffeur = request.chauffeur
+    feuille = get_object_or_404(FeuilleDeRoute, id=feuille_id, chauffeur=chauffeur)
     
     if request.method == 'POST':
         action = request.POST.get('action')
@@ -97,7 +110,9 @@ def feuille_detail_chauffeur(request, feuille_id):
         
         return redirect('chauffeur:feuille_detail', feuille_id=feuille_id)
     
-    livraisons = feuille.livraisons.select_related('client').prefetch_related('produits', 'sacs').all()
+    livraisons = feuille.livraisons.select_related('client').prefetch_related('produits', 'sacs').order_by(
+        F('ordre').asc(nulls_last=True), 'horaire_estime', 'id'
+    )
     
     context = {
         'feuille': feuille,
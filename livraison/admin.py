@@ -1,8 +1,13 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import F
+from django.shortcuts import redirect, render
 from django.utils.html import format_html
-from django.urls import reverse
+from django.urls import path, reverse
 from django.utils.safestring import mark_safe
-from .models import Chauffeur, Client, FeuilleDeRoute, Livraison, Produit, Sac, Vehicule
+from .planning import ErreurPlanning, importer_planning, lire_fichier
+from .geocodage import ErreurGeocodage, geocoder_clients
+from .tournees import ErreurTournee, optimiser_feuilles
+from .models import Chauffeur, Client, FeuilleDeRoute, Livraison, PositionGPS, Produit, Sac, Vehicule
 
 # Personnalisation du site admin
 admin.site.site_header = "🚚 Administration - Suivi de Livraison"
@@ -94,26 +99,42 @@ class ClientAdmin(admin.ModelAdmin):
     list_display = ('nom', 'telephone', 'adresse_courte')
     search_fields = ('nom', 'telephone', 'adresse')
     list_filter = ('nom',)
+    actions = ['geocoder']
     
     def adresse_courte(self, obj):
         return obj.adresse[:50] + "..." if len(obj.adresse) > 50 else obj.adresse
     adresse_courte.short_description = "Adresse"
     
+    @admin.action(description="Géocoder les adresses (gazetteer local)")
+    def geocoder(self, request, queryset):
+        try:
+            geocodes, non_reconnus = geocoder_clients(queryset, tous=True)
+        except ErreurGeocodage as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f"{geocodes} client(s) géocodé(s), {non_reconnus} adresse(s) non reconnue(s).")
+    
     fieldsets = (
         ('Informations client', {
             'fields': ('nom', 'telephone', 'adresse')
         }),
+        ('Géolocalisation', {
+            'fields': ('latitude', 'longitude'),
+            'classes': ('collapse',)
+        }),
     )
 
 
 class LivraisonInline(admin.TabularInline):
     model = Livraison
     extra = 0
-    fields = ('client', 'reference_commande', 'quantite', 'horaire_estime', 'statut', 'produits', 'sacs')
+    fields = ('ordre', 'client', 'reference_commande', 'quantite', 'horaire_estime', 'statut', 'produits', 'sacs')
     autocomplete_fields = ['client', 'produits', 'sacs']
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('client').prefetch_related('produits', 'sacs')
+        return super().get_queryset(request).select_related('client').prefetch_related('produits', 'sacs').order_by(
+            F('ordre').asc(nulls_last=True), 'horaire_estime', 'id'
+        )
 
 
 @admin.register(FeuilleDeRoute)
@@ -123,18 +144,60 @@ class FeuilleDeRouteAdmin(admin.ModelAdmin):
     search_fields = ('id', 'chauffeur__user__username', 'vehicule__immatriculation', 'vehicule__marque')
     date_hierarchy = 'date_route'
     inlines = [LivraisonInline]
+    change_list_template = 'admin/livraison/feuillederoute/change_list.html'
     readonly_fields = ('token', 'qr_code', 'last_latitude', 'last_longitude', 'last_position_at', 'date_observations')
+    actions = ['optimiser_tournees']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('chauffeur__user', 'vehicule').with_status_summary()
+    
+    def get_urls(self):
+        urls = [
+            path('importer-planning/', self.admin_site.admin_view(self.importer_planning_view), name='livraison_feuillederoute_importer_planning'),
+        ]
+        return urls + super().get_urls()
+    
+    def importer_planning_view(self, request):
+        """Import en masse d'un planning CSV/XLSX (voir livraison.planning)."""
+        if not self.has_add_permission(request):
+            return redirect('admin:livraison_feuillederoute_changelist')
+        rapport = None
+        if request.method == 'POST' and request.FILES.get('fichier'):
+            try:
+                lignes = lire_fichier(request.FILES['fichier'])
+            except ErreurPlanning as e:
+                messages.error(request, str(e))
+            else:
+                rapport = importer_planning(lignes, dry_run='dry_run' in request.POST)
+                if not rapport['erreurs'] and not rapport['dry_run']:
+                    messages.success(request, f"{rapport['feuilles']} feuille(s) de route et {rapport['livraisons']} livraison(s) importées.")
+                    return redirect('admin:livraison_feuillederoute_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Importer un planning",
+            'rapport': rapport,
+        }
+        return render(request, 'admin/livraison/feuillederoute/importer_planning.html', context)
+    
+    @admin.action(description="Optimiser l'ordre de passage des livraisons")
+    def optimiser_tournees(self, request, queryset):
+        try:
+            nombre = optimiser_feuilles(queryset)
+        except ErreurTournee as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f"{nombre} livraison(s) réordonnée(s).")
     
     def get_livraisons_count(self, obj):
-        count = obj.livraisons.count()
+        count = obj.nb_livraisons
         return format_html('<span style="color: {};">{}</span>', 
                           'green' if count > 0 else 'red', count)
     get_livraisons_count.short_description = "Nb livraisons"
+    get_livraisons_count.admin_order_field = 'nb_livraisons'
     
     def qr_code_link(self, obj):
-        if obj.qr_code:
-            return format_html('<a href="{}" target="_blank">📋 Voir QR</a>', obj.qr_code.url)
-        return "Pas de QR"
+        return format_html('<a href="{}" target="_blank">📋 Voir QR</a>', obj.get_qr_code_url())
     qr_code_link.short_description = "QR Code"
     
     def print_buttons(self, obj):
@@ -169,9 +232,15 @@ class LivraisonAdmin(admin.ModelAdmin):
     list_display = ('id', 'feuille', 'client', 'reference_commande', 'quantite', 'statut', 'date_livraison', 'get_produits_display')
     list_filter = ('statut', 'date_livraison', 'feuille__chauffeur', 'feuille__vehicule')
     search_fields = ('reference_commande', 'client__nom', 'feuille__chauffeur__user__username')
-    readonly_fields = ('public_token', 'date_livraison')
+    readonly_fields = ('public_token', 'date_livraison', 'apercu_preuve')
     autocomplete_fields = ['client', 'produits', 'sacs']
     
+    def apercu_preuve(self, obj):
+        if obj.preuve_photo:
+            return format_html('<img src="{}" width="200" style="border-radius:8px;">', obj.preuve_photo_miniature_url)
+        return "Aucune photo"
+    apercu_preuve.short_description = "Aperçu preuve"
+    
     def get_produits_display(self, obj):
         produits = obj.produits.all()
         if produits:
@@ -187,17 +256,29 @@ class LivraisonAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Informations générales', {
-            'fields': ('feuille', 'client', 'reference_commande', 'quantite', 'horaire_estime', 'statut')
+            'fields': ('feuille', 'client', 'reference_commande', 'quantite', 'ordre', 'horaire_estime', 'statut')
         }),
         ('Produits et sacs', {
             'fields': ('produits', 'sacs')
         }),
         ('Preuves et signatures', {
-            'fields': ('preuve_photo', 'signature_client', 'signature_tactile'),
+            'fields': ('preuve_photo', 'apercu_preuve', 'signature_client', 'signature_tactile'),
             'classes': ('collapse',)
         }),
         ('Système', {
             'fields': ('public_token', 'date_livraison', 'notes'),
             'classes': ('collapse',)
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(PositionGPS)
+class PositionGPSAdmin(admin.ModelAdmin):
+    list_display = ('feuille', 'latitude', 'longitude', 'precision', 'date_position')
+    list_filter = ('date_position', 'feuille__chauffeur')
+    date_hierarchy = 'date_position'
+    list_select_related = ('feuille__chauffeur__user',)
+    readonly_fields = ('feuille', 'latitude', 'longitude', 'precision', 'date_position')
+    
+    def has_add_permission(self, request):
+        return False
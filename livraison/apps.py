@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LivraisonConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'livraison'
+
+    def ready(self):
+        # Signaux : ETA, index spatiaux et cache de la page de suivi (recalculés dans cet ordre),
+        # cumuls des rapports ; PRAGMA des connexions SQLite
+        from . import cumuls, eta, spatial, sqlite, suivi  # noqa: F401
@@ -0,0 +1,178 @@
+"""Cumuls journaliers lus par les rapports à la place des livraisons brutes.
+
+``CumulJournalier`` compte, par date de route × chauffeur × véhicule × statut
+de feuille, les feuilles et leurs livraisons par statut, avec la quantité
+livrée ; ``CumulProduitJournalier`` la quantité livrée de chaque produit par
+date × chauffeur. Les rapports lisent les cumuls des jours clos et les tables
+brutes pour aujourd'hui et après (voir ``admin_dashboard.reporting``).
+
+Chaque modification d'une feuille, d'une livraison ou de ses produits marque le
+couple (date de route, chauffeur) concerné, recalculé en entier après
+validation de la transaction : quelques feuilles au plus. Les écritures sans
+signal (``bulk_create``, ``update``) appellent ``feuilles_modifiees`` ; la
+commande ``recalculer_cumuls`` reconstruit l'historique.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import CumulJournalier, CumulProduitJournalier, FeuilleDeRoute, Livraison
+
+LivraisonProduit = Livraison.produits.through
+
+# Champs d'une feuille qui entrent dans les cumuls
+CHAMPS_FEUILLE = {'date_route', 'chauffeur', 'chauffeur_id', 'vehicule', 'vehicule_id', 'statut'}
+TAILLE_LOT = 1000
+
+_en_attente = threading.local()
+
+
+def _attente():
+    if not hasattr(_en_attente, 'cles'):
+        _en_attente.cles, _en_attente.feuilles = set(), set()
+    return _en_attente
+
+
+def _appliquer():
+    # Un seul recalcul pour toutes les modifications de la transaction : les
+    # rappels suivants trouvent l'attente vide. Après un rollback, les marques
+    # restantes sont recalculées au commit suivant, sans autre effet.
+    attente = _attente()
+    cles, feuilles = attente.cles, attente.feuilles
+    attente.cles, attente.feuilles = set(), set()
+    if feuilles:
+        cles |= set(FeuilleDeRoute.objects.filter(pk__in=feuilles).values_list('date_route', 'chauffeur_id'))
+    recalculer(cles)
+
+
+def _marquer(cles=(), feuilles=()):
+    attente = _attente()
+    attente.cles.update(cle for cle in cles if cle[0] is not None)
+    attente.feuilles.update(pk for pk in feuilles if pk is not None)
+    transaction.on_commit(_appliquer)
+
+
+def feuilles_modifiees(feuille_ids):
+    """À appeler après une écriture sans signal sur des feuilles ou leurs livraisons."""
+    _marquer(feuilles=feuille_ids)
+
+
+def _filtre(cles):
+    """Q sur les feuilles des couples ``(date_route, chauffeur_id)``, groupés par date."""
+    par_date = {}
+    for date_route, chauffeur_id in cles:
+        par_date.setdefault(date_route, set()).add(chauffeur_id)
+    filtre = Q(pk__in=[])
+    for date_route, chauffeurs in par_date.items():
+        filtre |= Q(date_route=date_route, chauffeur_id__in=chauffeurs)
+    return filtre
+
+
+def _cumuls(feuilles):
+    """Cumuls (non enregistrés) des ``feuilles``, en deux requêtes groupées."""
+    lignes = feuilles.values('date_route', 'chauffeur_id', 'vehicule_id', 'statut').annotate(
+        nb_feuilles=Count('id', distinct=True),
+        nb_en_cours=Count('livraisons', filter=Q(livraisons__statut='en_cours')),
+        nb_livre=Count('livraisons', filter=Q(livraisons__statut='livre')),
+        nb_probleme=Count('livraisons', filter=Q(livraisons__statut='probleme')),
+        quantite_livree=Coalesce(Sum('livraisons__quantite', filter=Q(livraisons__statut='livre')), 0),
+    ).order_by()
+    ventes = LivraisonProduit.objects.filter(
+        livraison__feuille__in=feuilles.values('pk'), livraison__statut='livre',
+    ).values('livraison__feuille__date_route', 'livraison__feuille__chauffeur_id', 'produit_id').annotate(
+        quantite=Sum('livraison__quantite'),
+    ).order_by()
+    return (
+        [CumulJournalier(date=l.pop('date_route'), **l) for l in lignes],
+        [
+            CumulProduitJournalier(
+                date=v['livraison__feuille__date_route'], chauffeur_id=v['livraison__feuille__chauffeur_id'],
+                produit_id=v['produit_id'], quantite=v['quantite'],
+            )
+            for v in ventes
+        ],
+    )
+
+
+def _remplacer(filtre_cumuls, feuilles):
+    cumuls, ventes = _cumuls(feuilles)
+    with transaction.atomic():
+        CumulJournalier.objects.filter(filtre_cumuls).delete()
+        CumulProduitJournalier.objects.filter(filtre_cumuls).delete()
+        CumulJournalier.objects.bulk_create(cumuls, batch_size=TAILLE_LOT)
+        CumulProduitJournalier.objects.bulk_create(ventes, batch_size=TAILLE_LOT)
+    return len(cumuls)
+
+
+def recalculer(cles):
+    """Recalcule les cumuls des couples ``(date_route, chauffeur_id)``."""
+    cles = {cle for cle in cles if cle[0] is not None}
+    if not cles:
+        return 0
+    filtre_cumuls = Q(pk__in=[])
+    for date_route, chauffeur_id in cles:
+        filtre_cumuls |= Q(date=date_route, chauffeur_id=chauffeur_id)
+    return _remplacer(filtre_cumuls, FeuilleDeRoute.objects.filter(_filtre(cles)))
+
+
+def reconstruire(date_debut=None, date_fin=None):
+    """Reconstruit les cumuls de la période (tout l'historique par défaut) ; renvoie le nombre de lignes."""
+    feuilles = FeuilleDeRoute.objects.filter(date_route__isnull=False)
+    filtre_cumuls = Q()
+    if date_debut:
+        feuilles = feuilles.filter(date_route__gte=date_debut)
+        filtre_cumuls &= Q(date__gte=date_debut)
+    if date_fin:
+        feuilles = feuilles.filter(date_route__lte=date_fin)
+        filtre_cumuls &= Q(date__lte=date_fin)
+    return _remplacer(filtre_cumuls, feuilles)
+
+
+@receiver(pre_save, sender=FeuilleDeRoute)
+def _feuille_avant(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Date ou chauffeur changés : l'ancien couple doit aussi être recalculé
+    if raw or instance.pk is None or (update_fields is not None and not CHAMPS_FEUILLE & set(update_fields)):
+        return
+    _marquer(cles=FeuilleDeRoute.objects.filter(pk=instance.pk).values_list('date_route', 'chauffeur_id'))
+
+
+@receiver(post_save, sender=FeuilleDeRoute)
+def _feuille_enregistree(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not CHAMPS_FEUILLE & set(update_fields)):
+        return
+    _marquer(cles=[(instance.date_route, instance.chauffeur_id)])
+
+
+@receiver(post_delete, sender=FeuilleDeRoute)
+def _feuille_supprimee(sender, instance, **kwargs):
+    _marquer(cles=[(instance.date_route, instance.chauffeur_id)])
+
+
+@receiver(pre_save, sender=Livraison)
+def _livraison_avant(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Livraison déplacée vers une autre feuille : l'ancienne feuille est recalculée aussi
+    if raw or instance.pk is None or (update_fields is not None and 'feuille' not in update_fields):
+        return
+    _marquer(feuilles=Livraison.objects.filter(pk=instance.pk).values_list('feuille_id', flat=True))
+
+
+@receiver(post_save, sender=Livraison)
+@receiver(post_delete, sender=Livraison)
+def _livraison_modifiee(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _marquer(feuilles=[instance.feuille_id])
+
+
+@receiver(m2m_changed, sender=LivraisonProduit)
+def _produits_modifies(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _marquer(feuilles=[instance.feuille_id])
+    elif action in ('post_add', 'post_remove'):
+        _marquer(feuilles=Livraison.objects.filter(pk__in=pk_set).values_list('feuille_id', flat=True))
+    elif action == 'pre_clear':
+        _marquer(feuilles=instance.livraison_set.values_list('feuille_id', flat=True))
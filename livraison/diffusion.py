@@ -0,0 +1,97 @@
+"""Diffusion en mémoire des événements de suivi (positions, statuts) vers les flux SSE.
+
+Les vues synchrones publient avec ``diffuseur.publier()`` ; les vues
+asynchrones servies par l'ASGI (``suivi_livraison/asgi.py``) s'abonnent à
+un ou plusieurs sujets avec ``diffuseur.ecouter()`` et relaient les messages au navigateur
+en server-sent events. Chaque abonné a sa propre file bornée : un client
+lent perd les plus anciens messages au lieu de faire grossir la mémoire.
+
+La diffusion est propre au processus : avec plusieurs workers, chacun ne
+voit que les publications faites dans son propre processus.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Messages gardés en attente par abonné avant d'abandonner les plus anciens
+TAILLE_FILE = 100
+# Intervalle des commentaires de maintien de connexion, en secondes
+KEEPALIVE_SECONDES = 15
+
+# Sujet des positions de toutes les feuilles (carte de la flotte)
+SUJET_FLOTTE = 'flotte'
+
+
+def sujet_feuille(feuille_id):
+    """Sujet public d'une feuille de route : heure de sa dernière position, sans coordonnées."""
+    return f'feuille:{feuille_id}'
+
+
+def sujet_livraison(public_token):
+    """Sujet des changements de statut d'une livraison, par jeton public de suivi."""
+    return f'livraison:{public_token}'
+
+
+def sujet_eta(public_token):
+    """Sujet des heures d'arrivée estimées d'une livraison (voir ``livraison.eta``)."""
+    return f'eta:{public_token}'
+
+
+def _deposer(file, message):
+    if file.full():
+        file.get_nowait()
+    file.put_nowait(message)
+
+
+class Diffuseur:
+    def __init__(self):
+        self._abonnes = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publier(self, sujet, message):
+        """Envoie ``message`` à tous les abonnés de ``sujet`` ; utilisable depuis n'importe quel thread."""
+        with self._lock:
+            abonnes = list(self._abonnes.get(sujet, ()))
+        for loop, file in abonnes:
+            try:
+                loop.call_soon_threadsafe(_deposer, file, (sujet, message))
+            except RuntimeError:
+                # Boucle fermée : l'abonné sera retiré à la fin de son générateur
+                pass
+
+    def nombre_abonnes(self, sujet):
+        with self._lock:
+            return len(self._abonnes.get(sujet, ()))
+
+    async def ecouter(self, *sujets, keepalive=KEEPALIVE_SECONDES):
+        """Générateur asynchrone des ``(sujet, message)`` publiés sur ``sujets`` ; produit None à chaque keepalive."""
+        abonne = (asyncio.get_running_loop(), asyncio.Queue(maxsize=TAILLE_FILE))
+        with self._lock:
+            for sujet in sujets:
+                self._abonnes[sujet].add(abonne)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(abonne[1].get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for sujet in sujets:
+                    self._abonnes[sujet].discard(abonne)
+                    if not self._abonnes[sujet]:
+                        del self._abonnes[sujet]
+
+
+diffuseur = Diffuseur()
+
+
+def evenement_sse(message, event=None):
+    """Formate un message (dict) en événement server-sent events ; None donne un commentaire keepalive."""
+    if message is None:
+        return ': keepalive\n\n'
+    lignes = f'event: {event}\n' if event else ''
+    return f'{lignes}data: {json.dumps(message, cls=DjangoJSONEncoder)}\n\n'
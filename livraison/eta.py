@@ -0,0 +1,199 @@
+"""Heures d'arrivée estimées (ETA) des livraisons en cours d'une feuille de route.
+
+Les ETA partent de la dernière position GPS de la feuille et enchaînent les
+livraisons restantes dans l'ordre de passage : trajet à vol d'oiseau corrigé
+par ``FACTEUR_DETOUR`` à la vitesse moyenne des tournées, plus un temps d'arrêt
+par livraison tiré de l'historique du chauffeur (écarts entre ``date_livraison``
+successives, moins le trajet entre les deux clients).
+
+Le calcul est fait quand une position ou un changement de statut arrive, jamais
+à l'affichage : les pages lisent le résultat dans le cache. Les arrêts restants
+et le temps d'arrêt du chauffeur sont eux aussi gardés en cache, si bien
+qu'une nouvelle position ne coûte aucune requête SQL.
+"""
+import statistics
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import dateformat, timezone
+
+from . import suivi
+from .diffusion import diffuseur, sujet_eta
+from .models import FeuilleDeRoute, Livraison
+from .spatial import distance_km
+from .tournees import MINUTES_PAR_ARRET, VITESSE_MOYENNE_KMH
+
+# Les rues allongent le trajet à vol d'oiseau d'environ un tiers
+FACTEUR_DETOUR = 1.3
+# Historique utilisé pour le temps d'arrêt d'un chauffeur, et nombre minimal de mesures
+HISTORIQUE_JOURS = 30
+MIN_ECHANTILLONS = 5
+# Écart maximal entre deux livraisons pour qu'il compte comme une mesure (pause, trou de service...)
+ECART_MAX_MINUTES = 120
+DUREE_CACHE = 12 * 3600
+DUREE_CACHE_SERVICE = 6 * 3600
+
+
+def _cle_etas(feuille_id):
+    return f'eta:feuille:{feuille_id}'
+
+
+def _cle_arrets(feuille_id):
+    return f'eta:arrets:{feuille_id}'
+
+
+def _cle_service(chauffeur_id):
+    return f'eta:service:{chauffeur_id}'
+
+
+def minutes_trajet(km):
+    return km * FACTEUR_DETOUR / VITESSE_MOYENNE_KMH * 60
+
+
+def temps_arret_minutes(chauffeur_id):
+    """Temps médian passé par le chauffeur à chaque livraison, d'après ses livraisons récentes."""
+    minutes = cache.get(_cle_service(chauffeur_id))
+    if minutes is not None:
+        return minutes
+    livraisons = Livraison.objects.filter(
+        feuille__chauffeur_id=chauffeur_id, statut='livre', date_livraison__isnull=False,
+        date_livraison__gte=timezone.now() - timedelta(days=HISTORIQUE_JOURS),
+    ).order_by('feuille_id', 'date_livraison').values_list(
+        'feuille_id', 'date_livraison', 'client__latitude', 'client__longitude',
+    )
+    mesures = []
+    precedente = None
+    for feuille_id, date_livraison, lat, lng in livraisons:
+        if precedente and precedente[0] == feuille_id:
+            ecart = (date_livraison - precedente[1]).total_seconds() / 60
+            if 0 < ecart <= ECART_MAX_MINUTES:
+                if None not in (lat, lng, precedente[2], precedente[3]):
+                    ecart -= minutes_trajet(distance_km(precedente[2], precedente[3], lat, lng))
+                mesures.append(ecart)
+        precedente = (feuille_id, date_livraison, lat, lng)
+    if len(mesures) >= MIN_ECHANTILLONS:
+        minutes = min(max(statistics.median(mesures), 1), 30)
+    else:
+        minutes = MINUTES_PAR_ARRET
+    cache.set(_cle_service(chauffeur_id), minutes, DUREE_CACHE_SERVICE)
+    return minutes
+
+
+def arrets_restants(feuille_id):
+    """Chauffeur et livraisons restantes de la feuille, dans l'ordre de passage (gardés en cache)."""
+    donnees = cache.get(_cle_arrets(feuille_id))
+    if donnees is None:
+        feuille = FeuilleDeRoute.objects.filter(pk=feuille_id).values(
+            'chauffeur_id', 'last_latitude', 'last_longitude', 'last_position_at',
+        ).first()
+        if feuille is None:
+            return None
+        livraisons = Livraison.objects.filter(feuille_id=feuille_id, statut='en_cours').order_by(
+            F('ordre').asc(nulls_last=True), 'horaire_estime', 'id',
+        ).values_list('id', 'public_token', 'client__latitude', 'client__longitude')
+        donnees = {
+            'chauffeur_id': feuille['chauffeur_id'],
+            'position': (feuille['last_latitude'], feuille['last_longitude'], feuille['last_position_at']),
+            'arrets': [
+                (pk, token, float(lat) if lat is not None else None, float(lng) if lng is not None else None)
+                for pk, token, lat, lng in livraisons
+            ],
+        }
+        cache.set(_cle_arrets(feuille_id), donnees, DUREE_CACHE)
+    return donnees
+
+
+def calculer(depart, heure_depart, arrets, minutes_arret):
+    """ETA de chaque arrêt ``(id, lat, lng)`` depuis ``depart`` (lat, lng) : ``{id: datetime}``.
+
+    Un arrêt sans coordonnées n'a pas d'ETA, mais son temps d'arrêt compte
+    pour les suivants ; la position de référence reste celle d'avant.
+    """
+    etas = {}
+    courant, heure = depart, heure_depart
+    for i, (ident, lat, lng) in enumerate(arrets):
+        if i:
+            heure += timedelta(minutes=minutes_arret)
+        if lat is None or lng is None:
+            continue
+        heure += timedelta(minutes=minutes_trajet(distance_km(courant[0], courant[1], lat, lng)))
+        etas[ident] = heure
+        courant = (lat, lng)
+    return etas
+
+
+def recalculer_feuille(feuille_id, lat=None, lng=None):
+    """Recalcule et met en cache les ETA de la feuille ; pousse les changements aux pages de suivi.
+
+    ``lat``/``lng`` : nouvelle position reçue ; sans elles, la dernière position connue est reprise.
+    """
+    donnees = arrets_restants(feuille_id)
+    if donnees is None:
+        return {}
+    if lat is not None and lng is not None:
+        donnees['position'] = (lat, lng, timezone.now())
+        cache.set(_cle_arrets(feuille_id), donnees, DUREE_CACHE)
+    plat, plng, _ = donnees['position']
+    if plat is None or plng is None:
+        etas = {}
+    else:
+        etas = calculer(
+            (float(plat), float(plng)), timezone.now(),
+            [(pk, a_lat, a_lng) for pk, _, a_lat, a_lng in donnees['arrets']],
+            temps_arret_minutes(donnees['chauffeur_id']),
+        )
+
+    anciennes = cache.get(_cle_etas(feuille_id)) or {}
+    cache.set(_cle_etas(feuille_id), etas, DUREE_CACHE)
+    for pk, token, _, _ in donnees['arrets']:
+        eta, ancienne = etas.get(pk), anciennes.get(pk)
+        # Pas de message pour un écart de moins d'une minute
+        if eta and (ancienne is None or abs((eta - ancienne).total_seconds()) >= 60):
+            diffuseur.publier(sujet_eta(token), {'eta': format_eta(eta), 'date': eta})
+    return etas
+
+
+def format_eta(eta):
+    return dateformat.format(timezone.localtime(eta), 'H:i')
+
+
+def eta_livraison(livraison):
+    """ETA en cache de la livraison, ou None (pas encore de position, livraison terminée...)."""
+    if livraison.statut != 'en_cours':
+        return None
+    return (cache.get(_cle_etas(livraison.feuille_id)) or {}).get(livraison.pk)
+
+
+def prochaines_arrivees(feuille_ids):
+    """Prochaine ETA de chaque feuille, lue dans le cache : ``{feuille_id: datetime}``."""
+    trouvees = cache.get_many([_cle_etas(pk) for pk in feuille_ids])
+    arrivees = {}
+    for pk in feuille_ids:
+        etas = trouvees.get(_cle_etas(pk))
+        if etas:
+            arrivees[pk] = min(etas.values())
+    return arrivees
+
+
+def arrets_modifies(feuille_ids):
+    """À appeler après une écriture sans signal (``bulk_update``) de l'ordre ou du statut des livraisons."""
+    feuille_ids = list(feuille_ids)
+
+    def recalculer():
+        cache.delete_many([_cle_arrets(pk) for pk in feuille_ids])
+        for pk in feuille_ids:
+            if cache.get(_cle_etas(pk)) is not None:
+                recalculer_feuille(pk)
+                # Les ETA des autres livraisons de la feuille ont pu changer
+                suivi.invalider_feuille(pk)
+    transaction.on_commit(recalculer)
+
+
+@receiver(post_save, sender=Livraison)
+@receiver(post_delete, sender=Livraison)
+def _livraison_modifiee(sender, instance, **kwargs):
+    arrets_modifies([instance.feuille_id])
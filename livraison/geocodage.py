@@ -0,0 +1,118 @@
+"""Géocodage hors ligne des adresses clients à partir d'un gazetteer local.
+
+Le gazetteer est un fichier CSV (``settings.GEOCODAGE_GAZETTEER``) avec les
+colonnes ``nom, latitude, longitude`` : quartiers, communes, repères... Une
+même position peut figurer sous plusieurs noms (une ligne par variante).
+
+Une adresse est géocodée sur le nom du gazetteer le plus long (en mots) qu'elle
+contient, sans tenir compte des accents, de la casse ni de la ponctuation :
+« Rue 12, Cocody Riviera 2 » donne « riviera 2 » plutôt que « cocody » si les
+deux figurent dans le fichier. Aucun service externe n'est appelé.
+"""
+import csv
+import os
+import re
+import threading
+import unicodedata
+
+from django.conf import settings
+from django.db import transaction
+
+from . import spatial
+from .models import Client
+
+# Taille des lots envoyés à la base par bulk_update
+TAILLE_LOT = 1000
+
+
+class ErreurGeocodage(Exception):
+    pass
+
+
+def normaliser(texte):
+    """Minuscules, sans accents ni ponctuation : ``"Côte-d'Ivoire"`` -> ``"cote d ivoire"``."""
+    texte = unicodedata.normalize('NFKD', texte or '').encode('ascii', 'ignore').decode().lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', texte))
+
+
+class Gazetteer:
+    def __init__(self, lieux):
+        """``lieux`` : itérable de ``(nom, latitude, longitude)``."""
+        self._lieux = {}
+        for nom, latitude, longitude in lieux:
+            cle = normaliser(nom)
+            if cle:
+                self._lieux[cle] = (float(latitude), float(longitude))
+        self._mots_max = max((cle.count(' ') + 1 for cle in self._lieux), default=0)
+
+    def __len__(self):
+        return len(self._lieux)
+
+    @classmethod
+    def depuis_fichier(cls, chemin):
+        try:
+            with open(chemin, newline='', encoding='utf-8-sig') as fichier:
+                lignes = list(csv.DictReader(fichier))
+        except OSError as e:
+            raise ErreurGeocodage(f"Gazetteer illisible : {e}")
+        try:
+            return cls((ligne['nom'], ligne['latitude'], ligne['longitude']) for ligne in lignes)
+        except (KeyError, TypeError, ValueError):
+            raise ErreurGeocodage("Le gazetteer doit avoir les colonnes nom, latitude, longitude.")
+
+    def geocoder(self, adresse):
+        """Coordonnées ``(latitude, longitude)`` de l'adresse, ou None si aucun lieu n'est reconnu."""
+        mots = normaliser(adresse).split()
+        for taille in range(min(self._mots_max, len(mots)), 0, -1):
+            for debut in range(len(mots) - taille + 1):
+                position = self._lieux.get(' '.join(mots[debut:debut + taille]))
+                if position is not None:
+                    return position
+        return None
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def gazetteer(chemin=None):
+    """Gazetteer configuré, lu une fois par processus (et relu si le fichier change)."""
+    chemin = chemin or getattr(settings, 'GEOCODAGE_GAZETTEER', None)
+    if not chemin:
+        raise ErreurGeocodage("Aucun gazetteer configuré (settings.GEOCODAGE_GAZETTEER).")
+    try:
+        version = os.stat(chemin).st_mtime_ns
+    except OSError as e:
+        raise ErreurGeocodage(f"Gazetteer introuvable : {e}")
+    with _cache_lock:
+        if _cache.get(chemin, (None,))[0] != version:
+            _cache[chemin] = (version, Gazetteer.depuis_fichier(chemin))
+        return _cache[chemin][1]
+
+
+def geocoder_client(client, gaz=None):
+    """Renseigne latitude/longitude du client (sans sauvegarder) ; renvoie True si l'adresse est reconnue."""
+    position = (gaz if gaz is not None else gazetteer()).geocoder(client.adresse)
+    if position is None:
+        return False
+    client.latitude, client.longitude = (round(valeur, 6) for valeur in position)
+    return True
+
+
+def geocoder_clients(clients=None, tous=False, chemin=None):
+    """Géocode les clients (par défaut ceux sans coordonnées) ; renvoie ``(geocodes, non_reconnus)``."""
+    gaz = gazetteer(chemin)
+    if clients is None:
+        clients = Client.objects.all()
+    if not tous:
+        clients = clients.filter(latitude__isnull=True)
+    geocodes, non_reconnus = [], 0
+    for client in clients.only('id', 'adresse').iterator(chunk_size=TAILLE_LOT):
+        if geocoder_client(client, gaz):
+            geocodes.append(client)
+        else:
+            non_reconnus += 1
+    with transaction.atomic():
+        Client.objects.bulk_update(geocodes, ['latitude', 'longitude'], batch_size=TAILLE_LOT)
+        spatial.clients_geocodes([(c.pk, c.latitude, c.longitude) for c in geocodes])
+    return len(geocodes), non_reconnus
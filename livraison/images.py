@@ -0,0 +1,136 @@
+"""Traitement des photos de preuve et signatures envoyées depuis les téléphones.
+
+Les fichiers sont retraités hors du thread de la requête : suppression des
+métadonnées EXIF (après application de l'orientation), redimensionnement
+borné, puis génération d'une miniature WebP affichée par les pages.
+"""
+import logging
+import os
+import queue
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Plus grand côté de l'image conservée et de sa miniature, en pixels
+TAILLE_MAX = 1600
+TAILLE_MINIATURE = 400
+
+CHAMPS_IMAGES = ('preuve_photo', 'signature_client')
+
+_file = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _encoder(image, taille, format, **options):
+    copie = image.copy()
+    copie.thumbnail((taille, taille))
+    buffer = BytesIO()
+    copie.save(buffer, format=format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def traiter_image(livraison, champ):
+    """Réencode l'image ``champ`` de la livraison et crée sa miniature ; renvoie les champs modifiés.
+
+    Les fichiers d'origine ne sont pas supprimés : c'est à l'appelant de le faire
+    une fois les nouveaux noms enregistrés.
+    """
+    fichier = getattr(livraison, champ)
+    if not fichier or Image is None:
+        return {}
+    with fichier.open('rb'):
+        image = Image.open(fichier)
+        image.load()
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            fond = Image.new('RGB', image.size, 'white')
+            fond.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = fond
+        else:
+            image = image.convert('RGB')
+
+    base = os.path.splitext(os.path.basename(fichier.name))[0]
+    # Sans paramètre exif, Pillow n'écrit aucune métadonnée
+    fichier.save(f'{base}.jpg', _encoder(image, TAILLE_MAX, 'JPEG', quality=85, optimize=True, progressive=True), save=False)
+
+    miniature = getattr(livraison, f'{champ}_miniature')
+    miniature.save(f'{base}.webp', _encoder(image, TAILLE_MINIATURE, 'WEBP', quality=75), save=False)
+    return {champ: fichier.name, f'{champ}_miniature': miniature.name}
+
+
+def traiter_livraison(livraison_id, champs):
+    from .models import Livraison
+    from .suivi import invalider_livraisons
+
+    livraison = Livraison.objects.filter(pk=livraison_id).only(
+        'id', *CHAMPS_IMAGES, *(f'{champ}_miniature' for champ in CHAMPS_IMAGES)
+    ).first()
+    if livraison is None:
+        return
+    traitee = False
+    for champ in champs:
+        fichier, miniature = getattr(livraison, champ), getattr(livraison, f'{champ}_miniature')
+        anciens = {champ: fichier.name, f'{champ}_miniature': miniature.name}
+        modifications = traiter_image(livraison, champ)
+        if not modifications:
+            continue
+        # update() plutôt que save() : ne pas écraser un statut modifié entre-temps ;
+        # filtre sur le fichier d'origine : une image envoyée pendant le traitement est gardée
+        if Livraison.objects.filter(pk=livraison_id, **{champ: anciens[champ]}).update(**modifications):
+            traitee = True
+            perimes = [nom for cle, nom in anciens.items() if nom and nom != modifications[cle]]
+        else:
+            # Image remplacée pendant le traitement : la nouvelle reste, ce résultat est jeté
+            perimes = list(modifications.values())
+        for nom in perimes:
+            fichier.storage.delete(nom)
+    if traitee:
+        invalider_livraisons([livraison_id])
+
+
+def _boucle_worker():
+    while True:
+        livraison_id, champs = _file.get()
+        try:
+            close_old_connections()
+            traiter_livraison(livraison_id, champs)
+        except Exception:
+            logger.exception("Échec du traitement des images de la livraison %s", livraison_id)
+        finally:
+            close_old_connections()
+            _file.task_done()
+
+
+def _demarrer_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_boucle_worker, name='traitement-images', daemon=True)
+            _worker.start()
+
+
+def planifier_traitement(livraison, champs):
+    """Programme le traitement des images ``champs`` après la validation de la transaction courante."""
+    champs = [champ for champ in champs if champ in CHAMPS_IMAGES]
+    if not champs:
+        return
+
+    def lancer():
+        if getattr(settings, 'IMAGES_TRAITEMENT_ASYNCHRONE', True):
+            _demarrer_worker()
+            _file.put((livraison.pk, champs))
+        else:
+            traiter_livraison(livraison.pk, champs)
+
+    transaction.on_commit(lancer)
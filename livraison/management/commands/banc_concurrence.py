@@ -0,0 +1,96 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import RequestFactory, override_settings
+
+from livraison import positions, views
+from livraison.models import Chauffeur, Client, FeuilleDeRoute, Livraison
+
+STATUTS = ('en_cours', 'livre')
+
+
+class Command(BaseCommand):
+    help = (
+        "Simule des chauffeurs qui envoient en parallèle positions et statuts de livraison "
+        "sur la base configurée ; affiche le débit et les erreurs de verrou. Les positions "
+        "sont écrites dans la requête, sans tampon. Les données créées pour le banc sont "
+        "supprimées à la fin."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chauffeurs', type=int, default=20, help="Nombre de chauffeurs simulés (un thread chacun)")
+        parser.add_argument('--requetes', type=int, default=50, help="Requêtes par chauffeur, positions et statuts alternés")
+
+    def handle(self, *args, **options):
+        nb_chauffeurs, nb_requetes = options['chauffeurs'], options['requetes']
+        if nb_chauffeurs < 1 or nb_requetes < 1:
+            raise CommandError("--chauffeurs et --requetes doivent être positifs.")
+
+        prefixe = f'banc-{uuid.uuid4().hex[:8]}'
+        client = Client.objects.create(nom=prefixe, adresse='Banc de concurrence', telephone='0')
+        feuilles = []
+        for i in range(nb_chauffeurs):
+            chauffeur = Chauffeur.objects.create(user=User.objects.create(username=f'{prefixe}-{i}'), telephone='0')
+            feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur, statut='en_route')
+            livraison = Livraison.objects.create(feuille=feuille, client=client, reference_commande=prefixe)
+            feuilles.append((feuille.token, livraison.pk))
+
+        durees, verrous, erreurs = [], [], []
+        factory = RequestFactory()
+
+        def chauffeur(numero, token, livraison_pk):
+            try:
+                for i in range(nb_requetes):
+                    if i % 2:
+                        request = factory.post('/', {'statut': STATUTS[i // 2 % 2]}, HTTP_ACCEPT='application/json')
+                        vue, arguments = views.update_livraison_status, {'pk': livraison_pk}
+                    else:
+                        # Un point tous les ~200 m : aucun n'est écarté comme immobile
+                        lat = 5.3 + (numero + i) / 1000
+                        request = factory.post('/', {'lat': f'{lat:.6f}', 'lng': '-4.0'})
+                        vue, arguments = views.update_position, {'token': token}
+                    debut = time.perf_counter()
+                    try:
+                        vue(request, **arguments)
+                    except OperationalError as e:
+                        (verrous if 'locked' in str(e) else erreurs).append(str(e))
+                    else:
+                        durees.append(time.perf_counter() - debut)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=chauffeur, args=(i, *f)) for i, f in enumerate(feuilles)]
+        debut = time.perf_counter()
+        try:
+            # Écriture des positions dans la requête : le banc mesure bien les verrous de la
+            # base, et aucune écriture du tampon ne reste en cours après le nettoyage
+            with override_settings(POSITIONS_INTERVALLE_ECRITURE_S=0):
+                positions.tampon.vider()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            total = time.perf_counter() - debut
+        finally:
+            User.objects.filter(username__startswith=f'{prefixe}-').delete()
+            client.delete()
+
+        moteur = connection.vendor
+        if moteur == 'sqlite':
+            with connection.cursor() as curseur:
+                curseur.execute('PRAGMA journal_mode')
+                moteur += f" (journal {curseur.fetchone()[0]})"
+        self.stdout.write(f"Base : {moteur}, {nb_chauffeurs} chauffeur(s) × {nb_requetes} requête(s)")
+        self.stdout.write(f"{len(durees)} requête(s) réussie(s) en {total:.2f} s : {len(durees) / total:.1f} requêtes/s")
+        if len(durees) > 1:
+            self.stdout.write(
+                f"Durée : médiane {statistics.median(durees) * 1000:.1f} ms, "
+                f"95e centile {statistics.quantiles(durees, n=20)[-1] * 1000:.1f} ms"
+            )
+        style = self.style.ERROR if verrous or erreurs else self.style.SUCCESS
+        self.stdout.write(style(f"{len(verrous)} erreur(s) « database is locked », {len(erreurs)} autre(s) erreur(s) SQL"))
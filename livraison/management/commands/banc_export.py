@@ -0,0 +1,105 @@
+import resource
+import sys
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from admin_dashboard import views
+from livraison.models import Chauffeur, Client, FeuilleDeRoute, Livraison, Produit
+
+# Objets construits en mémoire avant chaque bulk_create
+LOT = 5000
+
+
+def pic_rss_mo():
+    """Pic de mémoire résidente du processus depuis son démarrage, en Mo."""
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, kilo-octets ailleurs
+    return pic / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la mémoire des exports CSV : crée des livraisons par paliers, lit en entier les "
+        "deux exports (livraisons et feuilles de route) à chaque palier et affiche le pic de "
+        "mémoire résidente du processus. Un pic qui ne monte plus d'un palier à l'autre montre "
+        "que la mémoire ne dépend pas du nombre de lignes. Les données créées pour le banc sont "
+        "annulées à la fin."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lignes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help="Nombres de livraisons exportées, un palier par valeur")
+        parser.add_argument('--par-feuille', type=int, default=20, help="Livraisons par feuille de route")
+
+    def handle(self, *args, **options):
+        paliers, par_feuille = sorted(set(options['lignes'])), options['par_feuille']
+        if paliers[0] < 1 or par_feuille < 1:
+            raise CommandError("--lignes et --par-feuille doivent être positifs.")
+
+        # Sans DEBUG : le journal des requêtes fausserait la mesure
+        with override_settings(DEBUG=False), transaction.atomic():
+            prefixe = f'banc-{uuid.uuid4().hex[:8]}'
+            client = Client.objects.create(nom=prefixe, adresse="Banc d'export", telephone='0')
+            produit = Produit.objects.create(nom=prefixe, prix_unitaire=1000)
+            chauffeur = Chauffeur.objects.create(user=User.objects.create(username=prefixe), telephone='0')
+            request = RequestFactory().get('/', {'chauffeur': chauffeur.pk})
+            request.user = User(username=f'{prefixe}-admin', is_staff=True, is_active=True)
+
+            self.stdout.write(f"Pic de mémoire avant le banc : {pic_rss_mo():.1f} Mo")
+            creees = 0
+            for palier in paliers:
+                while creees < palier:
+                    self.creer_lot(chauffeur, client, produit, creees, min(LOT, palier - creees), par_feuille)
+                    creees += min(LOT, palier - creees)
+                avant = pic_rss_mo()
+                debut = time.perf_counter()
+                livraisons = self.lire(views.export_csv_livraisons(request))
+                feuilles = self.lire(views.export_csv_feuilles_route(request))
+                duree = time.perf_counter() - debut
+                self.stdout.write(
+                    f"{livraisons:>9} livraison(s), {feuilles:>7} feuille(s) exportée(s) en {duree:.1f} s : "
+                    f"pic {pic_rss_mo():.1f} Mo (avant l'export {avant:.1f} Mo)"
+                )
+            transaction.set_rollback(True)
+
+    def creer_lot(self, chauffeur, client, produit, deja, nombre, par_feuille):
+        """Crée les livraisons ``deja`` à ``deja + nombre - 1``, ``par_feuille`` par feuille."""
+        # Dates futures : les feuilles du banc restent hors des cumuls des jours clos
+        demain = timezone.localdate() + timedelta(days=1)
+        premiere, derniere = deja // par_feuille, (deja + nombre - 1) // par_feuille
+        feuilles = {}
+        if deja % par_feuille:
+            # Feuille entamée par le lot précédent
+            feuilles[premiere] = self.feuille
+        nouvelles = {
+            n: FeuilleDeRoute(chauffeur=chauffeur, date_route=demain + timedelta(days=n % 365), statut='terminee')
+            for n in range(premiere, derniere + 1) if n not in feuilles
+        }
+        FeuilleDeRoute.objects.bulk_create(nouvelles.values())
+        feuilles.update(nouvelles)
+        self.feuille = feuilles[derniere]
+        livraisons = Livraison.objects.bulk_create([
+            Livraison(
+                feuille=feuilles[n // par_feuille], client=client,
+                reference_commande=f'CMD-{n}', quantite=1 + n % 5, statut='livre',
+            )
+            for n in range(deja, deja + nombre)
+        ])
+        Livraison.produits.through.objects.bulk_create([
+            Livraison.produits.through(livraison_id=livraison.pk, produit_id=produit.pk) for livraison in livraisons
+        ])
+
+    @staticmethod
+    def lire(response):
+        """Consomme la réponse en flux comme le ferait le serveur ; renvoie le nombre de lignes de données."""
+        lignes = -1  # en-tête
+        for morceau in response.streaming_content:
+            lignes += morceau.count(b'\n')
+        return lignes
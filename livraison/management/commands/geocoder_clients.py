@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from livraison.geocodage import ErreurGeocodage, geocoder_clients
+
+
+class Command(BaseCommand):
+    help = "Géocode les adresses clients à partir du gazetteer local (sans service externe)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gazetteer', help="Fichier CSV nom, latitude, longitude (par défaut settings.GEOCODAGE_GAZETTEER)")
+        parser.add_argument('--tous', action='store_true', help="Regéocode aussi les clients qui ont déjà des coordonnées")
+
+    def handle(self, *args, **options):
+        try:
+            geocodes, non_reconnus = geocoder_clients(tous=options['tous'], chemin=options['gazetteer'])
+        except ErreurGeocodage as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{geocodes} client(s) géocodé(s), {non_reconnus} adresse(s) non reconnue(s)."
+        ))
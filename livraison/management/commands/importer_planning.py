@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from livraison.planning import ErreurPlanning, importer_planning, lire_fichier
+
+
+class Command(BaseCommand):
+    help = "Importe un planning (CSV ou XLSX) : feuilles de route, clients et livraisons en masse."
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier', help="Chemin du fichier .csv ou .xlsx")
+        parser.add_argument('--dry-run', action='store_true', help="Valide le fichier sans rien écrire")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['fichier'], 'rb') as fichier:
+                lignes = lire_fichier(fichier)
+        except (OSError, ErreurPlanning) as e:
+            raise CommandError(str(e))
+
+        rapport = importer_planning(lignes, dry_run=options['dry_run'])
+        for erreur in rapport['erreurs']:
+            self.stderr.write(erreur)
+        if rapport['erreurs']:
+            raise CommandError(f"{len(rapport['erreurs'])} ligne(s) invalide(s) : rien n'a été importé.")
+
+        verbe = "seraient créées" if rapport['dry_run'] else "créées"
+        self.stdout.write(self.style.SUCCESS(
+            f"{rapport['feuilles']} feuille(s) de route et {rapport['livraisons']} livraison(s) {verbe}, "
+            f"{rapport['clients_crees']} nouveau(x) client(s)."
+        ))
@@ -0,0 +1,30 @@
+from datetime import date, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from livraison.models import FeuilleDeRoute
+from livraison.tournees import HEURE_DEPART, ErreurTournee, optimiser_feuilles
+
+
+class Command(BaseCommand):
+    help = "Optimise l'ordre de passage et les horaires estimés des feuilles de route d'une date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Date des feuilles (AAAA-MM-JJ), par défaut demain")
+        parser.add_argument('--depart', default=HEURE_DEPART.strftime('%H:%M'), help="Heure de départ des tournées (HH:MM)")
+        parser.add_argument('--processus', type=int, default=1, help="Nombre de processus de calcul")
+
+    def handle(self, *args, **options):
+        try:
+            jour = date.fromisoformat(options['date']) if options['date'] else timezone.localdate() + timedelta(days=1)
+            depart = time.fromisoformat(options['depart'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        feuilles = FeuilleDeRoute.objects.filter(date_route=jour).exclude(statut='terminee')
+        try:
+            nombre = optimiser_feuilles(feuilles, heure_depart=depart, processus=options['processus'])
+        except ErreurTournee as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"{nombre} livraison(s) réordonnée(s) pour le {jour:%d/%m/%Y}."))
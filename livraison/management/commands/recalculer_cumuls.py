@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from livraison.cumuls import reconstruire
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les cumuls journaliers des rapports à partir des feuilles et des livraisons."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debut', help="Première date de route (AAAA-MM-JJ), par défaut tout l'historique")
+        parser.add_argument('--fin', help="Dernière date de route (AAAA-MM-JJ)")
+
+    def handle(self, *args, **options):
+        try:
+            debut = date.fromisoformat(options['debut']) if options['debut'] else None
+            fin = date.fromisoformat(options['fin']) if options['fin'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        lignes = reconstruire(debut, fin)
+        self.stdout.write(self.style.SUCCESS(f"{lignes} cumul(s) journalier(s) recalculé(s)."))
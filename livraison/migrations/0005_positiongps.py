@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0004_vehicule_and_observations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='livraison',
+            name='signature_client',
+            field=models.ImageField(blank=True, null=True, upload_to='signatures/', verbose_name='Signature client (fichier)'),
+        ),
+        migrations.AlterField(
+            model_name='produit',
+            name='prix_unitaire',
+            field=models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Prix unitaire (FCFA)'),
+        ),
+        migrations.CreateModel(
+            name='PositionGPS',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='Latitude')),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='Longitude')),
+                ('precision', models.FloatField(blank=True, null=True, verbose_name='Précision (m)')),
+                ('date_position', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date de la position')),
+                ('feuille', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='livraison.feuillederoute', verbose_name='Feuille de route')),
+            ],
+            options={
+                'verbose_name': 'Position GPS',
+                'verbose_name_plural': 'Positions GPS',
+                'ordering': ['feuille', 'date_position'],
+                'indexes': [models.Index(fields=['feuille', 'date_position'], name='livraison_p_feuille_840356_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0005_positiongps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation_id', models.UUIDField(unique=True, verbose_name="Identifiant de l'opération")),
+                ('date_application', models.DateTimeField(auto_now_add=True, verbose_name="Date d'application")),
+                ('feuille', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operations_sync', to='livraison.feuillederoute', verbose_name='Feuille de route')),
+                ('livraison', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='livraison.livraison', verbose_name='Livraison')),
+            ],
+            options={
+                'verbose_name': 'Opération synchronisée',
+                'verbose_name_plural': 'Opérations synchronisées',
+            },
+        ),
+    ]
@@ -0,0 +1,112 @@
+import base64
+import binascii
+import logging
+import re
+import urllib.parse
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+# Copie figée du décodeur de livraison.signatures, pour que la migration ne
+# change pas avec le code de l'application
+DATA_URL_RE = re.compile(r'^data:image/(png|jpeg|webp|svg\+xml)(;base64)?,(.*)$', re.DOTALL)
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp', 'svg+xml': 'svg'}
+TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+# Valeurs non converties : gardées telles quelles dans ce dossier du stockage
+DOSSIER_NON_CONVERTIES = 'signatures/tactiles/non_converties'
+
+
+def _decoder(valeur):
+    """(contenu, extension) de la signature stockée dans la ligne, ou None si elle n'est pas lisible."""
+    valeur = valeur.strip()
+    # SVG brut, sans data URL
+    if valeur.startswith(('<svg', '<?xml')):
+        return valeur.encode(), 'svg'
+    match = DATA_URL_RE.match(valeur)
+    if not match:
+        return None
+    format, en_base64, donnees = match.groups()
+    try:
+        contenu = base64.b64decode(donnees, validate=True) if en_base64 else urllib.parse.unquote_to_bytes(donnees)
+    except (binascii.Error, ValueError):
+        return None
+    if not contenu:
+        return None
+    extension = EXTENSIONS[format]
+    if extension == 'svg':
+        return contenu, extension
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return contenu, extension
+    try:
+        image = Image.open(BytesIO(contenu))
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        return None
+    buffer = BytesIO()
+    image.convert('LA').save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue(), 'png'
+
+
+def signatures_vers_fichiers(apps, schema_editor):
+    """Enregistre comme fichiers les signatures stockées dans la ligne (base64 ou SVG).
+
+    Une valeur illisible n'est pas perdue : elle est écrite telle quelle dans
+    ``DOSSIER_NON_CONVERTIES`` et signalée dans les logs.
+    """
+    Livraison = apps.get_model('livraison', 'Livraison')
+    livraisons = Livraison.objects.exclude(signature_tactile='').only('id', 'signature_tactile')
+    for livraison in livraisons.iterator(chunk_size=500):
+        decodee = _decoder(livraison.signature_tactile)
+        fichier = livraison.signature_tactile_fichier
+        if decodee is None:
+            nom = fichier.storage.save(
+                f'{DOSSIER_NON_CONVERTIES}/signature_{livraison.pk}.txt',
+                ContentFile(livraison.signature_tactile.encode()),
+            )
+            logger.warning("Signature de la livraison %s non convertie, valeur d'origine gardée dans %s", livraison.pk, nom)
+            continue
+        contenu, extension = decodee
+        fichier.save(f'signature_{livraison.pk}.{extension}', ContentFile(contenu), save=False)
+        Livraison.objects.filter(pk=livraison.pk).update(signature_tactile_fichier=fichier.name)
+
+
+def fichiers_vers_signatures(apps, schema_editor):
+    Livraison = apps.get_model('livraison', 'Livraison')
+    livraisons = Livraison.objects.exclude(signature_tactile_fichier='').exclude(signature_tactile_fichier=None)
+    for livraison in livraisons.iterator(chunk_size=500):
+        fichier = livraison.signature_tactile_fichier
+        type_mime = TYPES.get(fichier.name.rsplit('.', 1)[-1].lower(), 'image/png')
+        with fichier.open('rb') as contenu:
+            data_url = f'data:{type_mime};base64,' + base64.b64encode(contenu.read()).decode()
+        Livraison.objects.filter(pk=livraison.pk).update(signature_tactile=data_url)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0006_operationsync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='livraison',
+            name='signature_tactile_fichier',
+            field=models.ImageField(blank=True, null=True, upload_to='signatures/tactiles/', verbose_name='Signature tactile'),
+        ),
+        migrations.RunPython(signatures_vers_fichiers, fichiers_vers_signatures),
+        migrations.RemoveField(
+            model_name='livraison',
+            name='signature_tactile',
+        ),
+        migrations.RenameField(
+            model_name='livraison',
+            old_name='signature_tactile_fichier',
+            new_name='signature_tactile',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0007_signature_tactile_fichier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='livraison',
+            name='preuve_photo_miniature',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='preuves/miniatures/', verbose_name='Miniature preuve photo'),
+        ),
+        migrations.AddField(
+            model_name='livraison',
+            name='signature_client_miniature',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='signatures/miniatures/', verbose_name='Miniature signature client'),
+        ),
+    ]
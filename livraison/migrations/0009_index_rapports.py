@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0008_miniatures_images'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feuillederoute',
+            index=models.Index(fields=['date_route', 'chauffeur'], name='feuille_date_chauffeur_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feuillederoute',
+            index=models.Index(fields=['date_route', 'statut'], name='feuille_date_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='livraison',
+            index=models.Index(fields=['feuille', 'statut'], name='livraison_feuille_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='livraison',
+            index=models.Index(fields=['date_livraison'], name='livraison_date_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0009_index_rapports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True, verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True, verbose_name='Longitude'),
+        ),
+        migrations.AddField(
+            model_name='livraison',
+            name='ordre',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ordre de passage'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def calculer_cumuls(apps, schema_editor):
+    FeuilleDeRoute = apps.get_model('livraison', 'FeuilleDeRoute')
+    Livraison = apps.get_model('livraison', 'Livraison')
+    CumulJournalier = apps.get_model('livraison', 'CumulJournalier')
+    CumulProduitJournalier = apps.get_model('livraison', 'CumulProduitJournalier')
+    lignes = FeuilleDeRoute.objects.filter(date_route__isnull=False).values(
+        'date_route', 'chauffeur_id', 'vehicule_id', 'statut',
+    ).annotate(
+        nb_feuilles=Count('id', distinct=True),
+        nb_en_cours=Count('livraisons', filter=Q(livraisons__statut='en_cours')),
+        nb_livre=Count('livraisons', filter=Q(livraisons__statut='livre')),
+        nb_probleme=Count('livraisons', filter=Q(livraisons__statut='probleme')),
+        quantite_livree=Coalesce(Sum('livraisons__quantite', filter=Q(livraisons__statut='livre')), 0),
+    ).order_by()
+    CumulJournalier.objects.bulk_create(
+        [CumulJournalier(date=l.pop('date_route'), **l) for l in lignes], batch_size=1000,
+    )
+    ventes = Livraison.produits.through.objects.filter(
+        livraison__feuille__date_route__isnull=False, livraison__statut='livre',
+    ).values('livraison__feuille__date_route', 'livraison__feuille__chauffeur_id', 'produit_id').annotate(
+        quantite=Sum('livraison__quantite'),
+    ).order_by()
+    CumulProduitJournalier.objects.bulk_create([
+        CumulProduitJournalier(
+            date=v['livraison__feuille__date_route'], chauffeur_id=v['livraison__feuille__chauffeur_id'],
+            produit_id=v['produit_id'], quantite=v['quantite'],
+        )
+        for v in ventes
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0010_coordonnees_clients_ordre'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CumulJournalier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date de route')),
+                ('statut', models.CharField(choices=[('planifie', 'Planifié'), ('en_route', 'En route'), ('terminee', 'Terminée'), ('probleme', 'Problème')], max_length=20, verbose_name='Statut de la feuille')),
+                ('nb_feuilles', models.PositiveIntegerField(default=0, verbose_name='Feuilles')),
+                ('nb_en_cours', models.PositiveIntegerField(default=0, verbose_name='Livraisons en cours')),
+                ('nb_livre', models.PositiveIntegerField(default=0, verbose_name='Livraisons livrées')),
+                ('nb_probleme', models.PositiveIntegerField(default=0, verbose_name='Livraisons en problème')),
+                ('quantite_livree', models.PositiveIntegerField(default=0, verbose_name='Quantité livrée')),
+                ('chauffeur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='livraison.chauffeur', verbose_name='Chauffeur')),
+                ('vehicule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='livraison.vehicule', verbose_name='Véhicule')),
+            ],
+            options={
+                'verbose_name': 'Cumul journalier',
+                'verbose_name_plural': 'Cumuls journaliers',
+                'indexes': [models.Index(fields=['date', 'chauffeur'], name='cumul_date_chauffeur_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CumulProduitJournalier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date de route')),
+                ('quantite', models.PositiveIntegerField(default=0, verbose_name='Quantité livrée')),
+                ('chauffeur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='livraison.chauffeur', verbose_name='Chauffeur')),
+                ('produit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='livraison.produit', verbose_name='Produit')),
+            ],
+            options={
+                'verbose_name': 'Cumul journalier par produit',
+                'verbose_name_plural': 'Cumuls journaliers par produit',
+                'indexes': [models.Index(fields=['date', 'chauffeur'], name='cumul_produit_date_idx')],
+            },
+        ),
+        migrations.RunPython(calculer_cumuls, migrations.RunPython.noop),
+    ]
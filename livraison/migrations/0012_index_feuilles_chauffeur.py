@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraison', '0011_cumuls_journaliers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feuillederoute',
+            index=models.Index(fields=['chauffeur', 'date_route'], name='feuille_chauffeur_date_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, Count, F, Q, Value, When
 from django.contrib.auth.models import User
 from django.utils import timezone
 import uuid
@@ -54,6 +55,8 @@ class Client(models.Model):
     nom = models.CharField(max_length=100)
     adresse = models.TextField()
     telephone = models.CharField(max_length=15)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, verbose_name="Latitude")
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, verbose_name="Longitude")
 
     def __str__(self):
         return self.nom
@@ -104,6 +107,25 @@ STATUTS_FEUILLE = [
 ]
 
 
+class FeuilleDeRouteQuerySet(models.QuerySet):
+    def with_status_summary(self):
+        """Annote chaque feuille avec ses compteurs de livraisons et sa couleur,
+        calculés en une seule requête (COUNT conditionnels sur livraisons__statut)."""
+        return self.annotate(
+            nb_livraisons=Count('livraisons'),
+            nb_livre=Count('livraisons', filter=Q(livraisons__statut='livre')),
+            nb_probleme=Count('livraisons', filter=Q(livraisons__statut='probleme')),
+        ).annotate(
+            nb_en_cours=F('nb_livraisons') - F('nb_livre') - F('nb_probleme'),
+            couleur=Case(
+                When(nb_probleme__gt=0, then=Value('red')),
+                When(nb_livraisons__gt=0, nb_livre=F('nb_livraisons'), then=Value('green')),
+                default=Value('orange'),
+                output_field=models.CharField(),
+            ),
+        )
+
+
 class FeuilleDeRoute(models.Model):
     chauffeur = models.ForeignKey(Chauffeur, on_delete=models.CASCADE, verbose_name="Chauffeur")
     vehicule = models.ForeignKey(Vehicule, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Véhicule assigné")
@@ -122,26 +144,71 @@ class FeuilleDeRoute(models.Model):
     last_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, verbose_name="Longitude")
     last_position_at = models.DateTimeField(null=True, blank=True, verbose_name="Dernière position")
 
+    objects = FeuilleDeRouteQuerySet.as_manager()
+
     def __str__(self):
         return f"Feuille {self.id} - {self.chauffeur}"
 
+    @property
+    def status_summary(self):
+        """Résumé total/livre/probleme/en_cours/color, à partir de with_status_summary()."""
+        return {
+            'total': self.nb_livraisons,
+            'livre': self.nb_livre,
+            'probleme': self.nb_probleme,
+            'en_cours': self.nb_en_cours,
+            'color': self.couleur,
+        }
+
     def get_driver_url(self):
         return f"/livraison/feuille/{self.token}/"
 
-    def save(self, *args, **kwargs):
-        creating = self._state.adding
-        super().save(*args, **kwargs)
-        if (creating or not self.qr_code) and qrcode:
-            img = qrcode.make(self.get_driver_url())
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            filename = f"feuille_{self.pk}.png"
-            self.qr_code.save(filename, ContentFile(buffer.getvalue()), save=False)
-            super().save(update_fields=['qr_code'])
+    def get_qr_code_url(self):
+        return f"/livraison/feuille/{self.token}/qr.png"
+
+    def generer_qr_code(self):
+        """Génère le QR code de la feuille et l'enregistre sur disque ; renvoie False sans qrcode.
+
+        Le QR code n'est plus produit à chaque save() : il est créé à la première
+        demande (voir livraison.views.qr_code), ce qui garde les créations en masse rapides.
+        """
+        if qrcode is None:
+            return False
+        img = qrcode.make(self.get_driver_url())
+        buffer = BytesIO()
+        img.save(buffer, format='PNG')
+        self.qr_code.save(f"feuille_{self.token}.png", ContentFile(buffer.getvalue()), save=False)
+        FeuilleDeRoute.objects.filter(pk=self.pk).update(qr_code=self.qr_code.name)
+        return True
 
     class Meta:
         verbose_name = "Feuille de route"
         verbose_name_plural = "Feuilles de route"
+        indexes = [
+            # Tableau de bord du jour et rapports : filtre par date puis chauffeur ou statut
+            models.Index(fields=['date_route', 'chauffeur'], name='feuille_date_chauffeur_idx'),
+            models.Index(fields=['date_route', 'statut'], name='feuille_date_statut_idx'),
+            # Accueil du chauffeur : ses feuilles les plus récentes, par pages
+            models.Index(fields=['chauffeur', 'date_route'], name='feuille_chauffeur_date_idx'),
+        ]
+
+
+class PositionGPS(models.Model):
+    """Historique des positions GPS d'une feuille de route (ajout seul)."""
+    feuille = models.ForeignKey(FeuilleDeRoute, on_delete=models.CASCADE, related_name="positions", verbose_name="Feuille de route")
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, verbose_name="Latitude")
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, verbose_name="Longitude")
+    precision = models.FloatField(null=True, blank=True, verbose_name="Précision (m)")
+    date_position = models.DateTimeField(default=timezone.now, verbose_name="Date de la position")
+
+    def __str__(self):
+        return f"{self.feuille_id} @ {self.latitude}, {self.longitude} ({self.date_position:%H:%M:%S})"
+
+    class Meta:
+        verbose_name = "Position GPS"
+        verbose_name_plural = "Positions GPS"
+        ordering = ['feuille', 'date_position']
+        indexes = [models.Index(fields=['feuille', 'date_position'])]
 
 
 STATUTS_LIVRAISON = [
@@ -157,10 +224,13 @@ class Livraison(models.Model):
     reference_commande = models.CharField(max_length=50, verbose_name="Référence commande")
     quantite = models.PositiveIntegerField(default=1, verbose_name="Quantité")
     horaire_estime = models.TimeField(blank=True, null=True, verbose_name="Horaire estimé")
+    ordre = models.PositiveIntegerField(blank=True, null=True, verbose_name="Ordre de passage")
     statut = models.CharField(max_length=20, choices=STATUTS_LIVRAISON, default='en_cours', verbose_name="Statut")
     preuve_photo = models.ImageField(upload_to="preuves/", blank=True, null=True, verbose_name="Preuve photo")
     signature_client = models.ImageField(upload_to="signatures/", blank=True, null=True, verbose_name="Signature client (fichier)")
-    signature_tactile = models.TextField(blank=True, verbose_name="Signature tactile (SVG)")
+    preuve_photo_miniature = models.ImageField(upload_to="preuves/miniatures/", blank=True, null=True, editable=False, verbose_name="Miniature preuve photo")
+    signature_client_miniature = models.ImageField(upload_to="signatures/miniatures/", blank=True, null=True, editable=False, verbose_name="Miniature signature client")
+    signature_tactile = models.ImageField(upload_to="signatures/tactiles/", blank=True, null=True, verbose_name="Signature tactile")
     date_livraison = models.DateTimeField(blank=True, null=True, verbose_name="Date de livraison")
     public_token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     
@@ -175,6 +245,76 @@ class Livraison(models.Model):
     def get_public_url(self):
         return f"/livraison/track/{self.public_token}/"
 
+    @property
+    def preuve_photo_miniature_url(self):
+        """Miniature WebP si le traitement est fait, sinon la photo d'origine."""
+        if self.preuve_photo_miniature:
+            return self.preuve_photo_miniature.url
+        return self.preuve_photo.url if self.preuve_photo else None
+
+    @property
+    def signature_client_miniature_url(self):
+        if self.signature_client_miniature:
+            return self.signature_client_miniature.url
+        return self.signature_client.url if self.signature_client else None
+
     class Meta:
         verbose_name = "Livraison"
-        verbose_name_plural = "Livraisons"
\ No newline at end of file
+        verbose_name_plural = "Livraisons"
+        indexes = [
+            # Compteurs par feuille (COUNT filtrés sur le statut) et rapports par statut
+            models.Index(fields=['feuille', 'statut'], name='livraison_feuille_statut_idx'),
+            models.Index(fields=['date_livraison'], name='livraison_date_idx'),
+        ]
+
+
+class OperationSync(models.Model):
+    """Opération hors-ligne déjà appliquée : permet d'ignorer les renvois d'un même lot."""
+    operation_id = models.UUIDField(unique=True, verbose_name="Identifiant de l'opération")
+    feuille = models.ForeignKey(FeuilleDeRoute, on_delete=models.CASCADE, related_name="operations_sync", verbose_name="Feuille de route")
+    livraison = models.ForeignKey(Livraison, on_delete=models.CASCADE, verbose_name="Livraison")
+    date_application = models.DateTimeField(auto_now_add=True, verbose_name="Date d'application")
+
+    def __str__(self):
+        return str(self.operation_id)
+
+    class Meta:
+        verbose_name = "Opération synchronisée"
+        verbose_name_plural = "Opérations synchronisées"
+
+
+class CumulJournalier(models.Model):
+    """Compteurs d'une journée par chauffeur, véhicule et statut de feuille (voir livraison.cumuls)."""
+    date = models.DateField(verbose_name="Date de route")
+    chauffeur = models.ForeignKey(Chauffeur, on_delete=models.CASCADE, verbose_name="Chauffeur")
+    vehicule = models.ForeignKey(Vehicule, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Véhicule")
+    statut = models.CharField(max_length=20, choices=STATUTS_FEUILLE, verbose_name="Statut de la feuille")
+    nb_feuilles = models.PositiveIntegerField(default=0, verbose_name="Feuilles")
+    nb_en_cours = models.PositiveIntegerField(default=0, verbose_name="Livraisons en cours")
+    nb_livre = models.PositiveIntegerField(default=0, verbose_name="Livraisons livrées")
+    nb_probleme = models.PositiveIntegerField(default=0, verbose_name="Livraisons en problème")
+    quantite_livree = models.PositiveIntegerField(default=0, verbose_name="Quantité livrée")
+
+    def __str__(self):
+        return f"{self.date} - {self.chauffeur_id} - {self.statut}"
+
+    class Meta:
+        verbose_name = "Cumul journalier"
+        verbose_name_plural = "Cumuls journaliers"
+        indexes = [models.Index(fields=['date', 'chauffeur'], name='cumul_date_chauffeur_idx')]
+
+
+class CumulProduitJournalier(models.Model):
+    """Quantité livrée d'un produit par journée et chauffeur ; le montant est calculé au prix actuel."""
+    date = models.DateField(verbose_name="Date de route")
+    chauffeur = models.ForeignKey(Chauffeur, on_delete=models.CASCADE, verbose_name="Chauffeur")
+    produit = models.ForeignKey(Produit, on_delete=models.CASCADE, verbose_name="Produit")
+    quantite = models.PositiveIntegerField(default=0, verbose_name="Quantité livrée")
+
+    def __str__(self):
+        return f"{self.date} - {self.chauffeur_id} - {self.produit_id}"
+
+    class Meta:
+        verbose_name = "Cumul journalier par produit"
+        verbose_name_plural = "Cumuls journaliers par produit"
+        indexes = [models.Index(fields=['date', 'chauffeur'], name='cumul_produit_date_idx')]
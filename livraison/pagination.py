@@ -0,0 +1,48 @@
+"""Pagination par clé des listes triées par date décroissante puis id décroissant.
+
+La page suivante repart après la dernière ligne lue (le « curseur » : sa date
+et son id) au lieu de sauter un OFFSET, si bien que son coût ne dépend pas de
+la profondeur de la page.
+"""
+from datetime import date
+from operator import attrgetter
+
+from django.db.models import F, Q
+
+TAILLE_PAGE = 50
+
+
+def lire_curseur(curseur):
+    """``"AAAA-MM-JJ.id"`` (date vide pour une ligne sans date) -> ``(date, id)`` ; None si invalide."""
+    jour, _, pk = (curseur or '').partition('.')
+    try:
+        return (date.fromisoformat(jour) if jour else None), int(pk)
+    except ValueError:
+        return None
+
+
+def ecrire_curseur(jour, pk):
+    return f"{jour.isoformat() if jour else ''}.{pk}"
+
+
+def page(queryset, curseur=None, champ='date_route', taille=TAILLE_PAGE):
+    """Page de ``queryset`` triée par ``champ`` (date) décroissant, sans date en dernier, puis id décroissant.
+
+    ``curseur`` : celui renvoyé pour la page précédente (None pour la première).
+    Renvoie ``(lignes, curseur de la page suivante ou None)``.
+    """
+    queryset = queryset.order_by(F(champ).desc(nulls_last=True), '-pk')
+    position = lire_curseur(curseur)
+    if position is not None:
+        jour, pk = position
+        if jour is None:
+            queryset = queryset.filter(Q(**{f'{champ}__isnull': True}), pk__lt=pk)
+        else:
+            queryset = queryset.filter(
+                Q(**{f'{champ}__lt': jour}) | Q(**{champ: jour, 'pk__lt': pk}) | Q(**{f'{champ}__isnull': True})
+            )
+    lignes = list(queryset[:taille + 1])
+    if len(lignes) <= taille:
+        return lignes, None
+    derniere = lignes[taille - 1]
+    return lignes[:taille], ecrire_curseur(attrgetter(champ.replace('__', '.'))(derniere), derniere.pk)
@@ -0,0 +1,204 @@
+"""Import en masse du planning du soir (feuilles de route, clients, livraisons).
+
+Une ligne du fichier = une livraison. Colonnes reconnues :
+
+    chauffeur, date_route, vehicule, client, adresse, telephone,
+    reference_commande, quantite, horaire_estime, produits, sacs, notes
+
+``chauffeur`` est le nom d'utilisateur, ``vehicule`` l'immatriculation
+(optionnelle), ``produits`` et ``sacs`` des noms séparés par ``;``. Les
+lignes d'un même chauffeur, d'une même date et d'un même véhicule forment
+une feuille de route. Les clients inconnus sont créés (adresse et
+téléphone obligatoires) et géocodés si un gazetteer est configuré
+(voir ``livraison.geocodage``).
+
+Toutes les références sont résolues en amont par quelques requêtes ``IN``,
+puis l'écriture se fait par ``bulk_create`` dans une seule transaction :
+rien n'est écrit si une ligne est invalide.
+"""
+from datetime import date, datetime, time
+
+from django.db import transaction
+
+from . import cumuls, spatial
+from .geocodage import ErreurGeocodage, gazetteer, geocoder_client
+from .models import Chauffeur, Client, FeuilleDeRoute, Livraison, Produit, Sac, Vehicule
+
+try:
+    import tablib
+except ImportError:
+    tablib = None
+
+# Taille des lots envoyés à la base par bulk_create
+TAILLE_LOT = 1000
+
+COLONNES_OBLIGATOIRES = ('chauffeur', 'date_route', 'client', 'reference_commande')
+
+
+class ErreurPlanning(Exception):
+    pass
+
+
+def lire_fichier(fichier, format=None):
+    """Lit un fichier CSV ou XLSX en liste de dicts (une par ligne) via tablib."""
+    if tablib is None:
+        raise ErreurPlanning("tablib (installé avec django-import-export) est requis pour lire le fichier.")
+    nom = getattr(fichier, 'name', '') or ''
+    format = format or ('xlsx' if nom.lower().endswith('.xlsx') else 'csv')
+    contenu = fichier.read()
+    if format == 'csv' and isinstance(contenu, bytes):
+        contenu = contenu.decode('utf-8-sig')
+    try:
+        dataset = tablib.Dataset().load(contenu, format=format)
+    except Exception as e:
+        raise ErreurPlanning(f"Fichier illisible ({format}) : {e}")
+    entetes = [str(h or '').strip().lower() for h in dataset.headers or []]
+    return [dict(zip(entetes, ligne)) for ligne in dataset]
+
+
+def _texte(valeur):
+    return '' if valeur is None else str(valeur).strip()
+
+
+def _noms(valeur):
+    return [nom.strip() for nom in _texte(valeur).split(';') if nom.strip()]
+
+
+def _date(valeur):
+    if isinstance(valeur, datetime):
+        return valeur.date()
+    if isinstance(valeur, date):
+        return valeur
+    texte = _texte(valeur)
+    try:
+        return date.fromisoformat(texte)
+    except ValueError:
+        return datetime.strptime(texte, '%d/%m/%Y').date()
+
+
+def _heure(valeur):
+    if isinstance(valeur, datetime):
+        return valeur.time()
+    if isinstance(valeur, time) or valeur in (None, ''):
+        return valeur or None
+    return time.fromisoformat(_texte(valeur))
+
+
+def importer_planning(lignes, dry_run=False):
+    """Valide puis importe les lignes du planning.
+
+    Renvoie un dict ``{'feuilles', 'livraisons', 'clients_crees', 'erreurs', 'dry_run'}``.
+    En cas d'erreur (ou en ``dry_run``), rien n'est écrit et ``erreurs``
+    contient des messages préfixés par le numéro de ligne du fichier.
+    """
+    lignes = list(lignes)
+    erreurs = []
+
+    # Tables de correspondance, chargées en une requête chacune
+    usernames, immatriculations, noms_clients, noms_produits, noms_sacs = set(), set(), set(), set(), set()
+    for ligne in lignes:
+        usernames.add(_texte(ligne.get('chauffeur')))
+        immatriculations.add(_texte(ligne.get('vehicule')))
+        noms_clients.add(_texte(ligne.get('client')))
+        noms_produits.update(_noms(ligne.get('produits')))
+        noms_sacs.update(_noms(ligne.get('sacs')))
+    chauffeurs = {c.user.username: c for c in Chauffeur.objects.select_related('user').filter(user__username__in=usernames)}
+    vehicules = {v.immatriculation: v for v in Vehicule.objects.filter(immatriculation__in=immatriculations)}
+    clients = {c.nom: c for c in Client.objects.filter(nom__in=noms_clients).order_by('id')}
+    produits = {p.nom: p for p in Produit.objects.filter(nom__in=noms_produits, actif=True)}
+    sacs = {s.nom: s for s in Sac.objects.filter(nom__in=noms_sacs, actif=True)}
+
+    nouveaux_clients = {}
+    feuilles = {}
+    livraisons = []  # (clé feuille, nom du client, Livraison, noms produits, noms sacs)
+    for numero, ligne in enumerate(lignes, start=2):
+        manquantes = [col for col in COLONNES_OBLIGATOIRES if not _texte(ligne.get(col))]
+        if manquantes:
+            erreurs.append(f"Ligne {numero} : colonne(s) manquante(s) {', '.join(manquantes)}")
+            continue
+        try:
+            date_route = _date(ligne.get('date_route'))
+            horaire = _heure(ligne.get('horaire_estime'))
+            quantite = int(_texte(ligne.get('quantite')) or 1)
+            if quantite < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            erreurs.append(f"Ligne {numero} : date, horaire ou quantité invalide")
+            continue
+
+        username = _texte(ligne['chauffeur'])
+        if username not in chauffeurs:
+            erreurs.append(f"Ligne {numero} : chauffeur inconnu « {username} »")
+            continue
+        immatriculation = _texte(ligne.get('vehicule'))
+        if immatriculation and immatriculation not in vehicules:
+            erreurs.append(f"Ligne {numero} : véhicule inconnu « {immatriculation} »")
+            continue
+        inconnus = [nom for nom in _noms(ligne.get('produits')) if nom not in produits]
+        inconnus += [nom for nom in _noms(ligne.get('sacs')) if nom not in sacs]
+        if inconnus:
+            erreurs.append(f"Ligne {numero} : produit(s)/sac(s) inconnu(s) {', '.join(inconnus)}")
+            continue
+
+        nom_client = _texte(ligne['client'])
+        if nom_client not in clients and nom_client not in nouveaux_clients:
+            adresse, telephone = _texte(ligne.get('adresse')), _texte(ligne.get('telephone'))
+            if not adresse or not telephone:
+                erreurs.append(f"Ligne {numero} : nouveau client « {nom_client} » sans adresse ou téléphone")
+                continue
+            nouveaux_clients[nom_client] = Client(nom=nom_client, adresse=adresse, telephone=telephone[:15])
+
+        cle = (username, date_route, immatriculation)
+        if cle not in feuilles:
+            feuilles[cle] = FeuilleDeRoute(
+                chauffeur=chauffeurs[username], vehicule=vehicules.get(immatriculation), date_route=date_route,
+            )
+        livraisons.append((cle, nom_client, Livraison(
+            reference_commande=_texte(ligne['reference_commande'])[:50],
+            quantite=quantite,
+            horaire_estime=horaire,
+            notes=_texte(ligne.get('notes')),
+        ), _noms(ligne.get('produits')), _noms(ligne.get('sacs'))))
+
+    rapport = {
+        'feuilles': len(feuilles),
+        'livraisons': len(livraisons),
+        'clients_crees': len(nouveaux_clients),
+        'erreurs': erreurs,
+        'dry_run': dry_run,
+    }
+    if erreurs or dry_run:
+        return rapport
+
+    try:
+        gaz = gazetteer()
+    except ErreurGeocodage:
+        gaz = None
+    if gaz is not None:
+        for client in nouveaux_clients.values():
+            geocoder_client(client, gaz)
+
+    with transaction.atomic():
+        Client.objects.bulk_create(nouveaux_clients.values(), batch_size=TAILLE_LOT)
+        spatial.clients_geocodes([
+            (c.pk, c.latitude, c.longitude) for c in nouveaux_clients.values() if c.latitude is not None
+        ])
+        clients.update(nouveaux_clients)
+        FeuilleDeRoute.objects.bulk_create(feuilles.values(), batch_size=TAILLE_LOT)
+        for cle, nom_client, livraison, _, _ in livraisons:
+            livraison.feuille = feuilles[cle]
+            livraison.client = clients[nom_client]
+        Livraison.objects.bulk_create([l for _, _, l, _, _ in livraisons], batch_size=TAILLE_LOT)
+
+        LivraisonProduit = Livraison.produits.through
+        LivraisonSac = Livraison.sacs.through
+        LivraisonProduit.objects.bulk_create([
+            LivraisonProduit(livraison_id=livraison.pk, produit_id=produits[nom].pk)
+            for _, _, livraison, noms, _ in livraisons for nom in dict.fromkeys(noms)
+        ], batch_size=TAILLE_LOT)
+        LivraisonSac.objects.bulk_create([
+            LivraisonSac(livraison_id=livraison.pk, sac_id=sacs[nom].pk)
+            for _, _, livraison, _, noms in livraisons for nom in dict.fromkeys(noms)
+        ], batch_size=TAILLE_LOT)
+        cumuls.feuilles_modifiees(f.pk for f in feuilles.values())
+    return rapport
@@ -0,0 +1,196 @@
+"""Tampon des positions GPS envoyées par les téléphones des chauffeurs.
+
+Chaque téléphone envoie sa position toutes les minutes, qu'il ait bougé ou
+non. Plutôt qu'une insertion et un UPDATE de la feuille à chaque envoi :
+
+* un point à moins de ``POSITIONS_DISTANCE_MIN_M`` mètres du dernier point
+  gardé pour la feuille, et reçu moins de ``POSITIONS_DELAI_MAX_S`` secondes
+  après lui, est ignoré (un chauffeur à l'arrêt est « vu » une fois par délai) ;
+* les points gardés attendent en mémoire et sont écrits par un thread de fond
+  toutes les ``POSITIONS_INTERVALLE_ECRITURE_S`` secondes : un ``bulk_create``
+  de l'historique et un ``bulk_update`` des dernières positions des feuilles.
+
+Les ETA, la carte de la flotte, l'index spatial et le cache des pages de suivi
+sont mis à jour à l'écriture. Les écritures suivent donc les déplacements et non
+la taille de la flotte ; en contrepartie, un arrêt brutal du processus perd au
+plus un intervalle de points. Chaque processus a son propre tampon.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from . import eta, spatial, suivi
+from .diffusion import SUJET_FLOTTE, diffuseur, sujet_feuille
+from .models import FeuilleDeRoute, PositionGPS
+
+logger = logging.getLogger(__name__)
+
+CHAMPS_POSITION = ['last_latitude', 'last_longitude', 'last_position_at']
+# Points gardés en mémoire au plus quand les écritures échouent (base indisponible)
+MAX_EN_ATTENTE = 100_000
+
+
+def _reglage(nom, defaut):
+    return getattr(settings, nom, defaut)
+
+
+class TamponPositions:
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._reperes = {}  # feuille -> dernier point gardé (lat, lng, date)
+        self._historique = []  # PositionGPS à insérer
+        self._dernieres = {}  # feuille -> point le plus récent à écrire sur la feuille
+
+    def __len__(self):
+        return len(self._historique)
+
+    def _garder(self, repere, position):
+        lat, lng, date = repere or (None, None, None)
+        if lat is None or lng is None:
+            return True
+        if abs((position.date_position - date).total_seconds()) >= _reglage('POSITIONS_DELAI_MAX_S', 300):
+            return True
+        distance_m = spatial.distance_km(float(lat), float(lng), float(position.latitude), float(position.longitude)) * 1000
+        return distance_m >= _reglage('POSITIONS_DISTANCE_MIN_M', 25)
+
+    def ajouter(self, feuille, positions):
+        """Met en attente les positions de la feuille qui la font bouger ; renvoie le nombre gardé.
+
+        ``feuille`` doit avoir sa dernière position chargée : elle sert de repère
+        tant que le tampon n'en connaît pas de plus récente.
+        """
+        gardees = 0
+        with self._verrou:
+            repere = self._reperes.get(feuille.pk)
+            if repere is None and feuille.last_position_at is not None:
+                repere = (feuille.last_latitude, feuille.last_longitude, feuille.last_position_at)
+            for position in sorted(positions, key=lambda p: p.date_position):
+                if not self._garder(repere, position):
+                    continue
+                position.feuille_id = feuille.pk
+                self._historique.append(position)
+                gardees += 1
+                # Un point plus ancien (envoi hors-ligne en retard) ne va qu'à l'historique
+                if repere is None or position.date_position >= repere[2]:
+                    repere = (position.latitude, position.longitude, position.date_position)
+                    self._dernieres[feuille.pk] = position
+            if repere is not None:
+                self._reperes[feuille.pk] = repere
+        if gardees:
+            if _reglage('POSITIONS_INTERVALLE_ECRITURE_S', 5):
+                _demarrer_worker()
+            else:
+                self.vider()
+        return gardees
+
+    def vider(self):
+        """Écrit les positions en attente ; renvoie le nombre de feuilles mises à jour."""
+        with self._verrou:
+            historique, dernieres = self._historique, self._dernieres
+            self._historique, self._dernieres = [], {}
+            # Après le délai, tout point est gardé : les repères plus anciens ne servent plus
+            limite = time.time() - _reglage('POSITIONS_DELAI_MAX_S', 300)
+            self._reperes = {pk: r for pk, r in self._reperes.items() if r[2].timestamp() >= limite}
+        if not historique:
+            return 0
+
+        try:
+            try:
+                self._ecrire(historique, dernieres)
+            except IntegrityError:
+                # Feuille supprimée entre-temps : ses points sont abandonnés, les autres écrits
+                existantes = set(FeuilleDeRoute.objects.filter(pk__in={p.feuille_id for p in historique})
+                                 .values_list('pk', flat=True))
+                historique = [p for p in historique if p.feuille_id in existantes]
+                dernieres = {pk: p for pk, p in dernieres.items() if pk in existantes}
+                for position in historique:
+                    position.pk = None
+                self._ecrire(historique, dernieres)
+        except Exception:
+            # Base verrouillée ou indisponible : le lot est remis en attente pour l'écriture
+            # suivante (les repères restent ceux de ces points, qui seront bien écrits)
+            self._remettre(historique, dernieres)
+            raise
+
+        messages = [
+            {'feuille': pk, 'lat': float(p.latitude), 'lng': float(p.longitude), 'date': p.date_position}
+            for pk, p in dernieres.items()
+        ]
+
+        def publier():
+            for message in messages:
+                eta.recalculer_feuille(message['feuille'], message['lat'], message['lng'])
+                diffuseur.publier(SUJET_FLOTTE, message)
+                # Sujet lu par les pages de suivi publiques : l'heure du point, jamais les coordonnées
+                diffuseur.publier(sujet_feuille(message['feuille']), {'date': message['date']})
+        transaction.on_commit(publier)
+        for pk, p in dernieres.items():
+            suivi.invalider_feuille(pk)
+            spatial.position_feuille(pk, p.latitude, p.longitude)
+        return len(dernieres)
+
+    def _remettre(self, historique, dernieres):
+        for position in historique:
+            position.pk = None
+        with self._verrou:
+            self._historique[:0] = historique
+            for pk, position in dernieres.items():
+                plus_recente = self._dernieres.get(pk)
+                if plus_recente is None or plus_recente.date_position < position.date_position:
+                    self._dernieres[pk] = position
+            if len(self._historique) > MAX_EN_ATTENTE:
+                perdus = len(self._historique) - MAX_EN_ATTENTE
+                del self._historique[:perdus]
+                logger.error("%s position(s) GPS en attente abandonnée(s) : écritures en échec", perdus)
+
+    @staticmethod
+    def _ecrire(historique, dernieres):
+        with transaction.atomic():
+            PositionGPS.objects.bulk_create(historique)
+            FeuilleDeRoute.objects.bulk_update([
+                FeuilleDeRoute(pk=pk, last_latitude=p.latitude, last_longitude=p.longitude, last_position_at=p.date_position)
+                for pk, p in dernieres.items()
+            ], CHAMPS_POSITION)
+
+    def reinitialiser(self):
+        with self._verrou:
+            self._reperes, self._historique, self._dernieres = {}, [], {}
+
+
+tampon = TamponPositions()
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _boucle_worker():
+    while True:
+        time.sleep(_reglage('POSITIONS_INTERVALLE_ECRITURE_S', 5))
+        try:
+            close_old_connections()
+            tampon.vider()
+        except Exception:
+            logger.exception("Échec de l'écriture des positions GPS en attente")
+        finally:
+            close_old_connections()
+
+
+def _demarrer_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_boucle_worker, name='positions-gps', daemon=True)
+            _worker.start()
+
+
+@atexit.register
+def _vider_a_l_arret():
+    if len(tampon):
+        try:
+            tampon.vider()
+        except Exception:
+            logger.exception("Positions GPS en attente perdues à l'arrêt")
@@ -0,0 +1,46 @@
+import base64
+import binascii
+import re
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Taille maximale acceptée pour une signature décodée
+TAILLE_MAX_SIGNATURE = 2 * 1024 * 1024
+
+DATA_URL_RE = re.compile(r'^data:image/(png|jpeg|webp);base64,(.+)$', re.DOTALL)
+
+
+def signature_depuis_data_url(data_url):
+    """Décode le ``canvas.toDataURL()`` d'une signature tactile en fichier PNG optimisé.
+
+    Renvoie un ``ContentFile`` ou ``None`` si la valeur n'est pas une image base64 valide.
+    """
+    match = DATA_URL_RE.match((data_url or '').strip())
+    if not match:
+        return None
+    try:
+        contenu = base64.b64decode(match.group(2), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not contenu or len(contenu) > TAILLE_MAX_SIGNATURE:
+        return None
+
+    if Image is not None:
+        try:
+            image = Image.open(BytesIO(contenu))
+            image.load()
+        except (OSError, Image.DecompressionBombError):
+            return None
+        # Une signature n'est qu'un tracé sombre sur fond transparent :
+        # niveaux de gris + alpha suffisent et compressent bien mieux.
+        buffer = BytesIO()
+        image.convert('LA').save(buffer, format='PNG', optimize=True)
+        contenu = buffer.getvalue()
+
+    return ContentFile(contenu)
@@ -0,0 +1,281 @@
+"""Index spatiaux en mémoire : clients géocodés et feuilles en route.
+
+``IndexGrille`` range des points (latitude, longitude) dans une grille de
+cellules d'environ ``taille_km`` de côté : une recherche par rayon ou du plus
+proche voisin ne lit que les cellules autour du point, sans parcourir tous les
+points ni interroger la base.
+
+Deux index sont tenus par processus :
+
+* ``index_clients()`` : clients qui ont des coordonnées, construit à la
+  première demande puis suivi par les signaux de ``Client`` ;
+* ``flotte()`` : feuilles au statut ``en_route`` et leur dernière position,
+  suivies par les signaux de ``FeuilleDeRoute`` et par l'enregistrement des
+  positions GPS (``livraison.views``).
+
+Comme pour ``livraison.diffusion``, l'état est propre au processus ; il est
+reconstruit depuis la base au-delà de ``RECHARGEMENT_SECONDES`` pour rattraper
+les écritures faites par les autres workers.
+"""
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Client, FeuilleDeRoute
+
+RAYON_TERRE_KM = 6371.0
+KM_PAR_DEGRE = math.pi * RAYON_TERRE_KM / 180
+# Côté approximatif d'une cellule de la grille
+TAILLE_CELLULE_KM = 1.0
+# Âge maximal des index avant reconstruction depuis la base
+RECHARGEMENT_SECONDES = 15 * 60
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Distance haversine entre deux points, en kilomètres."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RAYON_TERRE_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class IndexGrille:
+    def __init__(self, taille_km=TAILLE_CELLULE_KM):
+        self.pas = taille_km / KM_PAR_DEGRE
+        self._cellules = defaultdict(dict)
+        self._points = {}
+        self._etendue = None  # (i min, i max, j min, j max) des cellules occupées
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, ident):
+        return ident in self._points
+
+    def _cellule(self, lat, lng):
+        return math.floor(lat / self.pas), math.floor(lng / self.pas)
+
+    def position(self, ident):
+        return self._points.get(ident)
+
+    def placer(self, ident, lat, lng):
+        """Ajoute ou déplace le point ``ident``."""
+        self.retirer(ident)
+        lat, lng = float(lat), float(lng)
+        i, j = self._cellule(lat, lng)
+        self._cellules[(i, j)][ident] = (lat, lng)
+        self._points[ident] = (lat, lng)
+        if self._etendue is None:
+            self._etendue = (i, i, j, j)
+        else:
+            imin, imax, jmin, jmax = self._etendue
+            self._etendue = (min(imin, i), max(imax, i), min(jmin, j), max(jmax, j))
+
+    def retirer(self, ident):
+        position = self._points.pop(ident, None)
+        if position is not None:
+            cellule = self._cellule(*position)
+            self._cellules[cellule].pop(ident, None)
+            if not self._cellules[cellule]:
+                del self._cellules[cellule]
+
+    def _dans_cellules(self, cellules, lat, lng, filtre):
+        for cellule in cellules:
+            for ident, (plat, plng) in self._cellules.get(cellule, {}).items():
+                if filtre is None or filtre(ident):
+                    yield distance_km(lat, lng, plat, plng), ident
+
+    def dans_rayon(self, lat, lng, rayon_km, filtre=None):
+        """Points à moins de ``rayon_km`` : liste de ``(distance_km, ident)`` triée par distance."""
+        lat, lng = float(lat), float(lng)
+        dlat = rayon_km / KM_PAR_DEGRE
+        dlng = rayon_km / (KM_PAR_DEGRE * max(math.cos(math.radians(lat)), 0.01))
+        imin, jmin = self._cellule(lat - dlat, lng - dlng)
+        imax, jmax = self._cellule(lat + dlat, lng + dlng)
+        cellules = ((i, j) for i in range(imin, imax + 1) for j in range(jmin, jmax + 1))
+        return sorted(r for r in self._dans_cellules(cellules, lat, lng, filtre) if r[0] <= rayon_km)
+
+    def plus_proches(self, lat, lng, k=1, filtre=None):
+        """Les ``k`` points les plus proches : liste de ``(distance_km, ident)`` triée par distance.
+
+        Les cellules sont lues par anneaux successifs autour du point, jusqu'à
+        ce que l'anneau suivant soit forcément plus loin que le k-ième trouvé.
+        """
+        if self._etendue is None:
+            return []
+        lat, lng = float(lat), float(lng)
+        ci, cj = self._cellule(lat, lng)
+        imin, imax, jmin, jmax = self._etendue
+        rayon_max = max(abs(ci - imin), abs(ci - imax), abs(cj - jmin), abs(cj - jmax))
+        # Plus petit côté d'une cellule en km à cette latitude
+        cote_km = self.pas * KM_PAR_DEGRE * max(math.cos(math.radians(lat)), 0.01)
+        trouves = []
+        for r in range(rayon_max + 1):
+            if r == 0:
+                anneau = [(ci, cj)]
+            else:
+                anneau = [(ci + di, cj + dj) for di in (-r, r) for dj in range(-r, r + 1)]
+                anneau += [(ci + di, cj + dj) for dj in (-r, r) for di in range(-r + 1, r)]
+            trouves.extend(self._dans_cellules(anneau, lat, lng, filtre))
+            if len(trouves) >= k:
+                trouves.sort()
+                del trouves[k:]
+                if trouves[-1][0] <= r * cote_km:
+                    break
+        return sorted(trouves)[:k]
+
+
+class _IndexCharge:
+    """Index construit à la demande depuis la base et reconstruit périodiquement."""
+
+    def __init__(self, charger):
+        self._charger = charger
+        self._index = None
+        self._date = 0
+        self.lock = threading.RLock()
+
+    def __call__(self):
+        with self.lock:
+            if self._index is None or time.monotonic() - self._date > RECHARGEMENT_SECONDES:
+                self._index = self._charger()
+                self._date = time.monotonic()
+            return self._index
+
+    def si_charge(self):
+        """L'index s'il est déjà en mémoire (None sinon : il sera construit à jour à la demande)."""
+        return self._index
+
+    def reinitialiser(self):
+        with self.lock:
+            self._index = None
+
+
+def _charger_clients():
+    index = IndexGrille()
+    clients = Client.objects.filter(latitude__isnull=False, longitude__isnull=False).values_list(
+        'id', 'latitude', 'longitude',
+    )
+    for client_id, lat, lng in clients.iterator(chunk_size=5000):
+        index.placer(client_id, lat, lng)
+    return index
+
+
+class Flotte:
+    """Feuilles de route en route et leur dernière position connue."""
+
+    def __init__(self):
+        self.actives = set()
+        self.index = IndexGrille()
+
+    def activer(self, feuille_id, lat=None, lng=None):
+        self.actives.add(feuille_id)
+        if lat is not None and lng is not None:
+            self.index.placer(feuille_id, lat, lng)
+
+    def desactiver(self, feuille_id):
+        self.actives.discard(feuille_id)
+        self.index.retirer(feuille_id)
+
+    def deplacer(self, feuille_id, lat, lng):
+        if feuille_id in self.actives:
+            self.index.placer(feuille_id, lat, lng)
+
+    def plus_proches(self, lat, lng, k=1):
+        return self.index.plus_proches(lat, lng, k)
+
+
+def _charger_flotte():
+    etat = Flotte()
+    feuilles = FeuilleDeRoute.objects.filter(statut='en_route').values_list('id', 'last_latitude', 'last_longitude')
+    for feuille_id, lat, lng in feuilles:
+        etat.activer(feuille_id, lat, lng)
+    return etat
+
+
+index_clients = _IndexCharge(_charger_clients)
+flotte = _IndexCharge(_charger_flotte)
+
+
+def clients_dans_rayon(lat, lng, rayon_km):
+    """Clients géocodés à moins de ``rayon_km`` : liste de ``(distance_km, client_id)``."""
+    index = index_clients()
+    with index_clients.lock:
+        return index.dans_rayon(lat, lng, rayon_km)
+
+
+def feuille_active_la_plus_proche(lat, lng):
+    """Feuille en route la plus proche du point : ``(distance_km, feuille_id)`` ou None."""
+    etat = flotte()
+    with flotte.lock:
+        resultat = etat.plus_proches(lat, lng, k=1)
+    return resultat[0] if resultat else None
+
+
+def _apres_commit(index_charge, action):
+    def appliquer():
+        index = index_charge.si_charge()
+        if index is not None:
+            with index_charge.lock:
+                action(index)
+    transaction.on_commit(appliquer)
+
+
+def clients_geocodes(positions):
+    """Reporte dans l'index des coordonnées écrites sans signal (``bulk_update``) : ``[(id, lat, lng)]``."""
+    def action(index):
+        for client_id, lat, lng in positions:
+            index.placer(client_id, lat, lng)
+    _apres_commit(index_clients, action)
+
+
+def position_feuille(feuille_id, lat, lng):
+    """Nouvelle dernière position d'une feuille (appelé par l'enregistrement des positions GPS)."""
+    _apres_commit(flotte, lambda etat: etat.deplacer(feuille_id, lat, lng))
+
+
+@receiver(post_save, sender=Client)
+def _client_enregistre(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'latitude', 'longitude'} & set(update_fields):
+        return
+    client_id, lat, lng = instance.pk, instance.latitude, instance.longitude
+
+    def action(index):
+        if lat is None or lng is None:
+            index.retirer(client_id)
+        else:
+            index.placer(client_id, lat, lng)
+    _apres_commit(index_clients, action)
+
+
+@receiver(post_delete, sender=Client)
+def _client_supprime(sender, instance, **kwargs):
+    client_id = instance.pk
+    _apres_commit(index_clients, lambda index: index.retirer(client_id))
+
+
+@receiver(post_save, sender=FeuilleDeRoute)
+def _feuille_enregistree(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'statut' not in update_fields:
+        return
+    feuille_id, statut = instance.pk, instance.statut
+    # last_latitude/last_longitude peuvent ne pas être chargés (only()) : la position suivante les donnera
+    deferred = instance.get_deferred_fields()
+    lat = None if 'last_latitude' in deferred else instance.last_latitude
+    lng = None if 'last_longitude' in deferred else instance.last_longitude
+
+    def action(etat):
+        if statut == 'en_route':
+            etat.activer(feuille_id, lat, lng)
+        else:
+            etat.desactiver(feuille_id)
+    _apres_commit(flotte, action)
+
+
+@receiver(post_delete, sender=FeuilleDeRoute)
+def _feuille_supprimee(sender, instance, **kwargs):
+    feuille_id = instance.pk
+    _apres_commit(flotte, lambda etat: etat.desactiver(feuille_id))
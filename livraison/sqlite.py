@@ -0,0 +1,40 @@
+"""Réglages des connexions SQLite pour les écritures concurrentes des chauffeurs.
+
+En production (``settings.SQLITE_PROFIL_PRODUCTION``, variable d'environnement
+``DB_PROFIL=production``), chaque connexion ouverte reçoit les PRAGMA de
+``PRAGMAS`` (signal ``connection_created``) :
+
+* ``journal_mode=wal`` : les lectures ne bloquent plus les écritures et
+  inversement ; une seule écriture à la fois, les autres attendent ;
+* ``synchronous=normal`` : pas de fsync à chaque commit en WAL, seulement aux
+  points de contrôle (sûr en cas de crash de l'application, pas d'une coupure
+  de courant) ;
+* ``busy_timeout`` : une écriture attend le verrou jusqu'à 20 s au lieu
+  d'échouer avec « database is locked » ;
+* ``mmap_size``, ``cache_size``, ``temp_store`` : lectures en mémoire.
+
+Avec ``transaction_mode=IMMEDIATE`` (voir ``DATABASES`` dans les settings),
+une transaction prend le verrou d'écriture dès son début : deux transactions
+qui lisent puis écrivent ne peuvent plus se bloquer mutuellement.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'memory',
+}
+
+
+@receiver(connection_created)
+def _regler_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_PROFIL_PRODUCTION', False):
+        return
+    with connection.cursor() as curseur:
+        for nom, valeur in PRAGMAS.items():
+            curseur.execute(f'PRAGMA {nom} = {valeur}')
@@ -0,0 +1,132 @@
+"""Cache de la page publique de suivi (``/livraison/track/<token>/``).
+
+Chaque livraison et chaque feuille ont une version dans le cache : l'horodatage
+de leur dernière modification. La page rendue est mise en cache sous une clé
+qui contient le jeton et ces deux versions, et les mêmes versions donnent
+l'ETag et le Last-Modified de la réponse : une visite répétée sans changement
+se termine en 304 sans requête SQL ni rendu de gabarit.
+
+Les versions sont changées après validation de la transaction, par les signaux
+ci-dessous pour les ``save()`` et explicitement là où le code écrit par
+``update()`` ou ``bulk_update()`` (positions GPS, traitement des images,
+optimisation des tournées, commandes urgentes). Une version évincée du cache
+est simplement recréée : la page est alors rendue une fois de plus.
+
+Avec un cache propre à chaque processus (LocMemCache), une invalidation n'est
+vue que du processus qui l'a faite : les autres servent leur page jusqu'à
+l'expiration de ``SUIVI_CACHE_SECONDES``, d'où une durée courte par défaut. Avec
+un cache partagé (Redis...), elle peut être portée à plusieurs heures.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Client, FeuilleDeRoute, Livraison, Produit, Sac
+
+
+def duree_cache():
+    return getattr(settings, 'SUIVI_CACHE_SECONDES', 60)
+
+
+def _cle_ids(token):
+    return f'suivi:ids:{token}'
+
+
+def _cle_livraison(pk):
+    return f'suivi:version:livraison:{pk}'
+
+
+def _cle_feuille(pk):
+    return f'suivi:version:feuille:{pk}'
+
+
+def cle_page(token, versions):
+    return f'suivi:page:{token}:{versions[0]}:{versions[1]}'
+
+
+def _nouvelles_versions(cles):
+    maintenant = time.time()
+    cache.set_many({cle: maintenant for cle in cles}, duree_cache())
+
+
+def invalider_livraisons(pks):
+    """Change la version des livraisons ``pks`` une fois la transaction courante validée."""
+    cles = [_cle_livraison(pk) for pk in pks]
+    if cles:
+        transaction.on_commit(lambda: _nouvelles_versions(cles))
+
+
+def invalider_feuille(pk):
+    """Change la version d'une feuille (statut, dernière position) après validation."""
+    transaction.on_commit(lambda: _nouvelles_versions([_cle_feuille(pk)]))
+
+
+def versions(token):
+    """Versions ``(livraison, feuille)`` de la page de suivi, ou None si le jeton est inconnu."""
+    ids = cache.get(_cle_ids(token))
+    if ids is None:
+        ids = Livraison.objects.filter(public_token=token).values_list('pk', 'feuille_id').first()
+        if ids is None:
+            return None
+        cache.set(_cle_ids(token), ids, duree_cache())
+    cles = [_cle_livraison(ids[0]), _cle_feuille(ids[1])]
+    trouvees = cache.get_many(cles)
+    for cle in cles:
+        if cle not in trouvees:
+            # add() : ne pas écraser une version posée entre-temps par un autre processus
+            cache.add(cle, time.time(), duree_cache())
+            trouvees[cle] = cache.get(cle)
+    return trouvees[cles[0]], trouvees[cles[1]]
+
+
+def etag(token, versions):
+    return hashlib.md5(f'{token}:{versions[0]}:{versions[1]}'.encode()).hexdigest()
+
+
+def derniere_modification(versions):
+    return datetime.fromtimestamp(max(versions), tz=dt_timezone.utc)
+
+
+@receiver(post_save, sender=Livraison)
+@receiver(post_delete, sender=Livraison)
+def _livraison_modifiee(sender, instance, **kwargs):
+    cles = [_cle_ids(instance.public_token), _cle_livraison(instance.pk)]
+
+    def invalider():
+        # La livraison a pu changer de feuille : la correspondance jeton -> ids est recalculée
+        cache.delete(cles[0])
+        _nouvelles_versions(cles[1:])
+    transaction.on_commit(invalider)
+
+
+@receiver(post_save, sender=FeuilleDeRoute)
+def _feuille_modifiee(sender, instance, **kwargs):
+    invalider_feuille(instance.pk)
+
+
+@receiver(m2m_changed, sender=Livraison.produits.through)
+@receiver(m2m_changed, sender=Livraison.sacs.through)
+def _contenu_modifie(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalider_livraisons([instance.pk])
+    elif pk_set:
+        invalider_livraisons(pk_set)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Produit)
+@receiver(post_save, sender=Sac)
+def _reference_modifiee(sender, instance, created, **kwargs):
+    """Nom, adresse ou prix affichés par les pages de suivi des livraisons liées."""
+    if created:
+        return
+    champ = {Client: 'client', Produit: 'produits', Sac: 'sacs'}[sender]
+    invalider_livraisons(list(Livraison.objects.filter(**{champ: instance}).values_list('pk', flat=True)))
@@ -1,3 +1,905 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from datetime import date, time, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import eta, geocodage, images, planning, positions, spatial, sqlite, tournees
+from .diffusion import diffuseur, sujet_feuille, sujet_livraison
+from .models import (
+    Chauffeur, Client, CumulJournalier, CumulProduitJournalier, FeuilleDeRoute, Livraison, OperationSync, PositionGPS,
+    Produit, Sac, Vehicule,
+)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POSITIONS_INTERVALLE_ECRITURE_S=0)
+class PositionTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        user = User.objects.create_user('jean')
+        chauffeur = Chauffeur.objects.create(user=user, telephone='0600000002')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur)
+        self.url = reverse('livraison:update_positions_batch', args=[self.feuille.token])
+
+    def envoyer(self, positions):
+        return self.client.post(self.url, json.dumps({'positions': positions}), content_type='application/json')
+
+    def test_lot_de_positions(self):
+        response = self.envoyer([
+            {'lat': 5.345, 'lng': -4.024, 'accuracy': 12, 'timestamp': 1735725600000},
+            {'lat': 5.347, 'lng': -4.021, 'accuracy': 8, 'timestamp': 1735725660000},
+        ])
+
+        self.assertEqual(response.json(), {'ok': True, 'count': 2})
+        self.assertEqual(self.feuille.positions.count(), 2)
+        self.feuille.refresh_from_db()
+        self.assertEqual(self.feuille.last_latitude, Decimal('5.347000'))
+        self.assertEqual(self.feuille.last_longitude, Decimal('-4.021000'))
+
+    def test_lot_invalide_rejete_en_entier(self):
+        response = self.envoyer([{'lat': 5.3, 'lng': -4.0}, {'lat': 'abc', 'lng': -4.0}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PositionGPS.objects.exists())
+
+    def test_horodatage_hors_limites_rejete(self):
+        response = self.envoyer([{'lat': 5.3, 'lng': -4.0, 'timestamp': 1e20}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PositionGPS.objects.exists())
+
+    def test_position_unique_ajoutee_a_l_historique(self):
+        url = reverse('livraison:update_position', args=[self.feuille.token])
+        response = self.client.post(url, {'lat': '5.3', 'lng': '-4.0'})
+
+        self.assertEqual(response.json(), {'ok': True})
+        self.assertEqual(self.feuille.positions.count(), 1)
+        self.feuille.refresh_from_db()
+        self.assertIsNotNone(self.feuille.last_position_at)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SyncOperationsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('luc')
+        chauffeur = Chauffeur.objects.create(user=user, telephone='0600000003')
+        client = Client.objects.create(nom='Client C', adresse='3 rue C', telephone='03')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur)
+        self.livraison = Livraison.objects.create(feuille=self.feuille, client=client, reference_commande='CMD-1')
+        self.url = reverse('livraison:sync_operations', args=[self.feuille.token])
+
+    def synchroniser(self, operations):
+        return self.client.post(self.url, {'operations': json.dumps(operations)})
+
+    def test_operation_rejouee_appliquee_une_seule_fois(self):
+        op_id = str(uuid.uuid4())
+        operations = [{'id': op_id, 'livraison': self.livraison.pk, 'statut': 'livre', 'timestamp': 1735725600000}]
+
+        premiere = self.synchroniser(operations)
+        self.assertEqual(premiere.json(), {'ok': True, 'appliquees': [op_id], 'ignorees': []})
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.statut, 'livre')
+        self.assertEqual(self.livraison.date_livraison.year, 2025)
+
+        Livraison.objects.filter(pk=self.livraison.pk).update(statut='probleme')
+        seconde = self.synchroniser(operations)
+        self.assertEqual(seconde.json(), {'ok': True, 'appliquees': [], 'ignorees': [op_id]})
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.statut, 'probleme')
+
+    def test_livraison_d_une_autre_feuille_refusee(self):
+        autre = FeuilleDeRoute.objects.create(chauffeur=self.feuille.chauffeur)
+        response = self.client.post(
+            reverse('livraison:sync_operations', args=[autre.token]),
+            {'operations': json.dumps([{'id': str(uuid.uuid4()), 'livraison': self.livraison.pk, 'statut': 'livre'}])},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OperationSync.objects.exists())
+
+    def test_page_feuille(self):
+        response = self.client.get(reverse('livraison:feuille_detail', args=[self.feuille.token]))
+
+        self.assertContains(response, self.url)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ReponsesJsonTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('marc')
+        chauffeur = Chauffeur.objects.create(user=user, telephone='0600000004')
+        client = Client.objects.create(nom='Client D', adresse='4 rue D', telephone='04')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur)
+        self.livraison = Livraison.objects.create(feuille=self.feuille, client=client, reference_commande='CMD-1')
+
+    def test_statut_livraison_en_json(self):
+        response = self.client.post(
+            reverse('livraison:update_livraison_status', args=[self.livraison.pk]),
+            {'statut': 'livre'}, HTTP_ACCEPT='application/json',
+        )
+
+        data = response.json()['livraison']
+        self.assertEqual(data['statut'], 'livre')
+        self.assertEqual(data['couleur'], 'green')
+        self.assertIsNotNone(data['date_livraison'])
+        self.assertIsNone(data['preuve_photo_url'])
+
+    def test_statut_livraison_sans_json_redirige(self):
+        response = self.client.post(
+            reverse('livraison:update_livraison_status', args=[self.livraison.pk]), {'statut': 'probleme'},
+        )
+
+        self.assertRedirects(response, reverse('livraison:feuille_detail', args=[self.feuille.token]))
+
+    def test_demarrage_et_observations_en_json(self):
+        url = reverse('livraison:feuille_detail', args=[self.feuille.token])
+        demarrage = self.client.post(url, {'start_route': '1'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(demarrage.json()['feuille']['statut'], 'en_route')
+
+        observations = self.client.post(
+            url, {'update_observations': '1', 'observations_chauffeur': 'Route barrée'}, HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual(observations.json()['feuille']['observations_chauffeur'], 'Route barrée')
+
+    def test_signature_tactile_enregistree_en_fichier(self):
+        image = Image.new('RGBA', (40, 20), (0, 0, 0, 0))
+        image.putpixel((5, 5), (0, 0, 0, 255))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        data_url = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+        response = self.client.post(
+            reverse('livraison:update_livraison_status', args=[self.livraison.pk]),
+            {'signature_tactile': data_url}, HTTP_ACCEPT='application/json',
+        )
+
+        self.livraison.refresh_from_db()
+        self.assertTrue(self.livraison.signature_tactile.name.endswith('.png'))
+        self.assertEqual(response.json()['livraison']['signature_tactile_url'], self.livraison.signature_tactile.url)
+
+    def test_signature_tactile_invalide_ignoree(self):
+        self.client.post(
+            reverse('livraison:update_livraison_status', args=[self.livraison.pk]),
+            {'signature_tactile': 'data:image/png;base64,pas-du-base64'},
+        )
+
+        self.livraison.refresh_from_db()
+        self.assertFalse(self.livraison.signature_tactile)
+
+    def test_migration_signatures_sans_perte(self):
+        migration = importlib.import_module('livraison.migrations.0007_signature_tactile_fichier')
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><path d="M0 0L9 9"/></svg>'
+        self.assertEqual(migration._decoder(svg), (svg.encode(), 'svg'))
+        self.assertEqual(
+            migration._decoder('data:image/svg+xml;base64,' + base64.b64encode(svg.encode()).decode()), (svg.encode(), 'svg'),
+        )
+        self.assertEqual(migration._decoder('data:image/svg+xml,%3Csvg%2F%3E'), (b'<svg/>', 'svg'))
+        # Pas de limite de taille sur l'historique ; une valeur illisible part dans les non converties
+        grande = Image.frombytes('L', (1500, 1500), os.urandom(1500 * 1500))
+        buffer = io.BytesIO()
+        grande.save(buffer, format='PNG')
+        self.assertGreater(len(buffer.getvalue()), 2 * 1024 * 1024)
+        self.assertEqual(migration._decoder('data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode())[1], 'png')
+        self.assertIsNone(migration._decoder('data:image/png;base64,pas-du-base64'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POSITIONS_INTERVALLE_ECRITURE_S=0)
+class SuiviPublicTests(TestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        cache.clear()
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('remi'), telephone='0600000008')
+        client = Client.objects.create(nom='Client G', adresse='7 rue G', telephone='07')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur, statut='en_route')
+        self.livraison = Livraison.objects.create(feuille=self.feuille, client=client, reference_commande='CMD-1')
+
+    def ecouter(self, *sujets):
+        """Abonne un consommateur au diffuseur et renvoie une fonction qui attend le message suivant."""
+        loop = asyncio.new_event_loop()
+        flux = diffuseur.ecouter(*sujets, keepalive=0.1)
+        suivant = loop.create_task(flux.__anext__())
+        loop.run_until_complete(asyncio.sleep(0))
+
+        def recevoir():
+            nonlocal suivant
+            recu = loop.run_until_complete(suivant)
+            suivant = loop.create_task(flux.__anext__())
+            return recu
+
+        def fermer():
+            suivant.cancel()
+            loop.run_until_complete(asyncio.gather(suivant, return_exceptions=True))
+            loop.run_until_complete(flux.aclose())
+            loop.close()
+        self.addCleanup(fermer)
+        return recevoir
+
+    def test_page_suivi_sans_requete_en_double(self):
+        self.livraison.produits.add(Produit.objects.create(nom='Riz', prix_unitaire=Decimal('1000.00')))
+        self.livraison.sacs.add(Sac.objects.create(nom='Sac 25kg', couleur='Blanc'))
+
+        # Correspondance jeton -> ids, puis livraison, produits et sacs
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('livraison:track', args=[self.livraison.public_token]))
+
+        self.assertContains(response, 'Riz')
+        self.assertContains(response, reverse('livraison:track_flux', args=[self.livraison.public_token]))
+
+    def test_statut_pousse_seulement_s_il_change(self):
+        recevoir = self.ecouter(sujet_livraison(self.livraison.public_token))
+        url = reverse('livraison:update_livraison_status', args=[self.livraison.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'statut': 'livre'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'statut': 'livre'})
+
+        sujet, message = recevoir()
+        self.assertEqual(message['statut'], 'livre')
+        self.assertEqual(message['couleur'], 'green')
+        self.assertIsNone(recevoir())
+
+    def test_position_de_la_feuille_poussee(self):
+        recevoir = self.ecouter(sujet_feuille(self.feuille.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:update_position', args=[self.feuille.token]), {'lat': '5.3', 'lng': '-4.0'})
+
+        sujet, message = recevoir()
+        self.assertEqual(sujet, sujet_feuille(self.feuille.pk))
+        # Lien de suivi public : l'heure de la position, pas les coordonnées du livreur
+        self.assertEqual(list(message), ['date'])
+
+    async def test_flux_suivi(self):
+        response = await self.async_client.get(reverse('livraison:track_flux', args=[self.livraison.public_token]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        contenu = response.streaming_content.__aiter__()
+        self.assertEqual(await contenu.__anext__(), b'retry: 5000\n\n')
+
+        suivant = asyncio.ensure_future(contenu.__anext__())
+        while not diffuseur.nombre_abonnes(sujet_feuille(self.feuille.pk)):
+            await asyncio.sleep(0)
+        diffuseur.publier(sujet_feuille(self.feuille.pk), {'date': '2025-01-01T10:00:00Z'})
+        self.assertEqual(await suivant, b'event: position\ndata: {"date": "2025-01-01T10:00:00Z"}\n\n')
+        await contenu.aclose()
+
+    async def test_flux_suivi_jeton_inconnu(self):
+        response = await self.async_client.get(reverse('livraison:track_flux', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POSITIONS_INTERVALLE_ECRITURE_S=0)
+class CacheSuiviTests(TestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        cache.clear()
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('hugo'), telephone='0600000009')
+        client = Client.objects.create(nom='Client H', adresse='8 rue H', telephone='08')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur, statut='en_route')
+        self.livraison = Livraison.objects.create(feuille=self.feuille, client=client, reference_commande='CMD-1')
+        self.url = reverse('livraison:track', args=[self.livraison.public_token])
+
+    def test_visite_repetee_sans_requete_puis_304(self):
+        premiere = self.client.get(self.url)
+        self.assertTrue(premiere.has_header('ETag'))
+        self.assertTrue(premiere.has_header('Last-Modified'))
+        self.assertIn('no-cache', premiere['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            deuxieme = self.client.get(self.url)
+        self.assertEqual(deuxieme.content, premiere.content)
+
+        with self.assertNumQueries(0):
+            conditionnelle = self.client.get(self.url, HTTP_IF_NONE_MATCH=premiere['ETag'])
+        self.assertEqual(conditionnelle.status_code, 304)
+
+        depuis = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=premiere['Last-Modified'])
+        self.assertEqual(depuis.status_code, 304)
+
+    def test_changement_de_statut_change_l_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:update_livraison_status', args=[self.livraison.pk]), {'statut': 'livre'})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Livré')
+
+    def test_position_de_la_feuille_change_l_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:update_position', args=[self.feuille.token]), {'lat': '5.3', 'lng': '-4.0'})
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_modification_du_client_change_l_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        client = self.livraison.client
+        client.adresse = '9 rue H'
+        with self.captureOnCommitCallbacks(execute=True):
+            client.save()
+
+        self.assertContains(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag), '9 rue H')
+
+    def test_jeton_inconnu(self):
+        self.assertEqual(self.client.get(reverse('livraison:track', args=[uuid.uuid4()])).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGES_TRAITEMENT_ASYNCHRONE=False)
+class TraitementImagesTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('eric')
+        chauffeur = Chauffeur.objects.create(user=user, telephone='0600000005')
+        client = Client.objects.create(nom='Client E', adresse='5 rue E', telephone='05')
+        feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur)
+        self.livraison = Livraison.objects.create(feuille=feuille, client=client, reference_commande='CMD-1')
+
+    def test_photo_reduite_sans_exif_avec_miniature(self):
+        photo = Image.new('RGB', (4000, 3000), 'blue')
+        exif = Image.Exif()
+        exif[0x010F] = 'Fabricant'
+        buffer = io.BytesIO()
+        photo.save(buffer, format='JPEG', exif=exif)
+        fichier = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('livraison:update_livraison_status', args=[self.livraison.pk]), {'preuve_photo': fichier},
+            )
+
+        self.livraison.refresh_from_db()
+        with Image.open(self.livraison.preuve_photo.path) as image:
+            self.assertEqual(max(image.size), images.TAILLE_MAX)
+            self.assertFalse(image.getexif())
+        with Image.open(self.livraison.preuve_photo_miniature.path) as miniature:
+            self.assertEqual(miniature.format, 'WEBP')
+            self.assertEqual(max(miniature.size), images.TAILLE_MINIATURE)
+        self.assertEqual(self.livraison.preuve_photo_miniature_url, self.livraison.preuve_photo_miniature.url)
+
+    def test_photo_envoyee_pendant_le_traitement_gardee(self):
+        def photo(nom):
+            buffer = io.BytesIO()
+            Image.new('RGB', (50, 50), 'red').save(buffer, format='PNG')
+            return SimpleUploadedFile(nom, buffer.getvalue(), content_type='image/png')
+
+        self.livraison.preuve_photo.save('premiere.png', photo('premiere.png'))
+        traiter_image = images.traiter_image
+
+        def traiter_puis_nouvel_envoi(livraison, champ):
+            modifications = traiter_image(livraison, champ)
+            self.nouvelle = Livraison.objects.get(pk=self.livraison.pk)
+            self.nouvelle.preuve_photo.save('seconde.png', photo('seconde.png'))
+            return modifications
+
+        with mock.patch('livraison.images.traiter_image', side_effect=traiter_puis_nouvel_envoi):
+            images.traiter_livraison(self.livraison.pk, ['preuve_photo'])
+
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.preuve_photo.name, self.nouvelle.preuve_photo.name)
+        self.assertTrue(os.path.exists(self.livraison.preuve_photo.path))
+        # Résultat du traitement de la première photo supprimé, pas laissé orphelin
+        dossier = os.path.dirname(self.livraison.preuve_photo.path)
+        self.assertFalse([f for f in os.listdir(dossier) if f.startswith('premiere') and f.endswith('.jpg')])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QrCodeTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('yves')
+        self.chauffeur = Chauffeur.objects.create(user=user, telephone='0600000006')
+
+    def test_creation_en_masse_sans_qr_code(self):
+        feuilles = FeuilleDeRoute.objects.bulk_create([FeuilleDeRoute(chauffeur=self.chauffeur) for _ in range(50)])
+
+        self.assertEqual(len({f.token for f in feuilles}), 50)
+        self.assertFalse(FeuilleDeRoute.objects.exclude(qr_code='').exclude(qr_code=None).exists())
+
+    def test_qr_code_genere_a_la_premiere_demande(self):
+        feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur)
+        url = reverse('livraison:qr_code', args=[feuille.token])
+        self.assertEqual(url, feuille.get_qr_code_url())
+
+        premiere = self.client.get(url)
+        self.assertEqual(premiere['Content-Type'], 'image/png')
+        feuille.refresh_from_db()
+        nom = feuille.qr_code.name
+        self.assertIn(str(feuille.token), nom)
+
+        seconde = self.client.get(url)
+        self.assertEqual(b''.join(seconde.streaming_content), b''.join(premiere.streaming_content))
+        feuille.refresh_from_db()
+        self.assertEqual(feuille.qr_code.name, nom)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImportPlanningTests(TestCase):
+    ENTETE = 'chauffeur,date_route,vehicule,client,adresse,telephone,reference_commande,quantite,horaire_estime,produits,sacs\n'
+
+    def setUp(self):
+        Chauffeur.objects.create(user=User.objects.create_user('alain'), telephone='0600000007')
+        Vehicule.objects.create(nom='Camion', marque='Renault', modele='Master', immatriculation='AB-123-CD')
+        Produit.objects.create(nom='Eau', prix_unitaire=Decimal('500.00'))
+        Produit.objects.create(nom='Riz', prix_unitaire=Decimal('1500.00'))
+        Sac.objects.create(nom='Sac isotherme', couleur='bleu')
+        Client.objects.create(nom='Client existant', adresse='1 rue', telephone='01')
+
+    def lire(self, csv):
+        fichier = io.BytesIO((self.ENTETE + csv).encode())
+        fichier.name = 'planning.csv'
+        return planning.lire_fichier(fichier)
+
+    def test_import_groupe_les_livraisons_par_feuille(self):
+        lignes = self.lire(
+            'alain,2025-03-10,AB-123-CD,Client existant,,,CMD-1,2,08:30,Eau;Riz,Sac isotherme\n'
+            'alain,2025-03-10,AB-123-CD,Nouveau client,2 rue,0102,CMD-2,1,,Eau,\n'
+            'alain,11/03/2025,,Nouveau client,,,CMD-3,1,,,\n'
+        )
+
+        rapport = planning.importer_planning(lignes)
+
+        self.assertEqual(rapport['erreurs'], [])
+        self.assertEqual((rapport['feuilles'], rapport['livraisons'], rapport['clients_crees']), (2, 3, 1))
+        livraison = Livraison.objects.get(reference_commande='CMD-1')
+        self.assertEqual(livraison.feuille.vehicule.immatriculation, 'AB-123-CD')
+        self.assertEqual(sorted(p.nom for p in livraison.produits.all()), ['Eau', 'Riz'])
+        self.assertEqual(livraison.sacs.count(), 1)
+        self.assertEqual(Livraison.objects.get(reference_commande='CMD-3').feuille.date_route.day, 11)
+
+    def test_dry_run_et_erreurs_n_ecrivent_rien(self):
+        valide = self.lire('alain,2025-03-10,,Client existant,,,CMD-1,1,,,\n')
+        self.assertEqual(planning.importer_planning(valide, dry_run=True)['livraisons'], 1)
+
+        quantite_nulle = self.lire('alain,2025-03-10,,Client existant,,,CMD-1,0,,,\n')
+        rapport = planning.importer_planning(quantite_nulle, dry_run=True)
+        self.assertEqual(rapport['erreurs'], ['Ligne 2 : date, horaire ou quantité invalide'])
+        self.assertEqual(rapport['livraisons'], 0)
+
+        invalide = self.lire(
+            'alain,2025-03-10,,Client existant,,,CMD-1,1,,,\n'
+            'inconnu,2025-03-10,,Client existant,,,CMD-2,1,,Pain,\n'
+        )
+        rapport = planning.importer_planning(invalide)
+        self.assertEqual(rapport['erreurs'], ['Ligne 3 : chauffeur inconnu « inconnu »'])
+
+        self.assertFalse(FeuilleDeRoute.objects.exists())
+        self.assertFalse(Livraison.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, TOURNEE_DEPOT=(5.30, -4.00))
+class TourneesTests(TestCase):
+    def setUp(self):
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('ines'), telephone='0600000010')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=chauffeur, date_route=date(2025, 3, 1))
+
+    def creer_livraison(self, reference, latitude=None, longitude=None, **kwargs):
+        client = Client.objects.create(
+            nom=f'Client {reference}', adresse='Abidjan', telephone='09', latitude=latitude, longitude=longitude,
+        )
+        return Livraison.objects.create(feuille=self.feuille, client=client, reference_commande=reference, **kwargs)
+
+    def test_optimiser_ordre_arrets_alignes(self):
+        arrets = [(5.34, -4.0), (5.31, -4.0), (5.36, -4.0), (5.32, -4.0), (5.35, -4.0), (5.33, -4.0)]
+        ordre, etapes = tournees.optimiser_ordre(arrets, depart=(5.30, -4.0))
+
+        self.assertEqual(ordre, [1, 3, 5, 0, 4, 2])
+        self.assertAlmostEqual(sum(etapes), 6.67, places=2)
+
+    def test_optimiser_ordre_corrige_le_plus_proche_voisin(self):
+        # Le plus proche voisin part vers le nord puis doit revenir chercher l'arrêt au sud
+        arrets = [(5.31, -4.0), (5.285, -4.0), (5.33, -4.0)]
+        ordre, etapes = tournees.optimiser_ordre(arrets, depart=(5.30, -4.0))
+
+        self.assertEqual(ordre, [1, 0, 2])
+        self.assertAlmostEqual(sum(etapes), 6.67, places=2)
+
+    def test_optimiser_feuille_enregistre_ordre_et_horaires(self):
+        loin = self.creer_livraison('LOIN', Decimal('5.36'), Decimal('-4.0'))
+        pres = self.creer_livraison('PRES', Decimal('5.31'), Decimal('-4.0'))
+        sans = self.creer_livraison('SANS', horaire_estime=time(15, 0))
+        livree = self.creer_livraison('LIVREE', Decimal('5.30'), Decimal('-4.0'), statut='livre')
+
+        self.assertEqual(tournees.optimiser_feuille(self.feuille, heure_depart=time(8, 0)), 3)
+
+        pres.refresh_from_db(), loin.refresh_from_db(), sans.refresh_from_db(), livree.refresh_from_db()
+        self.assertEqual([pres.ordre, loin.ordre, sans.ordre], [1, 2, 3])
+        self.assertEqual(pres.horaire_estime, time(8, 2))
+        self.assertEqual(loin.horaire_estime, time(8, 21))
+        self.assertEqual(sans.horaire_estime, time(15, 0))
+        self.assertIsNone(livree.ordre)
+
+        response = self.client.get(reverse('livraison:feuille_detail', args=[self.feuille.token]))
+        self.assertEqual([l.reference_commande for l in response.context['livraisons']], ['PRES', 'LOIN', 'SANS', 'LIVREE'])
+
+    def test_optimisation_change_la_page_de_suivi(self):
+        pres = self.creer_livraison('PRES', Decimal('5.31'), Decimal('-4.0'))
+        url = reverse('livraison:track', args=[pres.public_token])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            tournees.optimiser_feuille(self.feuille, heure_depart=time(8, 0))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_commande_optimiser_tournees(self):
+        self.creer_livraison('A', Decimal('5.33'), Decimal('-4.0'))
+        self.creer_livraison('B', Decimal('5.31'), Decimal('-4.0'))
+        sortie = io.StringIO()
+
+        call_command('optimiser_tournees', date='2025-03-01', depart='07:30', stdout=sortie)
+
+        self.assertIn('2 livraison(s)', sortie.getvalue())
+        self.assertEqual(
+            list(self.feuille.livraisons.order_by('ordre').values_list('reference_commande', flat=True)), ['B', 'A'],
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class GeocodageTests(TestCase):
+    def setUp(self):
+        fichier = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        fichier.write('nom,latitude,longitude\nCocody,5.3600,-3.9870\nRiviera 2,5.3700,-3.9600\nYopougon,5.3450,-4.0740\n')
+        fichier.close()
+        self.gazetteer = fichier.name
+        self.addCleanup(os.remove, fichier.name)
+        spatial.index_clients.reinitialiser()
+
+    def test_nom_le_plus_long_sans_accents(self):
+        gaz = geocodage.Gazetteer.depuis_fichier(self.gazetteer)
+
+        self.assertEqual(gaz.geocoder('Rue 12, COCODY Riviera-2'), (5.37, -3.96))
+        self.assertEqual(gaz.geocoder('Cocody, près de la pharmacie'), (5.36, -3.987))
+        self.assertEqual(gaz.geocoder('Yopougôn Maroc'), (5.345, -4.074))
+        self.assertIsNone(gaz.geocoder('Adresse inconnue'))
+
+    def test_commande_geocode_les_clients_sans_coordonnees(self):
+        cocody = Client.objects.create(nom='A', adresse='Cocody Angré', telephone='01')
+        inconnu = Client.objects.create(nom='B', adresse='Quelque part', telephone='02')
+        deja = Client.objects.create(nom='C', adresse='Yopougon', telephone='03', latitude=1, longitude=1)
+        sortie = io.StringIO()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('geocoder_clients', gazetteer=self.gazetteer, stdout=sortie)
+
+        self.assertIn('1 client(s) géocodé(s), 1 adresse(s) non reconnue(s)', sortie.getvalue())
+        cocody.refresh_from_db(), inconnu.refresh_from_db(), deja.refresh_from_db()
+        self.assertEqual((cocody.latitude, cocody.longitude), (Decimal('5.36'), Decimal('-3.987')))
+        self.assertIsNone(inconnu.latitude)
+        self.assertEqual(deja.latitude, 1)
+        self.assertEqual([c for _, c in spatial.clients_dans_rayon(5.36, -3.987, 1)], [cocody.pk])
+
+    def test_import_planning_geocode_les_nouveaux_clients(self):
+        Chauffeur.objects.create(user=User.objects.create_user('odile'), telephone='0600000011')
+        lignes = [{'chauffeur': 'odile', 'date_route': '2025-03-01', 'client': 'Nouveau', 'adresse': 'Riviera 2',
+                   'telephone': '04', 'reference_commande': 'CMD-1'}]
+
+        with override_settings(GEOCODAGE_GAZETTEER=self.gazetteer):
+            planning.importer_planning(lignes)
+
+        self.assertEqual(Client.objects.get(nom='Nouveau').latitude, Decimal('5.37'))
+
+
+@override_settings(POSITIONS_INTERVALLE_ECRITURE_S=0)
+class IndexSpatialTests(TestCase):
+    def test_grille_concorde_avec_le_calcul_exhaustif(self):
+        rng = random.Random(0)
+        points = {i: (5.2 + rng.random() * 0.3, -4.2 + rng.random() * 0.4) for i in range(3000)}
+        index = spatial.IndexGrille()
+        for ident, (lat, lng) in points.items():
+            index.placer(ident, lat, lng)
+
+        for lat, lng in [(5.35, -4.0), (5.21, -4.19), (5.6, -3.7)]:
+            exhaustif = sorted((spatial.distance_km(lat, lng, *p), i) for i, p in points.items())
+            self.assertEqual(index.plus_proches(lat, lng, k=5), exhaustif[:5])
+            self.assertEqual(index.dans_rayon(lat, lng, 2.5), [r for r in exhaustif if r[0] <= 2.5])
+
+        index.retirer(exhaustif[0][1])
+        self.assertEqual(index.plus_proches(lat, lng)[0], exhaustif[1])
+
+    def test_feuille_en_route_la_plus_proche(self):
+        positions.tampon.reinitialiser()
+        spatial.flotte.reinitialiser()
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('paul'), telephone='0600000012')
+        proche = FeuilleDeRoute.objects.create(chauffeur=chauffeur)
+        loin = FeuilleDeRoute.objects.create(chauffeur=chauffeur, statut='en_route', last_latitude=5.5, last_longitude=-4)
+        self.assertEqual(spatial.feuille_active_la_plus_proche(5.3, -4.0)[1], loin.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:feuille_detail', args=[proche.token]), {'start_route': '1'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:update_position', args=[proche.token]), {'lat': '5.31', 'lng': '-4.0'})
+        self.assertEqual(spatial.feuille_active_la_plus_proche(5.3, -4.0)[1], proche.pk)
+
+        proche.statut = 'terminee'
+        with self.captureOnCommitCallbacks(execute=True):
+            proche.save()
+        self.assertEqual(spatial.feuille_active_la_plus_proche(5.3, -4.0)[1], loin.pk)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POSITIONS_INTERVALLE_ECRITURE_S=0)
+class EtaTests(TestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        cache.clear()
+        self.chauffeur = Chauffeur.objects.create(user=User.objects.create_user('lea'), telephone='0600000013')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, statut='en_route', date_route=date.today())
+        self.livraisons = [
+            Livraison.objects.create(
+                feuille=self.feuille, reference_commande=f'CMD-{i}', ordre=i,
+                client=Client.objects.create(nom=f'C{i}', adresse='-', telephone='0', latitude=lat, longitude=-4),
+            )
+            for i, lat in enumerate([Decimal('5.31'), Decimal('5.32')], start=1)
+        ]
+
+    def poster_position(self, lat='5.30'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:update_position', args=[self.feuille.token]), {'lat': lat, 'lng': '-4'})
+
+    def test_calcul_trajet_et_temps_d_arret(self):
+        depart = timezone.now()
+        etas = eta.calculer((5.30, -4.0), depart, [(1, 5.31, -4.0), (2, None, None), (3, 5.32, -4.0)], 5)
+
+        trajet = eta.minutes_trajet(spatial.distance_km(5.30, -4.0, 5.31, -4.0))
+        self.assertAlmostEqual((etas[1] - depart).total_seconds() / 60, trajet)
+        self.assertNotIn(2, etas)
+        self.assertAlmostEqual((etas[3] - depart).total_seconds() / 60, 2 * trajet + 10)
+
+    def test_temps_d_arret_tire_de_l_historique(self):
+        self.assertEqual(eta.temps_arret_minutes(self.chauffeur.pk), tournees.MINUTES_PAR_ARRET)
+        cache.clear()
+        client = self.livraisons[0].client
+        debut = timezone.now() - timedelta(hours=3)
+        for i in range(6):
+            Livraison.objects.create(
+                feuille=self.feuille, client=client, reference_commande=f'H{i}', statut='livre',
+                date_livraison=debut + timedelta(minutes=12 * i),
+            )
+
+        self.assertAlmostEqual(eta.temps_arret_minutes(self.chauffeur.pk), 12)
+
+    def test_position_recalcule_sans_requete_supplementaire(self):
+        self.poster_position()
+        premiere, seconde = (eta.eta_livraison(l) for l in self.livraisons)
+        self.assertLess(timezone.now(), premiere)
+        self.assertLess(premiere, seconde)
+
+        # Feuille, puis écriture du tampon en une transaction (ajout de la position, mise à
+        # jour de la dernière position) : rien pour les ETA
+        with self.assertNumQueries(5):
+            self.poster_position('5.305')
+        self.assertLess(eta.eta_livraison(self.livraisons[0]), premiere)
+
+        response = self.client.get(reverse('livraison:track', args=[self.livraisons[1].public_token]))
+        self.assertContains(response, 'Arrivée estimée vers')
+        arrivee = self.client.get(reverse('admin_dashboard:index')).context['feuilles'][0][0].prochaine_arrivee
+        self.assertEqual(arrivee, eta.eta_livraison(self.livraisons[0]))
+
+    def test_changement_de_statut_recalcule(self):
+        self.poster_position()
+        seconde = eta.eta_livraison(self.livraisons[1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('livraison:update_livraison_status', args=[self.livraisons[0].pk]), {'statut': 'livre'})
+
+        self.livraisons[0].refresh_from_db()
+        self.assertIsNone(eta.eta_livraison(self.livraisons[0]))
+        self.assertLess(eta.eta_livraison(self.livraisons[1]), seconde)
+
+
+class CumulsTests(TestCase):
+    def setUp(self):
+        self.chauffeur = Chauffeur.objects.create(user=User.objects.create_user('luc'), telephone='0600000020')
+        self.autre = Chauffeur.objects.create(user=User.objects.create_user('marc'), telephone='0600000021')
+        self.produit = Produit.objects.create(nom='Pain', prix_unitaire=Decimal('100.00'))
+        self.client_ = Client.objects.create(nom='Client C', adresse='x', telephone='01')
+        self.jour = date(2025, 3, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feuille = FeuilleDeRoute.objects.create(chauffeur=self.chauffeur, date_route=self.jour)
+            self.livraisons = [
+                Livraison.objects.create(feuille=self.feuille, client=self.client_, reference_commande=f'R{i}', quantite=i + 1)
+                for i in range(3)
+            ]
+
+    def cumul(self, **filtre):
+        return list(CumulJournalier.objects.filter(**filtre).values_list(
+            'date', 'chauffeur_id', 'statut', 'nb_feuilles', 'nb_en_cours', 'nb_livre', 'nb_probleme', 'quantite_livree',
+        ))
+
+    def test_statut_et_produits(self):
+        livraison = self.livraisons[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            livraison.statut = 'livre'
+            livraison.save()
+            livraison.produits.add(self.produit)
+        self.assertEqual(self.cumul(), [(self.jour, self.chauffeur.pk, 'planifie', 1, 2, 1, 0, 2)])
+        self.assertEqual(
+            list(CumulProduitJournalier.objects.values_list('date', 'produit_id', 'quantite')),
+            [(self.jour, self.produit.pk, 2)],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produit.livraison_set.clear()
+        self.assertFalse(CumulProduitJournalier.objects.exists())
+
+    def test_changement_de_date_et_de_feuille(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            autre_feuille = FeuilleDeRoute.objects.create(chauffeur=self.autre, date_route=self.jour, statut='en_route')
+            deplacee = self.livraisons[0]
+            deplacee.feuille = autre_feuille
+            deplacee.save()
+        self.assertEqual(self.cumul(chauffeur=self.chauffeur)[0][4], 2)
+        self.assertEqual(self.cumul(chauffeur=self.autre), [(self.jour, self.autre.pk, 'en_route', 1, 1, 0, 0, 0)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feuille.date_route = self.jour + timedelta(days=1)
+            self.feuille.save()
+        self.assertEqual(self.cumul(chauffeur=self.chauffeur, date=self.jour), [])
+        self.assertEqual(len(self.cumul(chauffeur=self.chauffeur, date=self.jour + timedelta(days=1))), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feuille.delete()
+        self.assertEqual(self.cumul(chauffeur=self.chauffeur), [])
+
+    def test_reconstruction(self):
+        # Écritures sans signal : les cumuls ne sont remis à jour que par la commande
+        Livraison.objects.filter(pk=self.livraisons[2].pk).update(statut='probleme')
+        self.assertEqual(self.cumul()[0][6], 0)
+        sortie = io.StringIO()
+        call_command('recalculer_cumuls', stdout=sortie)
+        self.assertIn('1 cumul(s)', sortie.getvalue())
+        self.assertEqual(self.cumul(), [(self.jour, self.chauffeur.pk, 'planifie', 1, 2, 0, 1, 0)])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POSITIONS_INTERVALLE_ECRITURE_S=0)
+class SansSessionTests(TestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        cache.clear()
+        caches['sessions'].clear()
+        user = User.objects.create_user('noe', password='x')
+        self.feuille = FeuilleDeRoute.objects.create(chauffeur=Chauffeur.objects.create(user=user, telephone='0600000040'))
+        # Le téléphone du chauffeur garde aussi la session de l'espace chauffeur
+        self.client.force_login(user)
+
+    def sans_requete_session(self, methode, url, *args):
+        with CaptureQueriesContext(connection) as requetes:
+            response = getattr(self.client, methode)(url, *args)
+        self.assertFalse([q['sql'] for q in requetes if 'django_session' in q['sql']])
+        return response
+
+    def test_points_d_entree_par_jeton_sans_session(self):
+        token = self.feuille.token
+        url = reverse('livraison:update_position', args=[token])
+        response = self.sans_requete_session('post', url, {'lat': '5.3', 'lng': '-4.0'})
+        # Session jamais ouverte : ni lecture, ni Vary: Cookie
+        self.assertFalse(response.wsgi_request.session.accessed)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        response = self.sans_requete_session('get', reverse('livraison:feuille_detail', args=[token]))
+        self.assertEqual(response.status_code, 200)
+        # (la page pose le cookie CSRF, qui ajoute lui-même Vary: Cookie)
+        self.assertFalse(response.wsgi_request.session.accessed)
+        self.assertFalse(response.context['user'].is_authenticated)
+        self.assertEqual(self.feuille.positions.count(), 1)
+
+    def test_session_chauffeur_lue_dans_le_cache(self):
+        response = self.sans_requete_session('get', reverse('chauffeur:dashboard'))
+        self.assertEqual(response.context['chauffeur'], self.feuille.chauffeur)
+        self.assertIn('Cookie', response['Vary'])
+
+
+
+@override_settings(POSITIONS_INTERVALLE_ECRITURE_S=0, POSITIONS_DISTANCE_MIN_M=25, POSITIONS_DELAI_MAX_S=300)
+class TamponPositionsTests(TestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+        chauffeur = Chauffeur.objects.create(user=User.objects.create_user('ines'), telephone='0600000050')
+        self.feuilles = [FeuilleDeRoute.objects.create(chauffeur=chauffeur, statut='en_route') for _ in range(2)]
+
+    def poster(self, feuille, lat, lng='-4.0'):
+        return self.client.post(reverse('livraison:update_position', args=[feuille.token]), {'lat': lat, 'lng': lng})
+
+    def test_chauffeur_immobile_ignore(self):
+        feuille = self.feuilles[0]
+        self.poster(feuille, '5.3')
+        # À 11 m du point précédent : seule la feuille est lue
+        with self.assertNumQueries(1):
+            self.assertEqual(self.poster(feuille, '5.3001').json(), {'ok': True})
+        self.poster(feuille, '5.301')
+        self.assertEqual(list(feuille.positions.values_list('latitude', flat=True)), [Decimal('5.3'), Decimal('5.301')])
+
+    def test_point_garde_apres_le_delai(self):
+        feuille = self.feuilles[0]
+        fixes = [{'lat': 5.3, 'lng': -4.0, 'timestamp': 1735725600000 + minute * 60000} for minute in range(7)]
+        self.client.post(
+            reverse('livraison:update_positions_batch', args=[feuille.token]),
+            json.dumps({'positions': fixes}), content_type='application/json',
+        )
+        # Immobile sept minutes : un point au début, un après les cinq minutes du délai
+        self.assertEqual(feuille.positions.count(), 2)
+        feuille.refresh_from_db()
+        self.assertEqual(feuille.last_position_at.minute, 5)
+
+    @override_settings(POSITIONS_INTERVALLE_ECRITURE_S=5)
+    @mock.patch('livraison.positions._demarrer_worker')
+    def test_ecriture_groupee(self, demarrer_worker):
+        for i, feuille in enumerate(self.feuilles):
+            self.poster(feuille, '5.3', f'-4.{i}')
+            self.poster(feuille, '5.31', f'-4.{i}')
+        self.assertTrue(demarrer_worker.called)
+        self.assertFalse(PositionGPS.objects.exists())
+
+        # Un INSERT et un UPDATE pour toute la flotte (dans leur savepoint)
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(4):
+            self.assertEqual(positions.tampon.vider(), 2)
+        self.assertEqual(PositionGPS.objects.count(), 4)
+        self.assertEqual(
+            list(FeuilleDeRoute.objects.order_by('pk').values_list('last_latitude', 'last_longitude')),
+            [(Decimal('5.31'), Decimal('-4')), (Decimal('5.31'), Decimal('-4.1'))],
+        )
+        self.assertEqual(positions.tampon.vider(), 0)
+
+    @override_settings(POSITIONS_INTERVALLE_ECRITURE_S=5)
+    @mock.patch('livraison.positions._demarrer_worker')
+    def test_lot_remis_en_attente_apres_echec(self, demarrer_worker):
+        feuille = self.feuilles[0]
+        self.poster(feuille, '5.3')
+        with mock.patch.object(PositionGPS.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                positions.tampon.vider()
+        # Point voisin de celui en échec : toujours ignoré, mais le premier n'est pas perdu
+        self.poster(feuille, '5.3001')
+        self.poster(feuille, '5.31')
+        self.assertEqual(positions.tampon.vider(), 1)
+        self.assertEqual(list(feuille.positions.order_by('date_position').values_list('latitude', flat=True)),
+                         [Decimal('5.3'), Decimal('5.31')])
+        feuille.refresh_from_db()
+        self.assertEqual(feuille.last_latitude, Decimal('5.31'))
+
+
+@override_settings(POSITIONS_INTERVALLE_ECRITURE_S=0)
+class BaseDeDonneesTests(TransactionTestCase):
+    def setUp(self):
+        positions.tampon.reinitialiser()
+
+    def test_pragmas_sqlite(self):
+        with connection.cursor() as curseur:
+            # Hors production, la connexion garde les réglages par défaut
+            curseur.execute('PRAGMA synchronous')
+            self.assertEqual(curseur.fetchone()[0], 2)  # FULL
+            with override_settings(SQLITE_PROFIL_PRODUCTION=True):
+                sqlite._regler_sqlite(None, connection)
+            curseur.execute('PRAGMA synchronous')
+            self.assertEqual(curseur.fetchone()[0], 1)  # NORMAL
+            curseur.execute('PRAGMA busy_timeout')
+            self.assertEqual(curseur.fetchone()[0], 20000)
+
+    def test_banc_concurrence(self):
+        sortie = io.StringIO()
+        call_command('banc_concurrence', chauffeurs=2, requetes=4, stdout=sortie)
+        self.assertIn('2 chauffeur(s) × 4 requête(s)', sortie.getvalue())
+        self.assertIn('requêtes/s', sortie.getvalue())
+        # Données du banc supprimées
+        self.assertFalse(Chauffeur.objects.exists())
+        self.assertFalse(Client.objects.exists())
@@ -0,0 +1,222 @@
+"""Optimisation de l'ordre de passage des livraisons d'une feuille de route.
+
+L'ordre est calculé sur les coordonnées des clients : plus proche voisin depuis
+le point de départ, puis amélioration locale par 2-opt (inversion d'un tronçon)
+et Or-opt (déplacement d'une suite de 1 à 3 arrêts), jusqu'à ce qu'aucun
+mouvement ne raccourcisse la tournée. Les distances sont à vol d'oiseau
+(haversine), calculées en une fois sous forme de matrice NumPy, et chaque passe
+évalue tous les mouvements possibles d'un coup.
+
+La tournée est ouverte : le véhicule ne revient pas au point de départ. Le
+départ est le dépôt (``settings.TOURNEE_DEPOT``), sinon la dernière position
+connue de la feuille, sinon libre. Les livraisons dont le client n'a pas de
+coordonnées sont placées à la fin, dans leur ordre actuel.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Livraison
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RAYON_TERRE_KM = 6371.0
+# Hypothèses pour les horaires estimés : vitesse moyenne en ville et temps passé par arrêt
+VITESSE_MOYENNE_KMH = 25
+MINUTES_PAR_ARRET = 5
+HEURE_DEPART = time(8, 0)
+
+# Amélioration minimale (km) pour qu'un mouvement soit appliqué
+EPSILON = 1e-9
+
+
+class ErreurTournee(Exception):
+    pass
+
+
+def matrice_distances(points):
+    """Matrice des distances haversine (km) entre des points ``[(lat, lng), ...]``."""
+    coords = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    lat, lng = coords[:, 0], coords[:, 1]
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _plus_proche_voisin(d):
+    n = len(d) - 1
+    ordre = [0]
+    restants = np.ones(n, dtype=bool)
+    restants[0] = False
+    for _ in range(n - 1):
+        distances = np.where(restants, d[ordre[-1], :n], np.inf)
+        suivant = int(np.argmin(distances))
+        ordre.append(suivant)
+        restants[suivant] = False
+    # Nœud fictif de fin, à distance nulle de tous : la tournée reste ouverte
+    ordre.append(n)
+    return np.array(ordre)
+
+
+def _deux_opt(ordre, d):
+    """Applique la meilleure inversion de tronçon ; renvoie False si aucune n'améliore."""
+    n = len(ordre) - 1
+    if n < 3:
+        return False
+    i = np.arange(1, n)
+    avant, debut = ordre[i - 1], ordre[i]
+    fin, apres = ordre[i], ordre[i + 1]
+    gain = (
+        d[avant[:, None], fin[None, :]] + d[debut[:, None], apres[None, :]]
+        - d[avant, debut][:, None] - d[fin, apres][None, :]
+    )
+    gain[np.tril_indices(len(i))] = np.inf
+    a, b = np.unravel_index(np.argmin(gain), gain.shape)
+    if gain[a, b] >= -EPSILON:
+        return False
+    ordre[a + 1:b + 2] = ordre[a + 1:b + 2][::-1].copy()
+    return True
+
+
+def _or_opt(ordre, d):
+    """Applique le meilleur déplacement d'une suite de 1 à 3 arrêts ; renvoie False si aucun n'améliore."""
+    n = len(ordre) - 1
+    aretes = d[ordre[:-1], ordre[1:]]
+    meilleur = (-EPSILON, None)
+    for longueur in (1, 2, 3):
+        for i in range(1, n - longueur + 1):
+            premier, dernier = ordre[i], ordre[i + longueur - 1]
+            retrait = aretes[i - 1] + aretes[i + longueur - 1] - d[ordre[i - 1], ordre[i + longueur]]
+            insertion = d[ordre[:-1], premier] + d[dernier, ordre[1:]] - aretes
+            # Les arêtes qui touchent la suite déplacée ne sont pas des positions d'insertion
+            insertion[i - 1:i + longueur] = np.inf
+            k = int(np.argmin(insertion))
+            if insertion[k] - retrait < meilleur[0]:
+                meilleur = (insertion[k] - retrait, (i, longueur, k))
+    if meilleur[1] is None:
+        return False
+    i, longueur, k = meilleur[1]
+    suite = ordre[i:i + longueur].copy()
+    reste = np.concatenate([ordre[:i], ordre[i + longueur:]])
+    position = k + 1 if k < i else k + 1 - longueur
+    ordre[:] = np.concatenate([reste[:position], suite, reste[position:]])
+    return True
+
+
+def optimiser_ordre(arrets, depart=None):
+    """Ordre de passage quasi optimal des ``arrets`` ``[(lat, lng), ...]``.
+
+    Renvoie la liste des indices des arrêts dans l'ordre de visite et la
+    distance de chaque étape (km, depuis le départ ou l'arrêt précédent).
+    """
+    if np is None:
+        raise ErreurTournee("NumPy est requis pour optimiser les tournées.")
+    if not arrets:
+        return [], []
+    # Nœud 0 : départ (fictif et à distance nulle s'il est inconnu) ; nœud n + 1 : fin fictive
+    points = [depart or arrets[0]] + list(arrets)
+    d = np.zeros((len(points) + 1, len(points) + 1))
+    d[:-1, :-1] = matrice_distances(points)
+    if depart is None:
+        d[0, :] = d[:, 0] = 0
+    d[-1, :] = d[:, -1] = 0
+
+    ordre = _plus_proche_voisin(d)
+    while _deux_opt(ordre, d) or _or_opt(ordre, d):
+        pass
+    etapes = d[ordre[:-2], ordre[1:-1]]
+    return [int(i) - 1 for i in ordre[1:-1]], [float(km) for km in etapes]
+
+
+def horaires(etapes, heure_depart=HEURE_DEPART):
+    """Horaires d'arrivée estimés à partir des distances de chaque étape."""
+    courant = datetime.combine(date.min, heure_depart)
+    resultat = []
+    for i, km in enumerate(etapes):
+        if i:
+            courant += timedelta(minutes=MINUTES_PAR_ARRET)
+        courant += timedelta(hours=km / VITESSE_MOYENNE_KMH)
+        resultat.append(courant.time().replace(second=0, microsecond=0))
+    return resultat
+
+
+def _point_depart(feuille):
+    depot = getattr(settings, 'TOURNEE_DEPOT', None)
+    if depot:
+        return tuple(map(float, depot))
+    if feuille.last_latitude is not None and feuille.last_longitude is not None:
+        return float(feuille.last_latitude), float(feuille.last_longitude)
+    return None
+
+
+def _donnees_feuilles(feuilles):
+    """Lit en deux requêtes les arrêts des feuilles : ``{feuille_id: (depart, [(livraison_id, lat, lng)])}``."""
+    donnees = {f.pk: (_point_depart(f), []) for f in feuilles}
+    livraisons = Livraison.objects.filter(feuille_id__in=donnees, statut='en_cours').order_by(
+        'feuille_id', F('ordre').asc(nulls_last=True), 'horaire_estime', 'id',
+    ).values_list('feuille_id', 'id', 'client__latitude', 'client__longitude')
+    for feuille_id, livraison_id, lat, lng in livraisons:
+        donnees[feuille_id][1].append((
+            livraison_id,
+            float(lat) if lat is not None else None,
+            float(lng) if lng is not None else None,
+        ))
+    return donnees
+
+
+def _calculer(args):
+    """Calcul pur (sans base de données) d'une feuille : ``[(livraison_id, ordre, horaire)]``."""
+    depart, arrets, heure_depart = args
+    localises = [a for a in arrets if a[1] is not None and a[2] is not None]
+    sans_coordonnees = [a for a in arrets if a[1] is None or a[2] is None]
+    indices, etapes = optimiser_ordre([(lat, lng) for _, lat, lng in localises], depart)
+    estimes = horaires(etapes, heure_depart)
+    resultat = [(localises[i][0], rang, estimes[rang]) for rang, i in enumerate(indices)]
+    resultat += [(a[0], len(resultat) + rang, None) for rang, a in enumerate(sans_coordonnees)]
+    return resultat
+
+
+def optimiser_feuilles(feuilles, heure_depart=HEURE_DEPART, processus=1):
+    """Optimise les livraisons en cours des ``feuilles`` et enregistre ordre et horaires.
+
+    Avec ``processus`` > 1, les calculs sont répartis entre plusieurs processus ;
+    les lectures et l'écriture restent dans le processus appelant. Renvoie le
+    nombre de livraisons réordonnées.
+    """
+    from . import eta, suivi
+
+    donnees = _donnees_feuilles(list(feuilles))
+    taches = [(depart, arrets, heure_depart) for depart, arrets in donnees.values() if arrets]
+    if processus > 1 and len(taches) > 1:
+        with ProcessPoolExecutor(max_workers=processus) as executor:
+            resultats = list(executor.map(_calculer, taches, chunksize=max(1, len(taches) // (processus * 4))))
+    else:
+        resultats = [_calculer(tache) for tache in taches]
+
+    modifiees = []
+    for resultat in resultats:
+        for livraison_id, ordre, horaire in resultat:
+            livraison = Livraison(pk=livraison_id, ordre=ordre + 1)
+            livraison.horaire_estime = horaire
+            modifiees.append(livraison)
+    # Les livraisons sans coordonnées gardent leur horaire saisi
+    avec_horaire = [l for l in modifiees if l.horaire_estime is not None]
+    sans_horaire = [l for l in modifiees if l.horaire_estime is None]
+    with transaction.atomic():
+        Livraison.objects.bulk_update(avec_horaire, ['ordre', 'horaire_estime'], batch_size=1000)
+        Livraison.objects.bulk_update(sans_horaire, ['ordre'], batch_size=1000)
+        eta.arrets_modifies(donnees)
+        # Écriture sans signal : les pages de suivi affichent l'ordre et l'horaire estimé
+        suivi.invalider_livraisons([l.pk for l in modifiees])
+    return len(modifiees)
+
+
+def optimiser_feuille(feuille, heure_depart=HEURE_DEPART):
+    return optimiser_feuilles([feuille], heure_depart)
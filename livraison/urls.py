@@ -7,6 +7,11 @@ urlpatterns = [
     # path('', views.index, name='index'),
     path('feuille/<uuid:token>/', views.feuille_detail, name='feuille_detail'),
     path('feuille/<uuid:token>/position/', views.update_position, name='update_position'),
+    path('feuille/<uuid:token>/positions/', views.update_positions_batch, name='update_positions_batch'),
+    path('feuille/<uuid:token>/qr.png', views.qr_code, name='qr_code'),
+    path('feuille/<uuid:token>/sync/', views.sync_operations, name='sync_operations'),
+    path('sw.js', views.service_worker, name='service_worker'),
     path('livraison/<int:pk>/update/', views.update_livraison_status, name='update_livraison_status'),
     path('track/<uuid:token>/', views.track_livraison, name='track'),
+    path('track/<uuid:token>/flux/', views.track_livraison_flux, name='track_flux'),
 ]
\ No newline at end of file
@@ -1,74 +1,358 @@
 from django.shortcuts import render
 
 # Create your views here.
-from django.http import HttpResponse, JsonResponse, Http404
-from django.shortcuts import get_object_or_404, render, redirect
-from django.utils import timezone
-from django.views.decorators.http import require_POST
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render, redirect
+from django.utils import dateformat, timezone
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST
 from django.views.decorators.csrf import csrf_exempt  # keep CSRF for forms; can exempt GPS endpoint if needed
-from .models import FeuilleDeRoute, Livraison
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from .models import FeuilleDeRoute, Livraison, OperationSync, PositionGPS
+from .diffusion import diffuseur, evenement_sse, sujet_eta, sujet_feuille, sujet_livraison
+from . import eta, positions, suivi
+from .images import CHAMPS_IMAGES, planifier_traitement
+from .signatures import signature_depuis_data_url
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import AnonymousUser
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
 import json
+import uuid
+
+# Nombre maximum de positions acceptées dans un seul envoi groupé
+MAX_POSITIONS_PAR_LOT = 1000
+# Nombre maximum d'opérations hors-ligne synchronisées en un seul envoi
+MAX_OPERATIONS_PAR_LOT = 500
+# Durée de cache navigateur des QR codes (le contenu ne change jamais pour un jeton donné)
+QR_CODE_CACHE_SECONDES = 7 * 24 * 3600
+
+COULEURS_LIVRAISON = {'livre': 'green', 'probleme': 'red'}
+COULEURS_FEUILLE = {'terminee': 'green', 'probleme': 'red'}
 
 # def index(request):
 #     return HttpResponse("Welcome to the Livraison app!")
 
+def sans_session(vue):
+    """Vue authentifiée par le jeton de son URL : utilisateur anonyme, session jamais lue.
+
+    Les positions GPS envoyées chaque minute, la page de la feuille et le suivi
+    public ne lisent ni n'écrivent ainsi django_session (ni son cache), même si
+    le navigateur a aussi une session ouverte sur l'espace chauffeur.
+    """
+    def preparer(request):
+        request.user = AnonymousUser()
+        request.chauffeur = None
+
+    if iscoroutinefunction(vue):
+        @wraps(vue)
+        async def wrapper(request, *args, **kwargs):
+            preparer(request)
+            return await vue(request, *args, **kwargs)
+    else:
+        @wraps(vue)
+        def wrapper(request, *args, **kwargs):
+            preparer(request)
+            return vue(request, *args, **kwargs)
+    return wrapper
+
+def _veut_json(request):
+    """Le navigateur demande une réponse JSON (amélioration progressive) plutôt qu'une redirection."""
+    return 'application/json' in request.headers.get('Accept', '')
+
+def _format_date(valeur):
+    return dateformat.format(timezone.localtime(valeur), 'd/m/Y à H:i') if valeur else None
+
+def _livraison_json(livraison):
+    """Données d'une livraison nécessaires pour rafraîchir son bloc dans la feuille du chauffeur."""
+    return {
+        'id': livraison.id,
+        'statut': livraison.statut,
+        'statut_display': livraison.get_statut_display(),
+        'couleur': COULEURS_LIVRAISON.get(livraison.statut, 'orange'),
+        'date_livraison': _format_date(livraison.date_livraison),
+        'preuve_photo_url': livraison.preuve_photo_miniature_url,
+        'signature_client_url': livraison.signature_client_miniature_url,
+        'signature_tactile_url': livraison.signature_tactile.url if livraison.signature_tactile else None,
+    }
+
+def _suivi_json(livraison):
+    """Statut poussé à la page publique de suivi : ni photos ni signatures."""
+    return {
+        'statut': livraison.statut,
+        'statut_display': livraison.get_statut_display(),
+        'couleur': COULEURS_LIVRAISON.get(livraison.statut, 'orange'),
+        'date_livraison': _format_date(livraison.date_livraison),
+    }
+
+def _publier_statut(livraison):
+    """Pousse le nouveau statut aux pages de suivi ouvertes, une fois la transaction validée."""
+    message = _suivi_json(livraison)
+    transaction.on_commit(lambda: diffuseur.publier(sujet_livraison(livraison.public_token), message))
+
+def _feuille_json(feuille):
+    return {
+        'statut': feuille.statut,
+        'statut_display': feuille.get_statut_display(),
+        'couleur': COULEURS_FEUILLE.get(feuille.statut, 'orange'),
+        'observations_chauffeur': feuille.observations_chauffeur,
+        'date_observations': _format_date(feuille.date_observations),
+    }
+
+@sans_session
 def feuille_detail(request, token):
     feuille = get_object_or_404(FeuilleDeRoute, token=token)
-    livraisons = feuille.livraisons.select_related('client').all().order_by('horaire_estime', 'id')
+    livraisons = feuille.livraisons.select_related('client').prefetch_related('produits', 'sacs').order_by(
+        F('ordre').asc(nulls_last=True), 'horaire_estime', 'id'
+    )
     
     if request.method == 'POST':
         if 'start_route' in request.POST:
             feuille.statut = 'en_route'
             feuille.save(update_fields=['statut'])
-            return redirect('livraison:feuille_detail', token=token)
         elif 'update_observations' in request.POST:
             observations = request.POST.get('observations_chauffeur', '').strip()
             if observations:
                 feuille.observations_chauffeur = observations
                 feuille.date_observations = timezone.now()
                 feuille.save(update_fields=['observations_chauffeur', 'date_observations'])
-            return redirect('livraison:feuille_detail', token=token)
+        if _veut_json(request):
+            return JsonResponse({'ok': True, 'feuille': _feuille_json(feuille)})
+        return redirect('livraison:feuille_detail', token=token)
     
     context = {'feuille': feuille, 'livraisons': livraisons}
     return render(request, 'livraison/feuille_detail.html', context)
 
-@require_POST
-def update_livraison_status(request, pk):
-    livraison = get_object_or_404(Livraison, pk=pk)
-    statut = request.POST.get('statut')
+def _appliquer_mise_a_jour(livraison, statut=None, fichiers=None, signature_tactile='', date_livraison=None):
+    """Applique un changement de statut / preuves à une livraison (sans la sauvegarder)."""
     if statut in dict(livraison._meta.get_field('statut').choices):
         livraison.statut = statut
         if statut == 'livre' and not livraison.date_livraison:
-            livraison.date_livraison = timezone.now()
-    
-    if 'preuve_photo' in request.FILES:
-        livraison.preuve_photo = request.FILES['preuve_photo']
-    if 'signature_client' in request.FILES:
-        livraison.signature_client = request.FILES['signature_client']
-    if 'signature_tactile' in request.POST:
-        signature_tactile = request.POST.get('signature_tactile', '').strip()
-        if signature_tactile:
-            livraison.signature_tactile = signature_tactile
+            livraison.date_livraison = date_livraison or timezone.now()
     
+    fichiers = fichiers or {}
+    if fichiers.get('preuve_photo'):
+        livraison.preuve_photo = fichiers['preuve_photo']
+    if fichiers.get('signature_client'):
+        livraison.signature_client = fichiers['signature_client']
+    fichier = signature_depuis_data_url(signature_tactile)
+    if fichier is not None:
+        livraison.signature_tactile.save(f'signature_{livraison.pk}.png', fichier, save=False)
+
+@sans_session
+@require_POST
+def update_livraison_status(request, pk):
+    livraison = get_object_or_404(Livraison, pk=pk)
+    ancien_statut = livraison.statut
+    _appliquer_mise_a_jour(
+        livraison,
+        statut=request.POST.get('statut'),
+        fichiers=request.FILES,
+        signature_tactile=request.POST.get('signature_tactile', ''),
+    )
     livraison.save()
+    planifier_traitement(livraison, request.FILES.keys())
+    if livraison.statut != ancien_statut:
+        _publier_statut(livraison)
+    if _veut_json(request):
+        return JsonResponse({'ok': True, 'livraison': _livraison_json(livraison)})
     return redirect('livraison:feuille_detail', token=livraison.feuille.token)
 
+@sans_session
+@require_POST
+def sync_operations(request, token):
+    """Applique en une transaction les mises à jour de livraisons mises en file hors-ligne.
+
+    Le corps est multipart : un champ ``operations`` (liste JSON de
+    ``{id, livraison, statut, signature_tactile, timestamp}``) et, pour chaque
+    opération, des fichiers optionnels ``preuve_photo_<id>`` / ``signature_client_<id>``.
+    Les identifiants d'opération sont générés par le navigateur ; une opération
+    déjà appliquée est ignorée, ce qui rend les renvois sans effet.
+    """
+    feuille = get_object_or_404(FeuilleDeRoute.objects.only('pk'), token=token)
+    try:
+        operations = json.loads(request.POST['operations'])
+        ids = [str(uuid.UUID(str(op['id']))) for op in operations]
+        livraison_ids = {int(op['livraison']) for op in operations}
+        dates = [_date_navigateur(op.get('timestamp')) for op in operations]
+    except (KeyError, ValueError, TypeError, OverflowError, OSError):
+        return JsonResponse({'ok': False, 'error': 'operations required'}, status=400)
+    if len(operations) > MAX_OPERATIONS_PAR_LOT:
+        return JsonResponse({'ok': False, 'error': f'max {MAX_OPERATIONS_PAR_LOT} operations'}, status=400)
+
+    livraisons = feuille.livraisons.in_bulk(livraison_ids)
+    if len(livraisons) != len(livraison_ids):
+        return JsonResponse({'ok': False, 'error': 'unknown livraison'}, status=400)
+    anciens_statuts = {pk: livraison.statut for pk, livraison in livraisons.items()}
+
+    with transaction.atomic():
+        deja_appliquees = {str(op_id) for op_id in OperationSync.objects.filter(
+            operation_id__in=ids
+        ).values_list('operation_id', flat=True)}
+        appliquees, modifiees, images = [], {}, {}
+        for op_id, op, date_livraison in zip(ids, operations, dates):
+            if op_id in deja_appliquees or op_id in appliquees:
+                continue
+            livraison = livraisons[int(op['livraison'])]
+            _appliquer_mise_a_jour(
+                livraison,
+                statut=op.get('statut'),
+                fichiers={
+                    'preuve_photo': request.FILES.get(f'preuve_photo_{op_id}'),
+                    'signature_client': request.FILES.get(f'signature_client_{op_id}'),
+                },
+                signature_tactile=op.get('signature_tactile', ''),
+                date_livraison=date_livraison,
+            )
+            modifiees[livraison.pk] = livraison
+            images.setdefault(livraison.pk, set()).update(
+                champ for champ in CHAMPS_IMAGES if f'{champ}_{op_id}' in request.FILES
+            )
+            appliquees.append(op_id)
+        for livraison in modifiees.values():
+            livraison.save()
+            planifier_traitement(livraison, images[livraison.pk])
+            if livraison.statut != anciens_statuts[livraison.pk]:
+                _publier_statut(livraison)
+        OperationSync.objects.bulk_create([
+            OperationSync(operation_id=op_id, feuille=feuille, livraison_id=int(op['livraison']))
+            for op_id, op in zip(ids, operations) if op_id in appliquees
+        ])
+
+    return JsonResponse({'ok': True, 'appliquees': appliquees, 'ignorees': sorted(set(ids) - set(appliquees))})
+
+@sans_session
+def service_worker(request):
+    """Service worker du mode hors-ligne, servi sous /livraison/ pour couvrir les feuilles de route."""
+    return render(request, 'livraison/sw.js', content_type='application/javascript')
+
+def _date_navigateur(timestamp):
+    """Horodatage du navigateur (millisecondes depuis l'epoch), borné à maintenant."""
+    if not timestamp:
+        return None
+    return min(datetime.fromtimestamp(float(timestamp) / 1000, tz=dt_timezone.utc), timezone.now())
+
+def _lire_position(fix):
+    """Convertit un point {lat, lng, accuracy, timestamp} envoyé par le navigateur en PositionGPS (non sauvegardée)."""
+    lat = float(fix['lat'])
+    lng = float(fix['lng'])
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('lat/lng hors limites')
+    accuracy = fix.get('accuracy')
+    return PositionGPS(
+        latitude=round(lat, 6),
+        longitude=round(lng, 6),
+        precision=float(accuracy) if accuracy not in (None, '') else None,
+        date_position=_date_navigateur(fix.get('timestamp')) or timezone.now(),
+    )
+
+@sans_session
 @require_POST
 def update_position(request, token):
-    feuille = get_object_or_404(FeuilleDeRoute, token=token)
+    feuille = get_object_or_404(FeuilleDeRoute.objects.only(*positions.CHAMPS_POSITION), token=token)
     lat = request.POST.get('lat') or request.GET.get('lat')
     lng = request.POST.get('lng') or request.GET.get('lng')
     if not lat or not lng:
         return JsonResponse({'ok': False, 'error': 'lat/lng required'}, status=400)
     try:
-        feuille.last_latitude = float(lat)
-        feuille.last_longitude = float(lng)
-        feuille.last_position_at = timezone.now()
-        feuille.save(update_fields=['last_latitude', 'last_longitude', 'last_position_at'])
-        return JsonResponse({'ok': True})
+        position = _lire_position({'lat': lat, 'lng': lng, 'accuracy': request.POST.get('accuracy')})
     except ValueError:
         return JsonResponse({'ok': False, 'error': 'invalid lat/lng'}, status=400)
+    positions.tampon.ajouter(feuille, [position])
+    return JsonResponse({'ok': True})
 
+@sans_session
+@require_POST
+def update_positions_batch(request, token):
+    """Reçoit en un seul POST JSON les positions mises en tampon par le navigateur du chauffeur."""
+    feuille = get_object_or_404(FeuilleDeRoute.objects.only(*positions.CHAMPS_POSITION), token=token)
+    try:
+        fixes = json.loads(request.body)['positions']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'ok': False, 'error': 'positions required'}, status=400)
+    if not isinstance(fixes, list) or not fixes:
+        return JsonResponse({'ok': False, 'error': 'positions required'}, status=400)
+    if len(fixes) > MAX_POSITIONS_PAR_LOT:
+        return JsonResponse({'ok': False, 'error': f'max {MAX_POSITIONS_PAR_LOT} positions'}, status=400)
+    try:
+        lues = [_lire_position(fix) for fix in fixes]
+    except (ValueError, KeyError, TypeError, OverflowError, OSError):
+        return JsonResponse({'ok': False, 'error': 'invalid lat/lng'}, status=400)
+    positions.tampon.ajouter(feuille, lues)
+    return JsonResponse({'ok': True, 'count': len(lues)})
+
+@sans_session
+def qr_code(request, token):
+    """QR code de la feuille, généré à la première demande puis servi depuis le disque."""
+    feuille = get_object_or_404(FeuilleDeRoute.objects.only('pk', 'token', 'qr_code'), token=token)
+    if not feuille.qr_code or not feuille.qr_code.storage.exists(feuille.qr_code.name):
+        if not feuille.generer_qr_code():
+            raise Http404("QR code indisponible")
+    response = FileResponse(feuille.qr_code.open('rb'), content_type='image/png')
+    # Le jeton d'une feuille ne change jamais : le QR code peut rester en cache côté navigateur
+    patch_cache_control(response, public=True, max_age=QR_CODE_CACHE_SECONDES)
+    return response
+
+def _versions_suivi(request, token):
+    # Calculées une fois par requête, pour l'ETag, le Last-Modified et la clé de cache
+    if not hasattr(request, '_versions_suivi'):
+        request._versions_suivi = suivi.versions(token)
+    return request._versions_suivi
+
+def _etag_suivi(request, token):
+    versions = _versions_suivi(request, token)
+    return versions and suivi.etag(token, versions)
+
+def _date_suivi(request, token):
+    versions = _versions_suivi(request, token)
+    return versions and suivi.derniere_modification(versions)
+
+@sans_session
+@condition(etag_func=_etag_suivi, last_modified_func=_date_suivi)
 def track_livraison(request, token):
-    livraison = get_object_or_404(Livraison, public_token=token)
-    return render(request, 'livraison/track.html', {'livraison': livraison})
+    """Page publique de suivi : 304 si rien n'a changé, sinon page servie depuis le cache si possible."""
+    versions = _versions_suivi(request, token)
+    page = cache.get(suivi.cle_page(token, versions)) if versions else None
+    if page is None:
+        livraison = get_object_or_404(
+            Livraison.objects.select_related('client', 'feuille').prefetch_related('produits', 'sacs'),
+            public_token=token,
+        )
+        page = render_to_string('livraison/track.html', {'livraison': livraison, 'eta': eta.eta_livraison(livraison)}, request)
+        if versions:
+            cache.set(suivi.cle_page(token, versions), page, suivi.duree_cache())
+    response = HttpResponse(page)
+    # Le navigateur garde la page mais la revalide à chaque visite (ETag / Last-Modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@sans_session
+async def track_livraison_flux(request, token):
+    """Flux server-sent events du suivi public : statut et ETA de la livraison, heure de position de sa feuille.
+
+    Une seule requête à l'ouverture du flux ; ensuite, rien n'est lu en base,
+    les messages sont poussés par les vues qui modifient le statut ou la position.
+    """
+    livraison = await aget_object_or_404(Livraison.objects.only('id', 'feuille_id'), public_token=token)
+    evenements = {
+        sujet_livraison(token): 'statut',
+        sujet_feuille(livraison.feuille_id): 'position',
+        sujet_eta(token): 'eta',
+    }
+
+    async def flux():
+        yield 'retry: 5000\n\n'
+        async for recu in diffuseur.ecouter(*evenements):
+            if recu is None:
+                yield evenement_sse(None)
+            else:
+                sujet, message = recu
+                yield evenement_sse(message, event=evenements[sujet])
+
+    response = StreamingHttpResponse(flux(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
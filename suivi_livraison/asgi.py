@@ -3,6 +3,10 @@ ASGI config for suivi_livraison project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live streams (server-sent events of the fleet map) are async views and
+must be served through this application by an ASGI server, e.g.
+``uvicorn suivi_livraison.asgi:application``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
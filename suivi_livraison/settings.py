@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,6 +51,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chauffeur.middleware.ChauffeurMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,13 +79,87 @@ WSGI_APPLICATION = 'suivi_livraison.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL si DB_ENGINE=postgresql (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST,
+# DB_PORT), SQLite sinon. Avec DB_PROFIL=production, SQLite est réglé pour les
+# écritures concurrentes (PRAGMA posés à chaque connexion, voir livraison.sqlite) ;
+# pas en développement ni en test : le mode WAL réécrit l'en-tête du fichier
+# db.sqlite3 versionné. Les connexions sont gardées DB_CONN_MAX_AGE secondes
+# d'une requête à l'autre.
+SQLITE_PROFIL_PRODUCTION = os.environ.get('DB_PROFIL') == 'production'
+
+if os.environ.get('DB_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'suivi_livraison'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Verrou d'écriture pris au début de la transaction (Django 5.1+)
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
     }
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Mémoire locale bornée à MAX_ENTRIES (un tiers des entrées évincé quand elle est
+# pleine). Avec plusieurs workers, utiliser un cache partagé, par exemple
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379',
+# (taille bornée par maxmemory côté serveur) ou FileBasedCache avec un dossier en LOCATION.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'suivi-livraison',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 3,
+        },
+    },
+    # Sessions à part : les pages de suivi et les ETA ne les évincent pas
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'suivi-livraison-sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
 }
 
+# Stockage des sessions (variable d'environnement SESSION_STOCKAGE) :
+# - 'cached_db' (défaut) : lues dans le cache, écrites en base seulement quand
+#   elles changent (connexion, message) ; une entrée évincée est relue en base ;
+# - 'signed_cookies' : tout dans le cookie signé, aucune lecture ni écriture serveur ;
+# - 'cache' : cache seul (sessions perdues au redémarrage avec LocMemCache) ;
+# - 'db' : base seule, comportement par défaut de Django.
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get('SESSION_STOCKAGE', 'cached_db')
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Durée de vie des pages publiques de suivi et de leurs versions dans le cache.
+# Courte tant que le cache est propre à chaque processus : les invalidations d'un
+# worker ne sont pas vues des autres. Avec un cache partagé, 24 * 3600 convient.
+SUIVI_CACHE_SECONDES = 60
+
+
+# Les chauffeurs (et leur utilisateur) sont servis depuis le cache à chaque requête.
+# ModelBackend reste listé : les sessions ouvertes avant ChauffeurBackend restent valides.
+AUTHENTICATION_BACKENDS = ['chauffeur.acces.ChauffeurBackend', 'django.contrib.auth.backends.ModelBackend']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -125,6 +201,26 @@ STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+# Photos de preuve et signatures envoyées par les chauffeurs : EXIF retiré,
+# redimensionnement et miniatures WebP dans un thread de fond (False : dans la requête)
+IMAGES_TRAITEMENT_ASYNCHRONE = True
+
+# Positions GPS des chauffeurs (voir livraison.positions) : un point à moins de
+# POSITIONS_DISTANCE_MIN_M mètres du précédent, reçu moins de POSITIONS_DELAI_MAX_S
+# secondes après lui, est ignoré ; les autres sont écrits par lots toutes les
+# POSITIONS_INTERVALLE_ECRITURE_S secondes (0 : dans la requête)
+POSITIONS_DISTANCE_MIN_M = 25
+POSITIONS_DELAI_MAX_S = 300
+POSITIONS_INTERVALLE_ECRITURE_S = 5
+
+# Point de départ des tournées (latitude, longitude) pour l'optimisation de
+# l'ordre de passage ; None : dernière position connue de la feuille
+TOURNEE_DEPOT = None
+
+# Gazetteer local (CSV nom, latitude, longitude) pour géocoder les adresses
+# clients sans service externe ; None : pas de géocodage
+GEOCODAGE_GAZETTEER = None
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
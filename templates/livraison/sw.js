@@ -0,0 +1,37 @@
+// templates/livraison/sw.js
+// Service worker du mode hors-ligne : garde une copie des feuilles de route
+// consultées pour pouvoir les rouvrir sans réseau.
+const CACHE = 'feuilles-v1';
+
+self.addEventListener('install', event => {
+  self.skipWaiting();
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(noms => Promise.all(noms.filter(nom => nom !== CACHE).map(nom => caches.delete(nom))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  const estFeuille = request.method === 'GET' && request.mode === 'navigate'
+    && /^\/livraison\/feuille\/[0-9a-f-]+\/$/.test(url.pathname);
+  if (!estFeuille) return;
+
+  // Réseau d'abord, copie en cache en secours
+  event.respondWith(
+    fetch(request)
+      .then(response => {
+        if (response.ok) {
+          const copie = response.clone();
+          caches.open(CACHE).then(cache => cache.put(url.pathname, copie));
+        }
+        return response;
+      })
+      .catch(() => caches.match(url.pathname))
+  );
+});